@@ -1,4 +1,4 @@
-from pyrocko import pile, io, util
+from pyrocko import pile, io, util, trace
 import time, calendar
 
 # when pile.make_pile() is called without any arguments, the command line 
@@ -9,20 +9,18 @@ p = pile.make_pile()
 tmin = calendar.timegm( time.gmtime(p.tmin)[:4] + ( 0, 0 ) )
 
 tinc = 3600.
-tpad = 10.
 target_deltat = 0.1
 
-# iterate over the data, with a window length of one hour and 2x10 seconds of
-# overlap
-for traces in p.chopper(tmin=tmin, tinc=tinc, tpad=tpad):
+# the filter chain keeps the state of the anti-aliasing filters of each
+# channel from one window to the next, so no overlapping windows are needed
+chain = trace.FilterChain()
+chain.add_downsample_to(target_deltat, snap=True)
+
+# iterate over the data, with a window length of one hour
+for traces in p.chopper(tmin=tmin, tinc=tinc):
     
+    traces = chain.process(traces)
     if traces: # the list could be empty due to gaps
-        for tr in traces:
-            tr.downsample_to(target_deltat, snap=True, demean=False)
-            
-            # remove overlapping
-            tr.chop(tr.wmin, tr.wmax)
-        
         window_start = traces[0].wmin
         timestring = util.time_to_str(window_start, format='%Y-%m-%d_%H')
         filepath = 'downsampled/%(station)s_%(channel)s_%(mytimestring)s.mseed'
@@ -2,3 +2,8 @@
 
 show_progress = True
 earthradius = 6371.*1000.
+cache_backend = 'pickle'
+pile_data_cache_size = 0
+pile_data_cache_max_mapped = 64
+pile_partial_read_fraction = 0.1
+pile_dispatch = 'month'
@@ -198,29 +198,31 @@ class EventDataAccess:
                     continue
                 traces.append(tr)
                                
-            traces.sort( lambda a,b: cmp(a.full_id, b.full_id) )
+            traces.sort(key=lambda tr: tr.full_id)
             
             traces = trace.degapper(traces)  # mainly to get rid if overlaps and duplicates
             if traces:
                 nsl = traces[0].nslc_id[:3]
                 station = stations[nsl] # all traces belong to the same station here
                 
-                displacements = []
                 for tr in traces:
-                   
                     if preprocess is not None:
                         preprocess(tr)
 
                     tr.ydata = tr.ydata - num.mean(tr.ydata)
-                    
-                    if deltat is not None:
-                        try:
-                            tr.downsample_to(deltat, snap=True, allow_upsample_max=5)
-                        except util.UnavailableDecimation, e:
-                            self.problems().add('cannot_downsample', tr.full_id)
-                            logger.warn( 'Cannot downsample %s.%s.%s.%s: %s' % (tr.nslc_id + (e,)))
-                            continue
-                        
+
+                if deltat is not None:
+                    # channels of a station usually share sampling and length: downsample in batches
+                    failed = trace.downsample_to_many(traces, deltat, snap=True, allow_upsample_max=5)
+                    for tr, e in failed:
+                        self.problems().add('cannot_downsample', tr.full_id)
+                        logger.warn( 'Cannot downsample %s.%s.%s.%s: %s' % (tr.nslc_id + (e,)))
+
+                    failed_ids = set([ id(tr) for (tr, e) in failed ])
+                    traces = [ tr for tr in traces if id(tr) not in failed_ids ]
+
+                displacements = []
+                for tr in traces:
                     try:
                         trans = self.get_restitution(tr, allowed_methods)
                     except NoRestitution, e:
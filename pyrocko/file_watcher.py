@@ -0,0 +1,275 @@
+'''Watch directory trees for added, modified and removed files.
+
+On Linux, the kernel's inotify interface is used (through ctypes), so that
+watching costs nothing while nothing changes. Elsewhere, or if inotify is not
+available, a fallback implementation periodically compares file modification
+times.
+'''
+
+import os, errno, struct, logging, ctypes, ctypes.util
+
+logger = logging.getLogger('pyrocko.file_watcher')
+
+class FileWatcherError(Exception):
+    pass
+
+def _abspaths(paths):
+    if isinstance(paths, str):
+        paths = [ paths ]
+
+    return [ os.path.abspath(path) for path in paths ]
+
+class FileWatcher(object):
+    '''Base class for file watchers.
+
+    :param paths: files and/or directories to watch. Directories are watched
+        recursively.
+    '''
+
+    def __init__(self, paths):
+        self._roots = _abspaths(paths)
+        self._dir_roots = [ path for path in self._roots if os.path.isdir(path) ]
+        self._file_roots = set( path for path in self._roots if path not in self._dir_roots )
+
+    def is_watched(self, path):
+        '''Check if path is inside of the watched trees.'''
+
+        if path in self._file_roots:
+            return True
+
+        for root in self._dir_roots:
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return True
+
+        return False
+
+    def _watched_dirs(self):
+        dirs = set()
+        for path in self._file_roots:
+            dirs.add(os.path.dirname(path))
+
+        for root in self._dir_roots:
+            for (dirpath, dirnames, filenames) in os.walk(root):
+                dirs.add(dirpath)
+
+        return dirs
+
+    def poll(self):
+        '''Get changes since the last call.
+
+        :returns: tuple ``(changed, removed)`` with sets of absolute paths of
+            new or modified files and removed files or directories, or None,
+            if the watcher lost track and the caller should rescan everything.
+        '''
+        assert False, 'should be implemented in derived class'
+
+    def close(self):
+        pass
+
+class PollingFileWatcher(FileWatcher):
+    '''File watcher comparing modification times on each call to :py:meth:`poll`.'''
+
+    def __init__(self, paths):
+        FileWatcher.__init__(self, paths)
+        self._mtimes = self._scan()
+
+    def _scan(self):
+        mtimes = {}
+        for path in self._file_roots:
+            try:
+                mtimes[path] = os.stat(path)[8]
+            except OSError:
+                pass
+
+        for root in self._dir_roots:
+            for (dirpath, dirnames, filenames) in os.walk(root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        mtimes[path] = os.stat(path)[8]
+                    except OSError:
+                        pass
+
+        return mtimes
+
+    def poll(self):
+        mtimes = self._scan()
+        changed = set( path for (path, mtime) in mtimes.iteritems() if self._mtimes.get(path) != mtime )
+        removed = set( path for path in self._mtimes if path not in mtimes )
+        self._mtimes = mtimes
+        return changed, removed
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0x00080000
+
+_inotify_mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+                IN_DELETE_SELF | IN_MOVE_SELF
+
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.inotify_init1
+            libc.inotify_add_watch
+            libc.inotify_rm_watch
+        except (OSError, AttributeError), e:
+            raise FileWatcherError('inotify is not available: %s' % e)
+
+        libc.inotify_add_watch.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+        _libc = libc
+
+    return _libc
+
+class InotifyFileWatcher(FileWatcher):
+    '''File watcher using the Linux inotify interface.'''
+
+    _event_header = struct.Struct('iIII')
+
+    def __init__(self, paths):
+        self._fd = None
+        FileWatcher.__init__(self, paths)
+        self._libc = _get_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise FileWatcherError('inotify_init1 failed: %s' % os.strerror(ctypes.get_errno()))
+
+        self._wd_to_dir = {}
+        self._changed = set()
+        self._removed = set()
+        self._lost = False
+        for dirpath in self._watched_dirs():
+            self._add_watch(dirpath)
+
+    def _add_watch(self, dirpath):
+        wd = self._libc.inotify_add_watch(self._fd, dirpath, _inotify_mask | IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+
+            raise FileWatcherError('cannot watch directory %s: %s' % (dirpath, os.strerror(err)))
+
+        self._wd_to_dir[wd] = dirpath
+
+    def _add_tree(self, dirpath):
+        '''Start watching new directory tree, reporting the files in it as new.'''
+
+        for (dpath, dirnames, filenames) in os.walk(dirpath):
+            self._add_watch(dpath)
+            for filename in filenames:
+                self._changed.add(os.path.join(dpath, filename))
+
+    def _read_events(self):
+        while True:
+            try:
+                buf = os.read(self._fd, 65536)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return
+
+                raise
+
+            if not buf:
+                return
+
+            pos = 0
+            hsize = self._event_header.size
+            while pos < len(buf):
+                wd, mask, cookie, namelen = self._event_header.unpack_from(buf, pos)
+                name = buf[pos+hsize:pos+hsize+namelen].rstrip('\0')
+                pos += hsize + namelen
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.warn('inotify event queue overflow, changes may have been lost')
+            self._lost = True
+            return
+
+        if mask & IN_IGNORED:
+            self._wd_to_dir.pop(wd, None)
+            return
+
+        dirpath = self._wd_to_dir.get(wd)
+        if dirpath is None or not name:
+            return
+
+        path = os.path.join(dirpath, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if self.is_watched(path):
+                    self._add_tree(path)
+
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._removed.add(path)
+
+            return
+
+        if not self.is_watched(path):
+            return
+
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self._changed.discard(path)
+            self._removed.add(path)
+
+        elif mask & (IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._removed.discard(path)
+            self._changed.add(path)
+
+    def poll(self):
+        self._read_events()
+        if self._lost:
+            self._lost = False
+            self._changed, self._removed = set(), set()
+            return None
+
+        changed, removed = self._changed, self._removed
+        self._changed, self._removed = set(), set()
+        return changed, removed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+def get_file_watcher(paths, backend=None):
+    '''Get a file watcher for the given paths.
+
+    :param paths: files and/or directories to watch
+    :param backend: ``'inotify'``, ``'polling'`` or None to use inotify if
+        available and fall back to polling otherwise
+    '''
+
+    if backend in (None, 'inotify'):
+        try:
+            return InotifyFileWatcher(paths)
+        except FileWatcherError, e:
+            if backend == 'inotify':
+                raise
+
+            logger.info('%s, falling back to polling' % e)
+
+    elif backend != 'polling':
+        raise FileWatcherError('unknown file watcher backend: %s' % backend)
+
+    return PollingFileWatcher(paths)
+
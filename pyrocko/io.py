@@ -17,6 +17,7 @@ SEG Y rev1   segy                        some
 SEISAN       seisan, seisan_l, seisan_b  yes                [#f2]_
 KAN          kan                         yes                [#f3]_
 YAFF         yaff                        yes       yes      [#f4]_
+MMTR         mmtrace                     yes       yes      [#f6]_
 ASCII Table  text                                  yes      [#f5]_
 ============ =========================== ========= ======== ======
 
@@ -27,10 +28,11 @@ ASCII Table  text                                  yes      [#f5]_
 .. [#f3] The KAN file format has only been seen once by the author, and support for it may be removed again.
 .. [#f4] YAFF is an in-house, experimental file format, which should not be released into the wild.
 .. [#f5] ASCII tables with two columns (time and amplitude) are output - meta information will be lost.
+.. [#f6] MMTR is an uncompressed format with page-aligned data blocks, see :py:mod:`pyrocko.mmtrace`. When loading, the data of the traces are read-only memory maps into the file.
 '''
 
 import os
-import mseed, sac, kan, segy, yaff, file, seisan_waveform, util
+import mseed, sac, kan, segy, yaff, mmtrace, file, seisan_waveform, util
 import trace
 from pyrocko.mseed_ext import MSeedError
 import numpy as num
@@ -38,7 +40,7 @@ import numpy as num
 def load(filename, format='mseed', getdata=True, substitutions=None ):
     '''Load traces from file.
 
-    :param format: format of the file (``'mseed'``, ``'sac'``, ``'segy'``, ``'seisan_l'``, ``'seisan_b'``, ``'kan'``, ``'yaff'``, ``'from_extension'``, or ``'try'``)
+    :param format: format of the file (``'mseed'``, ``'sac'``, ``'segy'``, ``'seisan_l'``, ``'seisan_b'``, ``'kan'``, ``'yaff'``, ``'mmtrace'``, ``'from_extension'``, or ``'try'``)
     :param getdata: if ``True`` (the default), read data, otherwise only read traces metadata
     :param substitutions:  dict with substitutions to be applied to the traces metadata
     
@@ -46,7 +48,7 @@ def load(filename, format='mseed', getdata=True, substitutions=None ):
     
     When *format* is set to ``'try'``, this function tries to read the files in Mini-SEED, SAC, and YAFF format.
     When *format* is set to ``'from_extension'``, the filename extension is used to decide what format should be assumed. The filename extensions
-    considered are (matching is case insensitiv): ``'.sac'``, ``'.kan'``, ``'.sgy'``, ``'.segy'``, ``'.yaff'``, everything else is assumed to be in Mini-SEED format.
+    considered are (matching is case insensitiv): ``'.sac'``, ``'.kan'``, ``'.sgy'``, ``'.segy'``, ``'.yaff'``, ``'.mmtr'``, everything else is assumed to be in Mini-SEED format.
     
     This function calls :py:func:`iload` and aggregates the loaded traces in a list.
     '''
@@ -74,6 +76,8 @@ def iload(filename, format='mseed', getdata=True, substitutions=None ):
             format = 'segy'
         elif extension.lower() == '.yaff':
             format = 'yaff' 
+        elif extension.lower() == '.mmtr':
+            format = 'mmtrace'
 
     if format in ('seisan', 'seisan_l', 'seisan_b'):
         endianness = {'seisan_l' : '<', 'seisan_b' : '>', 'seisan' : '<'}[format]
@@ -111,6 +115,14 @@ def iload(filename, format='mseed', getdata=True, substitutions=None ):
             else:
                 raise FileLoadError(e)
             
+    if format in ('mmtrace',):
+        try:
+            for tr in mmtrace.load(filename, getdata):
+                yield subs(tr)
+
+        except (OSError, IOError, mmtrace.MMTraceError), e:
+            raise FileLoadError(e)
+
     if format in ('sac', 'try'):
         mtime = os.stat(filename)[8]
         try:
@@ -133,7 +145,8 @@ def iload(filename, format='mseed', getdata=True, substitutions=None ):
         except (OSError, MSeedError), e:
             raise FileLoadError(e)
     
-def save(traces, filename_template, format='mseed', additional={}, stations=None):
+def save(traces, filename_template, format='mseed', additional={}, stations=None, 
+         reclen=4096, encoding=None):
     '''Save traces to file(s).
     
     :param traces: list or iterable of traces to store
@@ -144,8 +157,11 @@ def save(traces, filename_template, format='mseed', additional={}, stations=None
             sample), ``tmin_ms``, ``tmax_ms``, ``tmin_us``, ``tmax_us``. The
             versions with '_ms' include milliseconds, the versions with '_us'
             include microseconds.
-    :param format: ``mseed``, ``sac``, ``text``, or ``yaff``.
+    :param format: ``mseed``, ``sac``, ``text``, ``yaff``, or ``mmtrace``.
     :param additional: dict with custom template placeholder fillins.
+    :param reclen: record length in bytes (``mseed`` only)
+    :param encoding: data encoding, e.g. ``'steim1'`` or ``'steim2'``, see
+            :py:data:`pyrocko.mseed.encodings` (``mseed`` only)
     :returns: list of generated filenames
 
     .. note:: 
@@ -155,9 +171,11 @@ def save(traces, filename_template, format='mseed', additional={}, stations=None
 
     if format == 'from_extension':
         format = os.path.splitext(filename_template)[1][1:]
+        if format == 'mmtr':
+            format = 'mmtrace'
 
     if format == 'mseed':
-        return mseed.save(traces, filename_template, additional)
+        return mseed.save(traces, filename_template, additional, reclen=reclen, encoding=encoding)
     
     elif format == 'sac':
         fns = []
@@ -189,6 +207,10 @@ def save(traces, filename_template, format='mseed', additional={}, stations=None
             
     elif format == 'yaff':
         return yaff.save(traces, filename_template, additional)
+
+    elif format == 'mmtrace':
+        return mmtrace.save(traces, filename_template, additional)
+
     else:
         raise UnknownFormat(format)
 
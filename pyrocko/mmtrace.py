@@ -0,0 +1,195 @@
+'''File IO module for the uncompressed, memory-mappable MMTR traces format.
+
+A file consists of a sequence of trace records. Each record has a fixed-size
+little endian header, followed by the network, station, location and channel
+codes, padding, and the raw samples in little endian byte order. The samples
+of each record start at a file offset which is a multiple of
+:py:data:`page_size`, so that they can be mapped into memory directly.
+
+When loading with *mmap* enabled (the default), the ``ydata`` of the returned
+traces are read-only :py:class:`numpy.memmap` arrays. Nothing is decoded or
+read into memory until the data is accessed, and only the pages which are
+touched are read by the operating system.
+
+Files are written to a temporary file first, which is then renamed to the
+final name. This way, existing memory maps of an older version of a file stay
+valid when the file is rewritten.
+'''
+
+import os, struct
+import numpy as num
+
+import trace
+from nano import Nano, G
+from util import ensuredirs
+
+page_size = 4096
+
+_magic = 'MMTR'
+_version = '0001'
+
+# magic, version, size of codes block, number of samples, dtype, seconds part
+# of tmin, fractional part of tmin, sampling interval
+_header = struct.Struct('<4s4sIQ8sqdd')
+
+_dtypes = dict( (num.dtype(t).newbyteorder('<').str, num.dtype(t)) for t in
+                (num.int8, num.int16, num.int32, num.int64, num.float32, num.float64) )
+
+class MMTraceError(Exception):
+    pass
+
+def _aligned(offset):
+    return ((offset + page_size - 1) // page_size) * page_size
+
+def _split_time(t):
+    if isinstance(t, Nano):
+        return t.v // G, float(t.v % G) / G
+    else:
+        s = num.floor(t)
+        return int(s), t - s
+
+def _join_time(s, frac, deltat):
+    if deltat < 0.001:
+        return Nano(s, ns=int(round(frac*G)))
+    else:
+        return s + frac
+
+def iload_headers(fn):
+    '''Read trace headers of a file.
+
+    :returns: iterator yielding tuples ``(tr, offset, dtype, nsamples)`` with
+        a dataless :py:class:`trace.Trace`, the file offset of its samples,
+        their data type and their number
+    '''
+
+    f = open(fn, 'rb')
+    try:
+        offset = 0
+        filesize = os.fstat(f.fileno()).st_size
+        while offset < filesize:
+            f.seek(offset)
+            data = f.read(_header.size)
+            if len(data) != _header.size:
+                raise MMTraceError('%s: incomplete record header at offset %i' % (fn, offset))
+
+            magic, version, ncodes, nsamples, dtype_str, tmin_s, tmin_frac, deltat = _header.unpack(data)
+            if magic != _magic:
+                raise MMTraceError('%s: not an MMTR file or corrupt record at offset %i' % (fn, offset))
+
+            if version != _version:
+                raise MMTraceError('%s: MMTR version %s not supported' % (fn, version))
+
+            dtype_str = dtype_str.rstrip('\0')
+            if dtype_str not in _dtypes:
+                raise MMTraceError('%s: unsupported data type %s' % (fn, dtype_str))
+
+            codes = f.read(ncodes).split('\0')
+            if len(codes) != 4:
+                raise MMTraceError('%s: invalid codes block at offset %i' % (fn, offset))
+
+            dtype = num.dtype(dtype_str)
+            data_offset = _aligned(offset + _header.size + ncodes)
+            data_end = data_offset + nsamples * dtype.itemsize
+            if data_end > filesize:
+                raise MMTraceError('%s: truncated data in record at offset %i' % (fn, offset))
+
+            tmin = _join_time(tmin_s, tmin_frac, deltat)
+            network, station, location, channel = codes
+            tr = trace.Trace(network, station, location, channel, tmin=tmin,
+                             tmax=tmin + (nsamples-1)*deltat, deltat=deltat)
+
+            yield tr, data_offset, dtype, nsamples
+
+            offset = data_end
+    finally:
+        f.close()
+
+def load(fn, load_data=True, mmap=True):
+    '''Load traces from an MMTR file.
+
+    :param load_data: whether to attach the data to the traces
+    :param mmap: if ``True``, the data are read-only memory maps into the
+        file, otherwise they are read into memory
+
+    With *mmap*, the file is mapped once and the data of all traces are views
+    into this one map, so that a single file descriptor is held per file, as
+    long as any of the data is referenced.
+    '''
+
+    mtime = os.stat(fn)[8]
+    records = list(iload_headers(fn))
+    buf = None
+    if load_data and mmap and any( nsamples > 0 for (tr, data_offset, dtype, nsamples) in records ):
+        buf = num.memmap(fn, dtype=num.uint8, mode='r')
+
+    for tr, data_offset, dtype, nsamples in records:
+        tr.set_mtime(mtime)
+        if load_data:
+            if mmap:
+                if nsamples > 0:
+                    ydata = buf[data_offset:data_offset+nsamples*dtype.itemsize].view(dtype)
+                else:
+                    ydata = num.zeros(0, dtype=dtype)
+            else:
+                f = open(fn, 'rb')
+                f.seek(data_offset)
+                ydata = num.fromfile(f, dtype=dtype, count=nsamples)
+                f.close()
+                if not ydata.dtype.isnative:
+                    ydata = ydata.astype(ydata.dtype.newbyteorder('='))
+
+            tr.ydata = ydata
+
+        yield tr
+
+def _write_trace(f, tr):
+    ydata = tr.get_ydata()
+    dtype = ydata.dtype.newbyteorder('<')
+    if dtype.str not in _dtypes:
+        raise MMTraceError('unsupported data type for MMTR format: %s' % ydata.dtype)
+
+    codes = '\0'.join(tr.nslc_id)
+    tmin_s, tmin_frac = _split_time(tr.tmin)
+    offset = f.tell()
+    f.write(_header.pack(_magic, _version, len(codes), ydata.size, dtype.str, tmin_s, tmin_frac, tr.deltat))
+    f.write(codes)
+    f.write('\0' * (_aligned(offset + _header.size + len(codes)) - f.tell()))
+    f.write(ydata.astype(dtype).tostring())
+
+def save(traces, filename_template, additional={}):
+    '''Save traces to MMTR files.
+
+    Traces filling the template to the same filename are written to a common
+    file.
+
+    :returns: list of generated filenames
+    '''
+
+    by_fn = {}
+    fns = []
+    for tr in traces:
+        fn = tr.fill_template(filename_template, **additional)
+        if fn not in by_fn:
+            by_fn[fn] = []
+            fns.append(fn)
+
+        by_fn[fn].append(tr)
+
+    for fn in fns:
+        ensuredirs(fn)
+        tmpfn = fn + '.tmp-%i' % os.getpid()
+        f = open(tmpfn, 'wb')
+        try:
+            for tr in by_fn[fn]:
+                _write_trace(f, tr)
+
+            f.close()
+            os.rename(tmpfn, fn)
+
+        except:
+            f.close()
+            os.unlink(tmpfn)
+            raise
+
+    return fns
+
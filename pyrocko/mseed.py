@@ -2,13 +2,89 @@ import mseed_ext
 from mseed_ext import HPTMODULUS, MSeedError
 import trace
 import os
+import numpy as num
 from util import reuse, ensuredirs
 
-def load(filename, getdata=True):
+def _hptime(t):
+    if t is None:
+        return None
+
+    return int(round(t*HPTMODULUS))
+
+class RecordIndex(object):
+    '''Positions and time spans of the data records in a Mini-SEED file.
+
+    Allows to decode only the records needed for a given time window and
+    channel selection, see :py:func:`load`. Times are stored in units of
+    ``1/HPTMODULUS`` seconds.
+    '''
+
+    def __init__(self, records):
+        nslc_ids = {}
+        inslc = []
+        for record in records:
+            nslc = tuple(record[2:6])
+            if nslc not in nslc_ids:
+                nslc_ids[nslc] = len(nslc_ids)
+            inslc.append(nslc_ids[nslc])
+
+        self.nslc_ids = sorted(nslc_ids.keys(), key=lambda nslc: nslc_ids[nslc])
+        self.inslc = num.array(inslc, dtype=num.int32)
+        self.offsets = num.array([ record[0] for record in records ], dtype=num.int64)
+        self.reclens = num.array([ record[1] for record in records ], dtype=num.int32)
+        self.tmins = num.array([ record[6] for record in records ], dtype=num.int64)
+        self.tmaxs = num.array([ record[7] for record in records ], dtype=num.int64)
+        self.nsamples = num.array([ record[8] for record in records ], dtype=num.int32)
+
+    def __len__(self):
+        return self.offsets.size
+
+    def select(self, tmin=None, tmax=None, nslc_selector=None):
+        '''Get indices of the records overlapping with a time span and matching a selection.'''
+
+        mask = num.ones(len(self), dtype=num.bool)
+        if tmin is not None:
+            mask &= self.tmaxs >= _hptime(tmin)
+        if tmax is not None:
+            mask &= self.tmins <= _hptime(tmax)
+        if nslc_selector is not None:
+            nslc_mask = num.array([ bool(nslc_selector(nslc)) for nslc in self.nslc_ids ] + [False])
+            mask &= nslc_mask[self.inslc]
+
+        return num.nonzero(mask)[0]
+
+def get_record_index(filename):
+    '''Scan the record headers of a Mini-SEED file and create a :py:class:`RecordIndex`.'''
+
+    return RecordIndex(mseed_ext.get_records(filename))
+
+def load(filename, getdata=True, tmin=None, tmax=None, nslc_selector=None, record_index=None):
+    '''Load traces from Mini-SEED file.
+
+    :param getdata: if ``True`` (the default), read data, otherwise only read traces metadata
+    :param tmin: skip records ending before this time
+    :param tmax: skip records starting after this time
+    :param nslc_selector: callable, taking a ``(network, station, location,
+        channel)`` tuple, records for which it returns ``False`` are skipped
+    :param record_index: :py:class:`RecordIndex` of the file, if given, the
+        records are selected from the index and read from their positions in
+        the file, instead of scanning the whole file
+
+    Records are selected based on their headers, only the selected records are
+    decompressed. The traces returned are not cut to *tmin* and *tmax*, they
+    cover all selected records.
+    '''
 
     mtime = os.stat(filename)[8]
+    if record_index is not None and getdata:
+        isel = record_index.select(tmin, tmax, nslc_selector)
+        trtups = mseed_ext.get_traces_from_records( filename, 
+            record_index.offsets[isel].tolist(), record_index.reclens[isel].tolist() )
+    else:
+        trtups = mseed_ext.get_traces( filename, getdata, True, _hptime(tmin), _hptime(tmax), nslc_selector )
+
     traces = []
-    for tr in mseed_ext.get_traces( filename, getdata ):
+    for tr in trtups:
         network, station, location, channel = tr[1:5]
         tmin = float(tr[5])/float(HPTMODULUS)
         tmax = float(tr[6])/float(HPTMODULUS)
@@ -22,6 +98,94 @@ def load(filename, getdata=True):
     
     return traces
     
+encodings = {
+    'ascii': mseed_ext.DE_ASCII,
+    'int16': mseed_ext.DE_INT16,
+    'int32': mseed_ext.DE_INT32,
+    'float32': mseed_ext.DE_FLOAT32,
+    'float64': mseed_ext.DE_FLOAT64,
+    'steim1': mseed_ext.DE_STEIM1,
+    'steim2': mseed_ext.DE_STEIM2 }
+
+def _encoding_code(encoding):
+    if encoding is None:
+        return -1
+
+    try:
+        return encodings[encoding]
+    except KeyError:
+        raise MSeedError('Unknown encoding: %s' % encoding)
+
+class Writer(object):
+    '''Incremental Mini-SEED file writer.
+
+    Traces handed to :py:meth:`write` are packed into records right away.
+    Samples which do not fill a complete record are held back until more
+    contiguous data of the same channel arrives or until :py:meth:`flush` is
+    called, so that only these pending samples are kept in memory.
+
+    :param filename: name of the output file
+    :param reclen: record length in bytes, a power of two between 256 and 8192
+    :param encoding: one of the keys of :py:data:`encodings` or ``None``, to use
+        Steim1 for int32 data and the native format for other data types
+    :param append: if ``True``, records are added to an existing file,
+        otherwise the file is truncated
+    '''
+
+    def __init__(self, filename, reclen=4096, encoding=None, append=False):
+        self.filename = filename
+        self.reclen = reclen
+        self.encoding = _encoding_code(encoding)
+        self._pending = {}
+        ensuredirs(filename)
+        if not append:
+            open(filename, 'wb').close()
+
+    def write(self, tr):
+        '''Write a trace, or a further piece of a trace.'''
+
+        nslc = tr.nslc_id
+        pending = self._pending.pop(nslc, None)
+        if pending is not None:
+            if (abs((pending.tmax+pending.deltat) - tr.tmin) < 1.0e-1*pending.deltat and 
+                    pending.ydata.dtype == tr.ydata.dtype and
+                    pending.deltat == tr.deltat):
+                
+                pending.append(tr.ydata)
+                tr = pending
+            else:
+                self._store(pending, flush=True)
+
+        rest = self._store(tr, flush=False)
+        if rest is not None:
+            self._pending[nslc] = rest
+
+    def flush(self):
+        '''Write all pending samples, filling up the last records of each channel.'''
+
+        for tr in self._pending.values():
+            self._store(tr, flush=True)
+
+        self._pending = {}
+
+    def close(self):
+        self.flush()
+
+    def _store(self, tr, flush):
+        try:
+            npacked = mseed_ext.store_traces([ as_tuple(tr) ], self.filename, 
+                self.reclen, self.encoding, True, flush)[0]
+        except MSeedError, e:
+            raise MSeedError( str(e) + ' (while storing traces to file \'%s\')' % self.filename)
+
+        n = tr.data_len()
+        if npacked == n:
+            return None
+
+        return trace.Trace(tr.network, tr.station, tr.location, tr.channel,
+                           tmin=tr.tmin+npacked*tr.deltat, deltat=tr.deltat,
+                           ydata=tr.ydata[npacked:].copy(), mtime=tr.mtime)
+
 def as_tuple(tr):
     itmin = int(round(tr.tmin*HPTMODULUS))
     itmax = int(round(tr.tmax*HPTMODULUS))
@@ -29,7 +193,16 @@ def as_tuple(tr):
     return (tr.network, tr.station, tr.location, tr.channel, 
             itmin, itmax, srate, tr.get_ydata())
 
-def save(traces, filename_template, additional={}):
+def save(traces, filename_template, additional={}, reclen=4096, encoding=None):
+    '''Save traces to Mini-SEED file(s).
+
+    :param reclen: record length in bytes, a power of two between 256 and 8192
+    :param encoding: one of the keys of :py:data:`encodings` or ``None``, to use
+        Steim1 for int32 data and the native format for other data types
+
+    See :py:func:`pyrocko.io.save` for the other arguments.
+    '''
+
     fn_tr = {}
     for tr in traces:
         fn = tr.fill_template(filename_template, **additional)
@@ -46,7 +219,7 @@ def save(traces, filename_template, additional={}):
         
         ensuredirs(fn)
         try:
-            mseed_ext.store_traces(trtups, fn)
+            mseed_ext.store_traces(trtups, fn, reclen, _encoding_code(encoding))
         except MSeedError, e:
             raise MSeedError( str(e) + ' (while storing traces to file \'%s\')' % fn)
             
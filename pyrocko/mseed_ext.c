@@ -17,47 +17,291 @@ static PyObject *MSeedError;
 #define BUFSIZE 1024
 
 
-static PyObject*
-mseed_get_traces (PyObject *dummy, PyObject *args)
+static int
+numpy_type_for_sampletype (char sampletype)
+{
+    switch (sampletype) {
+        case 'i':
+            assert( ms_samplesize('i') == 4 );
+            return NPY_INT32;
+        case 'a':
+            assert( ms_samplesize('a') == 1 );
+            return NPY_INT8;
+        case 'f':
+            assert( ms_samplesize('f') == 4 );
+            return NPY_FLOAT32;
+        case 'd':
+            assert( ms_samplesize('d') == 8 );
+            return NPY_FLOAT64;
+        default:
+            return -1;
+    }
+}
+
+/* Wrappers around the reading and decoding functions of libmseed, releasing
+   the GIL while they run, so that other Python threads can proceed meanwhile. */
+static int
+readmsr_nogil (MSFileParam **ppmsfp, MSRecord **ppmsr, char *filename, off_t *fpos)
 {
-    char          *filename;
-    MSTraceGroup  *mstg = NULL;
-    MSTrace       *mst = NULL;
     int           retcode;
-    npy_intp      array_dims[1] = {0};
-    PyObject      *array = NULL;
-    PyObject      *out_traces = NULL;
-    PyObject      *out_trace = NULL;
-    int           numpytype;
-    char          strbuf[BUFSIZE];
-    PyObject      *unpackdata = NULL;
 
-    if (!PyArg_ParseTuple(args, "sO", &filename, &unpackdata)) {
-        PyErr_SetString(MSeedError, "usage get_traces(filename, dataflag)" );
-        return NULL;
+    Py_BEGIN_ALLOW_THREADS
+    retcode = ms_readmsr_r (ppmsfp, ppmsr, filename, 0, fpos, NULL, 1, 0, 0);
+    Py_END_ALLOW_THREADS
+
+    return retcode;
+}
+
+static int
+unpack_nogil (char *record, int reclen, MSRecord **ppmsr)
+{
+    int           retcode;
+
+    Py_BEGIN_ALLOW_THREADS
+    retcode = msr_unpack (record, reclen, ppmsr, 1, 0);
+    Py_END_ALLOW_THREADS
+
+    return retcode;
+}
+
+static int
+read_record_at_nogil (FILE *fp, off_t offset, char *record, int reclen, MSRecord **ppmsr)
+{
+    int           retcode;
+
+    Py_BEGIN_ALLOW_THREADS
+    if (fseeko(fp, offset, SEEK_SET) != 0 || fread(record, reclen, 1, fp) != 1) {
+        retcode = MS_GENERROR;
+    } else {
+        retcode = msr_unpack (record, reclen, ppmsr, 1, 0);
     }
+    Py_END_ALLOW_THREADS
 
-    if (!PyBool_Check(unpackdata)) {
-        PyErr_SetString(MSeedError, "Second argument must be a boolean" );
-        return NULL;
+    return retcode;
+}
+
+/* Record selection for partial reads. Time limits are in HPTMODULUS units,
+   HPTERROR meaning unbounded. If nslc_selector is not NULL, it is called with a
+   (network, station, location, channel) tuple and records for which it returns
+   a false value are skipped. Its answer is remembered for the most recent
+   source name, as records of a channel usually come in runs. */
+typedef struct {
+    hptime_t      tmin;
+    hptime_t      tmax;
+    PyObject      *nslc_selector;
+    char          last_srcname[50];
+    int           last_selected;
+} RecordFilter;
+
+/* Check a record against `filter`, using header information only. Returns 1 if
+   the record is selected, 0 if not and -1 if the selector raised an exception.
+   A NULL filter selects everything. */
+static int
+record_selected (MSRecord *msr, RecordFilter *filter)
+{
+    char          srcname[50];
+    PyObject      *result;
+    int           selected;
+
+    if (filter == NULL) return 1;
+
+    if (filter->tmin != HPTERROR && msr_endtime(msr) < filter->tmin) return 0;
+    if (filter->tmax != HPTERROR && msr_starttime(msr) > filter->tmax) return 0;
+
+    if (filter->nslc_selector == NULL) return 1;
+
+    msr_srcname(msr, srcname, 0);
+    if (strcmp(srcname, filter->last_srcname) == 0) return filter->last_selected;
+
+    result = PyObject_CallFunction(filter->nslc_selector, "((ssss))",
+                    msr->network, msr->station, msr->location, msr->channel);
+    if (result == NULL) return -1;
+    selected = PyObject_IsTrue(result);
+    Py_DECREF(result);
+    if (selected == -1) return -1;
+
+    strcpy(filter->last_srcname, srcname);
+    filter->last_selected = selected;
+    return selected;
+}
+
+/* Like ms_readtraces with default tolerances, but records are checked against
+   `filter` before their data is decoded. With dataflag set, only selected
+   records are decompressed. */
+static int
+read_traces (MSTraceGroup **ppmstg, char *filename, RecordFilter *filter, flag dataflag)
+{
+    MSFileParam   *msfp = NULL;
+    MSRecord      *msr = NULL;
+    int           retcode, selected;
+
+    *ppmstg = mst_initgroup (NULL);
+    if ( ! *ppmstg ) return MS_GENERROR;
+
+    while ( (retcode = readmsr_nogil (&msfp, &msr, filename, NULL)) == MS_NOERROR ) {
+        selected = record_selected (msr, filter);
+        if (selected == -1) {
+            retcode = MS_GENERROR;
+            break;
+        }
+        if (!selected) continue;
+
+        if (dataflag && (retcode = unpack_nogil (msr->record, msr->reclen, &msr)) != MS_NOERROR) break;
+
+        mst_addmsrtogroup (*ppmstg, msr, 0, -1.0, -1.0);
     }
-  
-    /* get data from mseed file */
-    retcode = ms_readtraces (&mstg, filename, 0, -1.0, -1.0, 0, 1, (unpackdata == Py_True), 0);
-    if ( retcode < 0 ) {
-        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
-        PyErr_SetString(MSeedError, strbuf);
-        return NULL;
+
+    if (retcode == MS_ENDOFFILE) retcode = MS_NOERROR;
+
+    ms_readmsr_r (&msfp, &msr, NULL, 0, NULL, NULL, 0, 0, 0);
+
+    return retcode;
+}
+
+/* Decode the records of an mseed file one by one and put their samples
+   directly into the NumPy arrays of the traces in `mstg`, which must come from
+   a header-only run of read_traces on the same file and with the same filter.
+   The arrays are
+   allocated here, sized from the sample counts of the header pass, so that the
+   samples are never held twice in memory.
+
+   Returns 0 on success, a negative libmseed error code if reading fails and 1
+   if the records cannot be assigned to the traces unambiguously, in which case
+   the caller should fall back to the regular reader. */
+static int
+decode_into_arrays (char *filename, MSTraceGroup *mstg, RecordFilter *filter, PyObject **arrays)
+{
+    MSFileParam   *msfp = NULL;
+    MSRecord      *msr = NULL;
+    MSTrace       *mst = NULL;
+    int           retcode, result = 0;
+    int           i, imatch, numpytype, selected;
+    int32_t       *filled;
+    double        offset;
+    npy_intp      ioffset;
+    npy_intp      array_dims[1] = {0};
+    size_t        samplesize;
+
+    filled = calloc(mstg->numtraces, sizeof(int32_t));
+    if (filled == NULL) return MS_GENERROR;
+
+    while ( result == 0 &&
+            (retcode = readmsr_nogil (&msfp, &msr, filename, NULL)) == MS_NOERROR ) {
+
+        selected = record_selected (msr, filter);
+        if (selected == -1) {
+            result = MS_GENERROR;
+            break;
+        }
+        if (!selected || msr->samplecnt == 0) continue;
+
+        if ((retcode = unpack_nogil (msr->record, msr->reclen, &msr)) != MS_NOERROR) {
+            result = retcode;
+            break;
+        }
+
+        if (msr->numsamples == 0) continue;
+
+        /* find the one trace this record belongs to */
+        imatch = -1;
+        mst = mstg->traces;
+        for (i=0; mst; i++, mst=mst->next) {
+            if (strcmp(mst->network, msr->network) ||
+                strcmp(mst->station, msr->station) ||
+                strcmp(mst->location, msr->location) ||
+                strcmp(mst->channel, msr->channel)) continue;
+
+            if (ms_dabs(msr_samprate(msr) - mst->samprate) > 0.0001 * mst->samprate) continue;
+
+            offset = (double)(msr_starttime(msr) - mst->starttime) / HPTMODULUS * mst->samprate;
+            if (offset < -0.5 || offset + msr->numsamples > mst->samplecnt + 0.5) continue;
+
+            if (imatch != -1) {
+                imatch = -1;
+                result = 1;
+                break;
+            }
+            imatch = i;
+            ioffset = (npy_intp)(offset + 0.5);
+        }
+
+        if (imatch == -1) {
+            result = 1;
+            break;
+        }
+
+        numpytype = numpy_type_for_sampletype(msr->sampletype);
+        if (numpytype == -1) {
+            result = 1;
+            break;
+        }
+
+        if (arrays[imatch] == NULL) {
+            mst = mstg->traces;
+            for (i=0; i<imatch; i++) mst = mst->next;
+            array_dims[0] = mst->samplecnt;
+            arrays[imatch] = PyArray_SimpleNew(1, array_dims, numpytype);
+        } else if (PyArray_TYPE(arrays[imatch]) != numpytype) {
+            result = 1;
+            break;
+        }
+
+        if (ioffset + msr->numsamples > PyArray_SIZE(arrays[imatch])) {
+            result = 1;
+            break;
+        }
+
+        samplesize = ms_samplesize(msr->sampletype);
+        memcpy( (char*)PyArray_DATA(arrays[imatch]) + ioffset*samplesize,
+                msr->datasamples, msr->numsamples*samplesize );
+
+        filled[imatch] += msr->numsamples;
     }
 
-    if ( ! mstg ) {
-        snprintf (strbuf, BUFSIZE, "Error reading file");
-        PyErr_SetString(MSeedError, strbuf);
-        return NULL;
+    if (result == 0 && retcode != MS_ENDOFFILE) result = retcode;
+
+    /* every trace must be covered exactly, otherwise let libmseed sort it out */
+    if (result == 0) {
+        mst = mstg->traces;
+        for (i=0; mst; i++, mst=mst->next) {
+            if (arrays[i] == NULL || filled[i] != mst->samplecnt) {
+                result = 1;
+                break;
+            }
+        }
     }
 
+    ms_readmsr_r (&msfp, &msr, NULL, 0, NULL, NULL, 0, 0, 0);
+    free(filled);
+
+    return result;
+}
+
+static void
+free_arrays (PyObject **arrays, int n)
+{
+    int i;
+    for (i=0; i<n; i++) Py_XDECREF(arrays[i]);
+    free(arrays);
+}
+
+/* Convert the traces of a trace group into a list of tuples as returned by
+   get_traces. If `arrays` is given, it holds the already decoded data of each
+   trace, references are taken over from it. */
+static PyObject*
+trace_list_from_group (MSTraceGroup *mstg, PyObject **arrays, int unpackdata)
+{
+    MSTrace       *mst = NULL;
+    npy_intp      array_dims[1] = {0};
+    PyObject      *array = NULL;
+    PyObject      *out_traces = NULL;
+    PyObject      *out_trace = NULL;
+    int           numpytype;
+    int           i;
+    char          strbuf[BUFSIZE];
+
     /* check that there is data in the traces */
-    if (unpackdata == Py_True) {
+    if (unpackdata && !arrays) {
         mst = mstg->traces;
         while (mst) {
             if (mst->datasamples == NULL) {
@@ -75,32 +319,19 @@ mseed_get_traces (PyObject *dummy, PyObject *args)
 
     /* convert data to python tuple */
 
-    while (mst) {
+    for (i=0; mst; i++) {
         
-        if (unpackdata == Py_True) {
+        if (arrays) {
+            array = arrays[i];
+            arrays[i] = NULL;
+        } else if (unpackdata) {
             array_dims[0] = mst->numsamples;
-            switch (mst->sampletype) {
-                case 'i':
-                    assert( ms_samplesize('i') == 4 );
-                    numpytype = NPY_INT32;
-                    break;
-                case 'a':
-                    assert( ms_samplesize('a') == 1 );
-                    numpytype = NPY_INT8;
-                    break;
-                case 'f':
-                    assert( ms_samplesize('f') == 4 );
-                    numpytype = NPY_FLOAT32;
-                    break;
-                case 'd':
-                    assert( ms_samplesize('d') == 8 );
-                    numpytype = NPY_FLOAT64;
-                    break;
-                default:
-                    snprintf (strbuf, BUFSIZE, "Unknown sampletype %c\n", mst->sampletype);
-                    PyErr_SetString(MSeedError, strbuf);
-                    Py_XDECREF(out_traces);
-                    return NULL;
+            numpytype = numpy_type_for_sampletype(mst->sampletype);
+            if (numpytype == -1) {
+                snprintf (strbuf, BUFSIZE, "Unknown sampletype %c\n", mst->sampletype);
+                PyErr_SetString(MSeedError, strbuf);
+                Py_XDECREF(out_traces);
+                return NULL;
             }
             array = PyArray_SimpleNew(1, array_dims, numpytype);
             memcpy( PyArray_DATA(array), mst->datasamples, mst->numsamples*ms_samplesize(mst->sampletype) );
@@ -126,17 +357,306 @@ mseed_get_traces (PyObject *dummy, PyObject *args)
         mst = mst->next;
     }
 
+    return out_traces;
+}
+
+static PyObject*
+mseed_get_traces (PyObject *dummy, PyObject *args)
+{
+    char          *filename;
+    MSTraceGroup  *mstg = NULL;
+    int           retcode;
+    int           numtraces;
+    PyObject      *out_traces = NULL;
+    PyObject      **arrays = NULL;
+    char          strbuf[BUFSIZE];
+    PyObject      *unpackdata = NULL;
+    PyObject      *zerocopy = Py_True;
+    PyObject      *tmin = Py_None;
+    PyObject      *tmax = Py_None;
+    PyObject      *nslc_selector = Py_None;
+    RecordFilter  filter;
+    RecordFilter  *pfilter = NULL;
+
+    if (!PyArg_ParseTuple(args, "sO|OOOO", &filename, &unpackdata, &zerocopy,
+                                           &tmin, &tmax, &nslc_selector)) {
+        PyErr_SetString(MSeedError, "usage get_traces(filename, dataflag[, zerocopy[, tmin, tmax[, nslc_selector]]])" );
+        return NULL;
+    }
+
+    if (!PyBool_Check(unpackdata)) {
+        PyErr_SetString(MSeedError, "Second argument must be a boolean" );
+        return NULL;
+    }
+
+    if (!PyBool_Check(zerocopy)) {
+        PyErr_SetString(MSeedError, "Third argument must be a boolean" );
+        return NULL;
+    }
+
+    if (tmin != Py_None || tmax != Py_None || nslc_selector != Py_None) {
+        filter.tmin = HPTERROR;
+        filter.tmax = HPTERROR;
+        filter.nslc_selector = NULL;
+        filter.last_srcname[0] = '\0';
+        filter.last_selected = 0;
+
+        if (tmin != Py_None) {
+            filter.tmin = PyLong_AsLongLong(tmin);
+            if (filter.tmin == -1 && PyErr_Occurred()) return NULL;
+        }
+        if (tmax != Py_None) {
+            filter.tmax = PyLong_AsLongLong(tmax);
+            if (filter.tmax == -1 && PyErr_Occurred()) return NULL;
+        }
+        if (nslc_selector != Py_None) {
+            if (!PyCallable_Check(nslc_selector)) {
+                PyErr_SetString(MSeedError, "nslc_selector must be callable" );
+                return NULL;
+            }
+            filter.nslc_selector = nslc_selector;
+        }
+        pfilter = &filter;
+    }
+
+    if (unpackdata == Py_True && zerocopy == Py_True) {
+        /* header pass, then decode records straight into the output arrays */
+        retcode = read_traces (&mstg, filename, pfilter, 0);
+        if ( retcode < 0 ) {
+            mst_freegroup (&mstg);
+            if (PyErr_Occurred()) return NULL;
+            snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+            PyErr_SetString(MSeedError, strbuf);
+            return NULL;
+        }
+
+        if ( ! mstg ) {
+            snprintf (strbuf, BUFSIZE, "Error reading file");
+            PyErr_SetString(MSeedError, strbuf);
+            return NULL;
+        }
+
+        arrays = calloc(mstg->numtraces, sizeof(PyObject*));
+        if (arrays == NULL) {
+            mst_freegroup (&mstg);
+            return PyErr_NoMemory();
+        }
+
+        retcode = decode_into_arrays (filename, mstg, pfilter, arrays);
+        if ( retcode < 0 ) {
+            free_arrays (arrays, mstg->numtraces);
+            mst_freegroup (&mstg);
+            if (PyErr_Occurred()) return NULL;
+            snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+            PyErr_SetString(MSeedError, strbuf);
+            return NULL;
+        }
+
+        if ( retcode == 1 ) {
+            free_arrays (arrays, mstg->numtraces);
+            mst_freegroup (&mstg);
+            arrays = NULL;
+        }
+    }
+
+    if ( ! arrays ) {
+        /* get data from mseed file */
+        retcode = read_traces (&mstg, filename, pfilter, (unpackdata == Py_True));
+        if ( retcode < 0 ) {
+            mst_freegroup (&mstg);
+            if (PyErr_Occurred()) return NULL;
+            snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+            PyErr_SetString(MSeedError, strbuf);
+            return NULL;
+        }
+
+        if ( ! mstg ) {
+            snprintf (strbuf, BUFSIZE, "Error reading file");
+            PyErr_SetString(MSeedError, strbuf);
+            return NULL;
+        }
+
+    }
+
+    numtraces = mstg->numtraces;
+    out_traces = trace_list_from_group (mstg, arrays, (unpackdata == Py_True));
+
+    if (arrays) free_arrays (arrays, numtraces);
     mst_freegroup (&mstg);
 
     return out_traces;
 }
 
+/* List the records of an mseed file, without decoding any data. */
+static PyObject*
+mseed_get_records (PyObject *dummy, PyObject *args)
+{
+    char          *filename;
+    MSFileParam   *msfp = NULL;
+    MSRecord      *msr = NULL;
+    off_t         fpos;
+    int           retcode;
+    PyObject      *out_records = NULL;
+    PyObject      *out_record = NULL;
+    char          strbuf[BUFSIZE];
+
+    if (!PyArg_ParseTuple(args, "s", &filename)) {
+        PyErr_SetString(MSeedError, "usage get_records(filename)" );
+        return NULL;
+    }
+
+    out_records = Py_BuildValue("[]");
+
+    while ( (retcode = readmsr_nogil (&msfp, &msr, filename, &fpos)) == MS_NOERROR ) {
+        out_record = Py_BuildValue( "(L,i,s,s,s,s,L,L,i)",
+                                    (PY_LONG_LONG)fpos,
+                                    msr->reclen,
+                                    msr->network,
+                                    msr->station,
+                                    msr->location,
+                                    msr->channel,
+                                    msr_starttime(msr),
+                                    msr_endtime(msr),
+                                    msr->samplecnt );
+
+        PyList_Append(out_records, out_record);
+        Py_DECREF(out_record);
+    }
+
+    ms_readmsr_r (&msfp, &msr, NULL, 0, NULL, NULL, 0, 0, 0);
+
+    if ( retcode != MS_ENDOFFILE ) {
+        Py_DECREF(out_records);
+        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+        PyErr_SetString(MSeedError, strbuf);
+        return NULL;
+    }
+
+    return out_records;
+}
+
+/* Decode the records at the given file positions and merge them into traces,
+   like get_traces does for the whole file. */
+static PyObject*
+mseed_get_traces_from_records (PyObject *dummy, PyObject *args)
+{
+    char          *filename;
+    PyObject      *in_offsets = NULL;
+    PyObject      *in_reclens = NULL;
+    PyObject      *offsets = NULL;
+    PyObject      *reclens = NULL;
+    MSTraceGroup  *mstg = NULL;
+    MSRecord      *msr = NULL;
+    PyObject      *out_traces = NULL;
+    FILE          *fp;
+    char          *record = NULL;
+    int           i, n, reclen, maxreclen = 0;
+    PY_LONG_LONG  offset;
+    int           retcode = MS_NOERROR;
+    char          strbuf[BUFSIZE];
+
+    if (!PyArg_ParseTuple(args, "sOO", &filename, &in_offsets, &in_reclens)) {
+        PyErr_SetString(MSeedError, "usage get_traces_from_records(filename, offsets, reclens)" );
+        return NULL;
+    }
+
+    offsets = PySequence_Fast(in_offsets, "offsets must be a sequence");
+    reclens = PySequence_Fast(in_reclens, "reclens must be a sequence");
+    if (offsets == NULL || reclens == NULL) {
+        Py_XDECREF(offsets);
+        Py_XDECREF(reclens);
+        return NULL;
+    }
+
+    n = PySequence_Fast_GET_SIZE(offsets);
+    if (PySequence_Fast_GET_SIZE(reclens) != n) {
+        Py_DECREF(offsets);
+        Py_DECREF(reclens);
+        PyErr_SetString(MSeedError, "offsets and reclens must have the same length" );
+        return NULL;
+    }
+
+    fp = fopen(filename, "rb");
+    if (fp == NULL) {
+        Py_DECREF(offsets);
+        Py_DECREF(reclens);
+        snprintf (strbuf, BUFSIZE, "Cannot open file '%s'", filename);
+        PyErr_SetString(MSeedError, strbuf);
+        return NULL;
+    }
+
+    mstg = mst_initgroup (NULL);
+
+    for (i=0; i<n; i++) {
+        offset = PyLong_AsLongLong(PySequence_Fast_GET_ITEM(offsets, i));
+        reclen = (int)PyInt_AsLong(PySequence_Fast_GET_ITEM(reclens, i));
+        if (PyErr_Occurred()) break;
+
+        if (reclen > maxreclen) {
+            free(record);
+            record = malloc(reclen);
+            maxreclen = reclen;
+        }
+
+        if ((retcode = read_record_at_nogil (fp, (off_t)offset, record, reclen, &msr)) != MS_NOERROR) break;
+
+        mst_addmsrtogroup (mstg, msr, 0, -1.0, -1.0);
+    }
+
+    msr_free (&msr);
+    free(record);
+    fclose(fp);
+    Py_DECREF(offsets);
+    Py_DECREF(reclens);
+
+    if (!PyErr_Occurred() && retcode != MS_NOERROR) {
+        snprintf (strbuf, BUFSIZE, "Cannot read records from file '%s': %s", filename, ms_errorstr(retcode));
+        PyErr_SetString(MSeedError, strbuf);
+    }
+
+    if (!PyErr_Occurred()) out_traces = trace_list_from_group (mstg, NULL, 1);
+
+    mst_freegroup (&mstg);
+    return out_traces;
+}
+
 static void record_handler (char *record, int reclen, void *outfile) {    
     if ( fwrite(record, reclen, 1, outfile) != 1 ) {
       fprintf(stderr, "Error writing mseed record to output file\n");
     }
 }
 
+/* Check if data of the given sample type can be stored with an encoding. */
+static int
+encoding_supported (char sampletype, int encoding)
+{
+    switch (sampletype) {
+        case 'i':
+            return (encoding == DE_INT16 || encoding == DE_INT32 ||
+                    encoding == DE_STEIM1 || encoding == DE_STEIM2);
+        case 'a':
+            return encoding == DE_ASCII;
+        case 'f':
+            return encoding == DE_FLOAT32;
+        case 'd':
+            return encoding == DE_FLOAT64;
+        default:
+            return 0;
+    }
+}
+
+/* Check if all int32 samples can be represented as int16. */
+static int
+fits_int16 (int32_t *data, int length)
+{
+    int i;
+
+    for (i=0; i<length; i++) {
+        if (data[i] < -32768 || data[i] > 32767) return 0;
+    }
+    return 1;
+}
+
 static PyObject*
 mseed_store_traces (PyObject *dummy, PyObject *args)
 {
@@ -145,38 +665,54 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
     PyObject      *array = NULL;
     PyObject      *in_traces = NULL;
     PyObject      *in_trace = NULL;
+    PyObject      *out_npacked = NULL;
+    PyObject      *npacked = NULL;
+    PyObject      *append = Py_False;
+    PyObject      *flush = Py_True;
     PyArrayObject *contiguous_array = NULL;
     int           i;
     char          *network, *station, *location, *channel;
     char          mstype;
     int           msdetype;
+    int           encoding = -1;
+    int           reclen = 4096;
     int           psamples, precords;
     int           numpytype;
     int           length;
     FILE          *outfile;
 
-    if (!PyArg_ParseTuple(args, "Os", &in_traces, &filename)) {
-        PyErr_SetString(MSeedError, "usage store_traces(traces, filename)" );
+    if (!PyArg_ParseTuple(args, "Os|iiOO", &in_traces, &filename, &reclen, &encoding, &append, &flush)) {
+        PyErr_SetString(MSeedError, "usage store_traces(traces, filename[, reclen[, encoding[, append[, flush]]]])" );
         return NULL;
     }
     if (!PySequence_Check( in_traces )) {
         PyErr_SetString(MSeedError, "Traces is not of sequence type." );
         return NULL;
     }
+    if (!PyBool_Check(append) || !PyBool_Check(flush)) {
+        PyErr_SetString(MSeedError, "Arguments append and flush must be booleans." );
+        return NULL;
+    }
+    if (reclen < 256 || reclen > 8192 || (reclen & (reclen - 1)) != 0) {
+        PyErr_SetString(MSeedError, "Record length must be a power of two between 256 and 8192." );
+        return NULL;
+    }
 
-    outfile = fopen(filename, "w" );
+    outfile = fopen(filename, (append == Py_True) ? "ab" : "wb" );
     if (outfile == NULL) {
         PyErr_SetString(MSeedError, "Error opening file.");
         return NULL;
     }
 
+    out_npacked = Py_BuildValue("[]");
+
     for (i=0; i<PySequence_Length(in_traces); i++) {
         
         in_trace = PySequence_GetItem(in_traces, i);
         if (!PyTuple_Check(in_trace)) {
             PyErr_SetString(MSeedError, "Trace record must be a tuple of (network, station, location, channel, starttime, endtime, samprate, data)." );
             Py_DECREF(in_trace);
-            return NULL;
+            goto fail;
         }
         mst = mst_init (NULL);
         
@@ -192,7 +728,7 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
             PyErr_SetString(MSeedError, "Trace record must be a tuple of (network, station, location, channel, starttime, endtime, samprate, data)." );
             mst_free( &mst );  
             Py_DECREF(in_trace);
-            return NULL;
+            goto fail;
         }
 
         strncpy( mst->network, network, 10);
@@ -208,7 +744,7 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
             PyErr_SetString(MSeedError, "Data must be given as NumPy array." );
             mst_free( &mst );  
             Py_DECREF(in_trace);
-            return NULL;
+            goto fail;
         }
         numpytype = PyArray_TYPE(array);
         switch (numpytype) {
@@ -236,13 +772,33 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
                     PyErr_SetString(MSeedError, "Data must be of type float64, float32, int32 or int8.");
                     mst_free( &mst );  
                     Py_DECREF(in_trace);
-                    return NULL;
+                    goto fail;
+            }
+
+        if (encoding != -1) {
+            if (!encoding_supported(mstype, encoding)) {
+                PyErr_SetString(MSeedError, "Encoding cannot be used with the data type of the trace.");
+                mst_free( &mst );  
+                Py_DECREF(in_trace);
+                goto fail;
             }
+            msdetype = encoding;
+        }
+
         mst->sampletype = mstype;
 
         contiguous_array = PyArray_GETCONTIGUOUS((PyArrayObject*)array);
 
         length = PyArray_SIZE(contiguous_array);
+        if (mstype == 'i' && msdetype == DE_INT16 &&
+                !fits_int16((int32_t*)PyArray_DATA(contiguous_array), length)) {
+            PyErr_SetString(MSeedError, "Data out of range for int16 encoding.");
+            Py_DECREF(contiguous_array);
+            mst_free( &mst );
+            Py_DECREF(in_trace);
+            goto fail;
+        }
+
         mst->numsamples = length;
         mst->samplecnt = length;
 
@@ -250,21 +806,38 @@ mseed_store_traces (PyObject *dummy, PyObject *args)
         memcpy(mst->datasamples, PyArray_DATA(contiguous_array), length*ms_samplesize(mstype));
         Py_DECREF(contiguous_array);
 
-        precords = mst_pack (mst, &record_handler, outfile, 4096, msdetype,
-                                     1, &psamples, 1, 0, NULL);
+        psamples = 0;
+        precords = 0;
+        if (length > 0) {
+            precords = mst_pack (mst, &record_handler, outfile, reclen, msdetype,
+                                         1, &psamples, (flush == Py_True), 0, NULL);
+        }
         mst_free( &mst );
         Py_DECREF(in_trace);
+
+        if (precords < 0 || (flush == Py_True && psamples != length)) {
+            PyErr_SetString(MSeedError, "Error packing mseed records.");
+            goto fail;
+        }
+
+        npacked = PyInt_FromLong(psamples);
+        PyList_Append(out_npacked, npacked);
+        Py_DECREF(npacked);
     }
     fclose( outfile );
 
-    Py_INCREF(Py_None);
-    return Py_None;
+    return out_npacked;
+
+  fail:
+    fclose( outfile );
+    Py_DECREF(out_npacked);
+    return NULL;
 }
 
 
 static PyMethodDef MSEEDMethods[] = {
     {"get_traces",  mseed_get_traces, METH_VARARGS, 
-    "get_traces(filename, dataflag)\n"
+    "get_traces(filename, dataflag[, zerocopy[, tmin, tmax[, nslc_selector]]])\n"
     "Get all traces stored in an mseed file.\n\n"
     "Returns a list of tuples, one tuple for each trace in the file. Each tuple\n"
     "has 9 elements:\n\n"
@@ -272,10 +845,40 @@ static PyMethodDef MSEEDMethods[] = {
     "    startime, endtime, samprate, data)\n\n"
     "These come straight from the MSTrace data structure, defined and described\n"
     "in libmseed. If dataflag is True, `data` is a numpy array containing the\n"
-    "data. If dataflag is False, the data is not unpacked and `data` is None.\n" },
+    "data. If dataflag is False, the data is not unpacked and `data` is None.\n\n"
+    "Unless zerocopy is False, the records are decoded directly into the\n"
+    "output arrays, sized by a preceding header-only pass, instead of being\n"
+    "merged by libmseed and copied afterwards.\n\n"
+    "If tmin or tmax (in HPTMODULUS units) are given, records lying completely\n"
+    "outside of that time span are skipped without being decoded. Likewise, if\n"
+    "nslc_selector is given, it is called with a (network, station, location,\n"
+    "channel) tuple and records for which it returns False are skipped.\n" },
+
+    {"get_records",  mseed_get_records, METH_VARARGS, 
+    "get_records(filename)\n"
+    "List the data records of an mseed file, without decoding their data.\n\n"
+    "Returns a list of tuples, one tuple for each record, with the elements\n\n"
+    "  (offset, reclen, network, station, location, channel,\n"
+    "    starttime, endtime, samplecnt)\n\n"
+    "where offset is the position of the record in the file in bytes.\n" },
+
+    {"get_traces_from_records",  mseed_get_traces_from_records, METH_VARARGS, 
+    "get_traces_from_records(filename, offsets, reclens)\n"
+    "Decode the records at the given positions of an mseed file.\n\n"
+    "The records are merged into traces, which are returned like with\n"
+    "get_traces(filename, True).\n" },
 
     {"store_traces",  mseed_store_traces, METH_VARARGS, 
-    "store_traces(traces, filename)\n" },
+    "store_traces(traces, filename[, reclen[, encoding[, append[, flush]]]])\n"
+    "Store traces in an mseed file.\n\n"
+    "Each trace is given as a tuple\n\n"
+    "  (network, station, location, channel, starttime, endtime, samprate, data)\n\n"
+    "Records of length reclen (default 4096) are written with the given\n"
+    "encoding, one of the DE_* constants of this module. The default (-1) is\n"
+    "to use Steim1 for int32 data and the native format for other types. If\n"
+    "append is True, the records are appended to an existing file. If flush is\n"
+    "False, samples which do not fill a complete record are not written.\n\n"
+    "Returns a list with the number of samples written of each trace.\n" },
 
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
@@ -302,4 +905,12 @@ initmseed_ext(void)
                                in the c code and it could be safely removed from
                                the  module. */
     PyModule_AddObject(m, "HPTMODULUS", hptmodulus);
+
+    PyModule_AddIntConstant(m, "DE_ASCII", DE_ASCII);
+    PyModule_AddIntConstant(m, "DE_INT16", DE_INT16);
+    PyModule_AddIntConstant(m, "DE_INT32", DE_INT32);
+    PyModule_AddIntConstant(m, "DE_FLOAT32", DE_FLOAT32);
+    PyModule_AddIntConstant(m, "DE_FLOAT64", DE_FLOAT64);
+    PyModule_AddIntConstant(m, "DE_STEIM1", DE_STEIM1);
+    PyModule_AddIntConstant(m, "DE_STEIM2", DE_STEIM2);
 }
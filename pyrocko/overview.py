@@ -0,0 +1,372 @@
+'''Multi-resolution min/max/RMS overviews of the waveforms in a pile.
+
+An :py:class:`Overview` holds, for each channel, block-wise minimum, maximum
+and RMS values of the data at several resolution levels. Blocks are aligned
+to a fixed absolute time grid: level *i* uses blocks of duration
+``tbase*factor**i`` seconds. The overview is built from a
+:py:class:`pile.Pile` and can be updated incrementally; only channels and
+time spans of files which have been added, modified or removed since the
+last update are recomputed. Optionally, it is stored persistently in a
+directory.
+
+Overviews allow to draw envelopes or to determine data ranges for long time
+spans without touching the raw data.
+'''
+
+import os, logging, math
+import cPickle as pickle
+import numpy as num
+
+import util, trace, config
+
+logger = logging.getLogger('pyrocko.overview')
+
+progressbar = util.progressbar_module()
+
+class OverviewError(Exception):
+    pass
+
+_block_fields = ('ib', 'vmin', 'vmax', 'sum', 'sumsq', 'n')
+
+def _aggregate(ib, vmin, vmax, sum, sumsq, n):
+    '''Merge entries with equal block index. *ib* must be sorted.'''
+
+    if ib.size == 0:
+        return ib, vmin, vmax, sum, sumsq, n
+
+    idx = num.concatenate(([0], num.nonzero(num.diff(ib))[0]+1))
+    if idx.size == ib.size:
+        return ib, vmin, vmax, sum, sumsq, n
+
+    return (ib[idx], num.minimum.reduceat(vmin, idx), num.maximum.reduceat(vmax, idx),
+            num.add.reduceat(sum, idx), num.add.reduceat(sumsq, idx), num.add.reduceat(n, idx))
+
+def _empty_blocks():
+    return (num.zeros(0, dtype=num.int64), num.zeros(0), num.zeros(0), num.zeros(0), num.zeros(0),
+            num.zeros(0, dtype=num.int64))
+
+def _blocks_from_trace(tr, tblock, tmin, tmax):
+    '''Get block-wise statistics of the samples of a trace in [tmin, tmax).'''
+
+    ydata = tr.get_ydata()
+    t = float(tr.tmin) + num.arange(ydata.size) * tr.deltat
+    mask = num.logical_and(tmin <= t, t < tmax)
+    t = t[mask]
+    if t.size == 0:
+        return _empty_blocks()
+
+    y = ydata[mask].astype(num.float64)
+    ib = num.floor(t / tblock).astype(num.int64)
+    idx = num.concatenate(([0], num.nonzero(num.diff(ib))[0]+1))
+    n = num.diff(num.concatenate((idx, [ib.size])))
+    return (ib[idx], num.minimum.reduceat(y, idx), num.maximum.reduceat(y, idx),
+            num.add.reduceat(y, idx), num.add.reduceat(y**2, idx), n.astype(num.int64))
+
+class ChannelOverview(object):
+    '''Overview levels of a single channel.'''
+
+    def __init__(self, nslc_id, nlevels):
+        self.nslc_id = nslc_id
+        self.levels = [ _empty_blocks() for i in xrange(nlevels) ]
+
+    def replace(self, ilevel, ibmin, ibmax, blocks):
+        '''Replace blocks with indices in [ibmin, ibmax) of a level.'''
+
+        old = self.levels[ilevel]
+        i1, i2 = num.searchsorted(old[0], [ibmin, ibmax])
+        self.levels[ilevel] = tuple( num.concatenate((a[:i1], b, a[i2:])) for (a, b) in zip(old, blocks) )
+
+    def get(self, ilevel, ibmin, ibmax):
+        '''Get blocks with indices in [ibmin, ibmax) of a level.'''
+
+        blocks = self.levels[ilevel]
+        i1, i2 = num.searchsorted(blocks[0], [ibmin, ibmax])
+        return tuple( a[i1:i2] for a in blocks )
+
+    def is_empty(self):
+        return self.levels[0][0].size == 0
+
+class Overview(object):
+    '''Min/max/RMS overview pyramid of the channels of a pile.
+
+    :param path: directory to store the overview in, or ``None`` to keep it
+        only in memory. An existing overview is loaded from there.
+    :param tbase: duration of the blocks at the finest level [s]
+    :param factor: ratio of block durations of successive levels
+    :param nlevels: number of levels
+    '''
+
+    def __init__(self, path=None, tbase=60., factor=4, nlevels=6):
+        self.path = path
+        self.tbase = float(tbase)
+        self.factor = int(factor)
+        self.nlevels = int(nlevels)
+        self.channels = {}
+        self.files = {}
+        self.pending = {}
+        self._dirty = set()
+
+        if path is not None and os.path.exists(self._index_path()):
+            self._load()
+
+    def tblock(self, ilevel):
+        '''Get block duration of a level.'''
+
+        return self.tbase * self.factor**ilevel
+
+    def get_nslc_ids(self):
+        return sorted( nslc_id for (nslc_id, channel) in self.channels.iteritems() if not channel.is_empty() )
+
+    def update(self, pile, show_progress=False, max_windows=None):
+        '''Bring overview up to date with the contents of a pile.
+
+        Only files with a path on disk are considered. Files are compared by
+        path and modification time with the state of the last update.
+
+        :param max_windows: if not ``None``, process at most this number of
+            outdated time windows and leave the rest for later calls, see
+            :py:meth:`is_pending`. This lets a GUI spread the work.
+        :returns: True if the overview has been changed
+        '''
+
+        self._find_outdated(pile)
+        if not self.pending:
+            return False
+
+        iws = sorted(self.pending.keys())
+        if max_windows is not None:
+            iws = iws[:max_windows]
+
+        pbar = None
+        if show_progress and progressbar and config.show_progress:
+            widgets = ['Building overview', ' ',
+                    progressbar.Bar(marker='-',left='[',right=']'), ' ',
+                    progressbar.Percentage(), ' ',]
+
+            pbar = progressbar.ProgressBar(widgets=widgets, maxval=len(iws)).start()
+
+        for i, iw in enumerate(iws):
+            self._update_window(pile, iw, self.pending.pop(iw))
+            if pbar:
+                pbar.update(i+1)
+
+        if pbar:
+            pbar.finish()
+
+        return True
+
+    def is_pending(self):
+        '''Check if outdated time windows are left from an incomplete update.'''
+
+        return bool(self.pending)
+
+    def _find_outdated(self, pile):
+        '''Mark time windows affected by added, changed or removed files as pending.'''
+
+        current = {}
+        for file in pile.iter_files():
+            abspath = getattr(file, 'abspath', None)
+            if abspath is not None and file.tmin is not None:
+                current[abspath] = (file.mtime, tuple(sorted(file.nslc_ids)), float(file.tmin), float(file.tmax))
+
+        spans = []
+        for abspath, info in self.files.iteritems():
+            if current.get(abspath, None) != info:
+                spans.append(info[1:])
+
+        for abspath, info in current.iteritems():
+            if self.files.get(abspath, None) != info:
+                spans.append(info[1:])
+
+        ttop = self.tblock(self.nlevels-1)
+        for nslc_ids, tmin, tmax in spans:
+            for iw in xrange(int(math.floor(tmin/ttop)), int(math.floor(tmax/ttop))+1):
+                self.pending.setdefault(iw, set()).update(nslc_ids)
+
+        self.files = current
+
+    def _update_window(self, pile, iw, nslc_ids):
+        ttop = self.tblock(self.nlevels-1)
+        wmin, wmax = iw*ttop, (iw+1)*ttop
+        collected = dict( (nslc_id, []) for nslc_id in nslc_ids )
+        selector = util.NSLCSelector(nslc_ids=nslc_ids)
+        for traces in pile.chopper(tmin=wmin, tmax=wmax, selector=selector):
+            for tr in traces:
+                if tr.nslc_id in collected:
+                    collected[tr.nslc_id].append(_blocks_from_trace(tr, self.tbase, wmin, wmax))
+
+        for nslc_id, parts in collected.iteritems():
+            if nslc_id not in self.channels:
+                self.channels[nslc_id] = ChannelOverview(nslc_id, self.nlevels)
+
+            channel = self.channels[nslc_id]
+            if parts:
+                ib = num.concatenate([ part[0] for part in parts ])
+                order = num.argsort(ib, kind='mergesort')
+                blocks = _aggregate(*[ num.concatenate([ part[k] for part in parts ])[order] for k in range(len(_block_fields)) ])
+            else:
+                blocks = _empty_blocks()
+
+            for ilevel in xrange(self.nlevels):
+                nblocks = self.factor**(self.nlevels-1-ilevel)
+                if ilevel > 0:
+                    blocks = _aggregate(blocks[0] // self.factor, *blocks[1:])
+
+                channel.replace(ilevel, iw*nblocks, (iw+1)*nblocks, blocks)
+
+            self._dirty.add(nslc_id)
+
+    def _level_for(self, tblock):
+        ilevel = 0
+        while ilevel+1 < self.nlevels and self.tblock(ilevel+1) <= tblock:
+            ilevel += 1
+
+        return ilevel
+
+    def get_envelope(self, nslc_id, tmin, tmax, tblock=None):
+        '''Get block-wise min, max and RMS values of a channel.
+
+        :param nslc_id: (network, station, location, channel) tuple
+        :param tmin, tmax: time span
+        :param tblock: desired block duration; the coarsest level with blocks
+            not longer than this is used. If ``None``, the finest level is used.
+
+        :returns: tuple ``(t, tblock, vmin, vmax, rms)``, where *t* are the
+            start times of the blocks and *tblock* their duration, or None if
+            there is no data
+        '''
+
+        channel = self.channels.get(nslc_id, None)
+        if channel is None:
+            return None
+
+        ilevel = 0
+        if tblock is not None:
+            ilevel = self._level_for(tblock)
+
+        tb = self.tblock(ilevel)
+        ib, vmin, vmax, sum, sumsq, n = channel.get(ilevel, int(math.floor(tmin/tb)), int(math.floor(tmax/tb))+1)
+        if ib.size == 0:
+            return None
+
+        return ib*tb, tb, vmin, vmax, num.sqrt(sumsq/n)
+
+    def _summary(self, nslc_id, tmin, tmax):
+        channel = self.channels.get(nslc_id, None)
+        if channel is None:
+            return None
+
+        # use a level which has at least a few blocks in the span
+        ilevel = self._level_for((tmax-tmin)/16.)
+        tb = self.tblock(ilevel)
+        ib, vmin, vmax, sum, sumsq, n = channel.get(ilevel, int(math.floor(tmin/tb)), int(math.floor(tmax/tb))+1)
+        if ib.size == 0:
+            return None
+
+        return num.min(vmin), num.max(vmax), num.sum(sum), num.sum(sumsq), num.sum(n)
+
+    def minmax(self, nslc_ids, tmin, tmax, key=None, mode='minmax'):
+        '''Get data ranges of channels, like :py:func:`trace.minmax` does for traces.
+
+        The values are taken from the blocks overlapping the time span, so
+        the result may include data slightly outside of it.
+
+        :param nslc_ids: list of (network, station, location, channel) tuples
+        :param tmin, tmax: time span
+        :param key: a callable which takes as single argument a (dataless)
+            trace and returns a key for the grouping of the results. If this
+            is ``None``, the default, ``lambda tr: (tr.network, tr.station,
+            tr.location, tr.channel)`` is used.
+        :param mode: 'minmax' or floating point number. If this is 'minmax',
+            minimum and maximum of the data are used, if it is a number, mean
+            +- standard deviation times *mode* is used.
+
+        :returns: a dict with the combined data ranges.
+        '''
+
+        if key is None:
+            key = trace._default_key
+
+        ranges = {}
+        for nslc_id in nslc_ids:
+            s = self._summary(nslc_id, tmin, tmax)
+            if s is None:
+                continue
+
+            vmin, vmax, sum, sumsq, n = s
+            if isinstance(mode, str) and mode == 'minmax':
+                mi, ma = vmin, vmax
+            else:
+                mean = sum/n
+                std = math.sqrt(max(0., sumsq/n - mean**2))
+                mi, ma = mean-std*mode, mean+std*mode
+
+            k = key(trace.Trace(*nslc_id, **dict(tmin=tmin, tmax=tmax, ydata=None)))
+            if k not in ranges:
+                ranges[k] = mi, ma
+            else:
+                tmi, tma = ranges[k]
+                ranges[k] = min(tmi,mi), max(tma,ma)
+
+        return ranges
+
+    def _index_path(self):
+        return os.path.join(self.path, 'index')
+
+    def _channel_path(self, nslc_id):
+        return os.path.join(self.path, '%s.%s.%s.%s.npz' % nslc_id)
+
+    def save(self):
+        '''Write changed parts of the overview to its directory.'''
+
+        if self.path is None:
+            raise OverviewError('no path set for overview')
+
+        util.ensuredir(self.path)
+        for nslc_id in self._dirty:
+            channel = self.channels[nslc_id]
+            arrays = {}
+            for ilevel, blocks in enumerate(channel.levels):
+                for name, a in zip(_block_fields, blocks):
+                    arrays['%s%i' % (name, ilevel)] = a
+
+            f = open(self._channel_path(nslc_id), 'wb')
+            num.savez(f, **arrays)
+            f.close()
+
+        self._dirty = set()
+
+        index = dict(tbase=self.tbase, factor=self.factor, nlevels=self.nlevels,
+                     nslc_ids=self.channels.keys(), files=self.files, pending=self.pending)
+        tmppath = self._index_path() + '.tmp'
+        f = open(tmppath, 'wb')
+        pickle.dump(index, f, protocol=2)
+        f.close()
+        os.rename(tmppath, self._index_path())
+
+    def _load(self):
+        f = open(self._index_path(), 'rb')
+        index = pickle.load(f)
+        f.close()
+
+        if (index['tbase'], index['factor'], index['nlevels']) != (self.tbase, self.factor, self.nlevels):
+            logger.warn('overview in %s has different parameters, using those' % self.path)
+            self.tbase, self.factor, self.nlevels = index['tbase'], index['factor'], index['nlevels']
+
+        self.files = index['files']
+        self.pending = index.get('pending', {})
+        for nslc_id in index['nslc_ids']:
+            channel = ChannelOverview(nslc_id, self.nlevels)
+            try:
+                data = num.load(self._channel_path(nslc_id))
+                channel.levels = [ tuple( data['%s%i' % (name, ilevel)]
+                                          for name in _block_fields )
+                                   for ilevel in xrange(self.nlevels) ]
+            except (IOError, KeyError), e:
+                logger.warn('cannot load overview of channel %s.%s.%s.%s: %s' % (nslc_id + (e,)))
+                # forget files, so that everything is rebuilt on next update
+                self.files = {}
+                self.pending = {}
+
+            self.channels[nslc_id] = channel
+
@@ -1,15 +1,22 @@
 '''A pile contains subpiles which contain tracesfiles which contain traces.'''
 
-import trace, io, util, config
+import trace, io, util, config, mseed, file_watcher
 
 import numpy as num
-import os, pickle, logging, time, weakref, copy, re, sys
+import os, pickle, logging, time, weakref, copy, re, sys, bisect, threading, Queue, math, hashlib
 import cPickle as pickle
+from collections import OrderedDict
 pjoin = os.path.join
 logger = logging.getLogger('pyrocko.pile')
 
 from util import reuse
 from trace import degapper
+from nano import Nano
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
 
 
 progressbar = util.progressbar_module()
@@ -72,6 +79,54 @@ class TracesFileCache(object):
             
         self.modified = set()
 
+    def get_record_index(self, abspath, mtime):
+        '''Get record index of a file, if it is cached and up to date.
+        
+        :param abspath: absolute path of the file
+        :param mtime: modification time of the file
+
+        :returns: :py:class:`pyrocko.mseed.RecordIndex` object or None
+        '''
+
+        fn = self._record_index_path(abspath)
+        if not os.path.isfile(fn):
+            return None
+
+        try:
+            f = open(fn, 'rb')
+            try:
+                path, index_mtime, index = pickle.load(f)
+            finally:
+                f.close()
+
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+
+        if path != abspath or index_mtime != mtime:
+            return None
+
+        return index
+
+    def put_record_index(self, abspath, mtime, index):
+        '''Store record index of a file.
+        
+        Record indices are kept in one file per indexed file, in the
+        subdirectory ``records`` of the cache directory. They are written
+        immediately.
+
+        :param abspath: absolute path of the file
+        :param mtime: modification time of the file
+        :param index: :py:class:`pyrocko.mseed.RecordIndex` object
+        '''
+
+        fn = self._record_index_path(abspath)
+        util.ensuredirs(fn)
+        tmpfn = fn+'.%i.tmp' % os.getpid()
+        f = open(tmpfn, 'wb')
+        pickle.dump((abspath, mtime, index), f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+        os.rename(tmpfn, fn)
+
     def clean(self):
         '''Weed out missing files from the disk caches.'''
         
@@ -86,6 +141,24 @@ class TracesFileCache(object):
             except ValueError:
                 pass
 
+        recordsdir = pjoin(self.cachedir, 'records')
+        if os.path.isdir(recordsdir):
+            for fn in os.listdir(recordsdir):
+                try:
+                    f = open(pjoin(recordsdir, fn), 'rb')
+                    try:
+                        path = pickle.load(f)[0]
+                    finally:
+                        f.close()
+
+                except (IOError, EOFError, ValueError, IndexError, pickle.UnpicklingError):
+                    path = None
+
+                if path is None or not os.path.isfile(path):
+                    os.remove(pjoin(recordsdir, fn))
+
+        self.dircaches = {}
+
     def _get_dircache_for(self, abspath):
         return self._get_dircache(self._dircachepath(abspath))
     
@@ -101,6 +174,9 @@ class TracesFileCache(object):
     def _dircachepath(self, abspath):
         cachefn = "%i" % abs(hash(os.path.dirname(abspath)))
         return  pjoin(self.cachedir, cachefn)
+
+    def _record_index_path(self, abspath):
+        return pjoin(self.cachedir, 'records', hashlib.sha1(abspath).hexdigest())
             
     def _load_dircache(self, cachefilename):
         
@@ -134,14 +210,328 @@ class TracesFileCache(object):
         os.rename(tmpfn, cachefilename)
 
 
-def get_cache(cachedir):
-    '''Get global TracesFileCache object for given directory.'''
-    if cachedir not in TracesFileCache.caches:
-        TracesFileCache.caches[cachedir] = TracesFileCache(cachedir)
+_sqlite_schema = '''
+    CREATE TABLE IF NOT EXISTS files (
+        file_id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE,
+        dir TEXT,
+        format TEXT,
+        mtime REAL);
+
+    CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+
+    CREATE TABLE IF NOT EXISTS traces (
+        file_id INTEGER,
+        network TEXT,
+        station TEXT,
+        location TEXT,
+        channel TEXT,
+        tmin,
+        tmax,
+        nano INTEGER,
+        deltat REAL,
+        mtime REAL,
+        meta BLOB);
+
+    CREATE INDEX IF NOT EXISTS traces_file_id ON traces (file_id);
+
+    CREATE TABLE IF NOT EXISTS record_indices (
+        path TEXT PRIMARY KEY,
+        mtime REAL,
+        data BLOB);
+'''
+
+class SQLiteTracesFileCache(object):
+    '''Manages trace metainformation cache in an SQLite database.
+    
+    The metainformation of all traces is stored in a single database file in
+    the cache directory, with one row per trace. Entries are read lazily, one
+    directory at a time, when first requested. Modifications are collected
+    and written in a single transaction by :py:meth:`dump_modified`. The
+    locking of SQLite allows several processes to read and update the same
+    cache concurrently. Each thread uses its own database connection.
+    '''
+
+    def __init__(self, cachedir):
+        '''Create new cache.
+        
+        :param cachedir: directory to hold the cache database.
+        '''
+
+        self.cachedir = cachedir
+        self.dircaches = {}
+        self.modified = {}
+        self._local = threading.local()
+        util.ensuredir(self.cachedir)
+
+    def get(self, abspath):
+        '''Try to get an item from the cache.
+        
+        :param abspath: absolute path of the object to retrieve
+          
+        :returns: a stored object is returned or None if nothing could be found.
+        '''
+
+        dircache = self._get_dircache(os.path.dirname(abspath))
+        return dircache.get(abspath, None)
+
+    def put(self, abspath, tfile):
+        '''Put an item into the cache.
+        
+        :param abspath: absolute path of the object to be stored
+        :param tfile: object to be stored
+        '''
+
+        dircache = self._get_dircache(os.path.dirname(abspath))
+        dircache[abspath] = tfile
+        self.modified[abspath] = tfile
+
+    def dump_modified(self):
+        '''Save any modifications to disk.'''
+
+        if not self.modified:
+            return
+
+        conn = self._get_connection()
+        try:
+            for abspath, tfile in self.modified.iteritems():
+                self._delete(conn, abspath)
+                cursor = conn.execute(
+                    'INSERT INTO files (path, dir, format, mtime) VALUES (?, ?, ?, ?)',
+                    (abspath, os.path.dirname(abspath), tfile.format, tfile.mtime))
+
+                file_id = cursor.lastrowid
+                conn.executemany(
+                    '''INSERT INTO traces (file_id, network, station, location, channel, 
+                        tmin, tmax, nano, deltat, mtime, meta) 
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    [ (file_id,) + self._header_to_row(header) for header in tfile.iter_header_rows() ])
+
+            conn.commit()
+
+        except:
+            conn.rollback()
+            raise
+
+        self.modified = {}
+
+    def get_record_index(self, abspath, mtime):
+        '''Get record index of a file, if it is cached and up to date.
+        
+        :param abspath: absolute path of the file
+        :param mtime: modification time of the file
+
+        :returns: :py:class:`pyrocko.mseed.RecordIndex` object or None
+        '''
+
+        conn = self._get_connection()
+        row = conn.execute(
+            'SELECT mtime, data FROM record_indices WHERE path = ?', (abspath,)).fetchone()
+
+        if row is None or row[0] != mtime:
+            return None
+
+        return pickle.loads(str(row[1]))
+
+    def put_record_index(self, abspath, mtime, index):
+        '''Store record index of a file.
+        
+        Record indices are kept in a separate table of the database. They are
+        written immediately.
+
+        :param abspath: absolute path of the file
+        :param mtime: modification time of the file
+        :param index: :py:class:`pyrocko.mseed.RecordIndex` object
+        '''
+
+        conn = self._get_connection()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO record_indices (path, mtime, data) VALUES (?, ?, ?)',
+                (abspath, mtime, sqlite3.Binary(pickle.dumps(index, pickle.HIGHEST_PROTOCOL))))
+            conn.commit()
+
+        except:
+            conn.rollback()
+            raise
+
+    def clean(self):
+        '''Weed out missing files from the cache.'''
+
+        self.dump_modified()
+        conn = self._get_connection()
+        try:
+            for (abspath,) in conn.execute('SELECT path FROM files').fetchall():
+                if not os.path.isfile(abspath):
+                    self._delete(conn, abspath)
+
+            for (abspath,) in conn.execute('SELECT path FROM record_indices').fetchall():
+                if not os.path.isfile(abspath):
+                    conn.execute('DELETE FROM record_indices WHERE path = ?', (abspath,))
+
+            conn.commit()
+
+        except:
+            conn.rollback()
+            raise
+
+        self.dircaches = {}
+
+    def _get_connection(self):
+        # sqlite3 connections may only be used in the thread which created them
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(pjoin(self.cachedir, 'traces.sqlite'), timeout=60.)
+            conn.text_factory = str
+            conn.executescript(_sqlite_schema)
+            self._local.conn = conn
+
+        return conn
+
+    def _delete(self, conn, abspath):
+        conn.execute(
+            'DELETE FROM traces WHERE file_id IN (SELECT file_id FROM files WHERE path = ?)', 
+            (abspath,))
+        conn.execute('DELETE FROM files WHERE path = ?', (abspath,))
+
+    def _get_dircache(self, dirname):
+        if dirname not in self.dircaches:
+            self.dircaches[dirname] = self._load_dircache(dirname)
+
+        return self.dircaches[dirname]
+
+    def _load_dircache(self, dirname):
+        conn = self._get_connection()
+        rows = conn.execute(
+            '''SELECT files.path, files.format, files.mtime, traces.network, traces.station, 
+                traces.location, traces.channel, traces.tmin, traces.tmax, traces.nano, 
+                traces.deltat, traces.mtime, traces.meta 
+                FROM files LEFT JOIN traces ON traces.file_id = files.file_id 
+                WHERE files.dir = ? ORDER BY files.file_id, traces.rowid''', (dirname,))
+
+        files = {}
+        for row in rows:
+            abspath, format, mtime = row[:3]
+            if abspath not in files:
+                files[abspath] = (format, mtime, [])
+
+            if row[3] is not None:
+                files[abspath][2].append(self._trace_from_row(row[3:]))
+        
+        cache = {}
+        for abspath, (format, mtime, traces) in files.iteritems():
+            cache[abspath] = TracesFile(None, abspath, format, mtime=mtime, traces=traces)
+
+        return cache
+
+    def _header_to_row(self, header):
+        network, station, location, channel, tmin, tmax, deltat, mtime, meta = header
+        nano = isinstance(tmin, Nano)
+        if nano:
+            tmin, tmax = tmin.v, tmax.v
+
+        if meta is not None:
+            meta = sqlite3.Binary(pickle.dumps(meta, pickle.HIGHEST_PROTOCOL))
+
+        return (network, station, location, channel, tmin, tmax, 
+                nano, deltat, mtime, meta)
+
+    def _trace_from_row(self, row):
+        network, station, location, channel, tmin, tmax, nano, deltat, mtime, meta = row
+        if nano:
+            tmin, tmax = Nano(ns=tmin), Nano(ns=tmax)
+
+        if meta is not None:
+            meta = pickle.loads(str(meta))
+
+        return trace.Trace(network, station, location, channel, tmin, tmax, deltat,
+                           mtime=mtime, meta=meta)
+
+
+def get_cache(cachedir, backend=None):
+    '''Get global cache object for given directory.
+    
+    :param cachedir: directory to hold the cache file(s)
+    :param backend: ``'sqlite'`` for :py:class:`SQLiteTracesFileCache` or
+        ``'pickle'`` for :py:class:`TracesFileCache`. If ``None``, the value of
+        ``config.cache_backend`` is used, which is ``'pickle'`` unless changed,
+        so that existing caches keep being used. The two backends do not share
+        their contents.
+    '''
+
+    if backend is None:
+        backend = config.cache_backend
+
+    if backend == 'sqlite' and sqlite3 is None:
+        logger.warn('sqlite3 module not available, using pickle cache backend.')
+        backend = 'pickle'
+
+    k = (cachedir, backend)
+    if k not in TracesFileCache.caches:
+        if backend == 'sqlite':
+            TracesFileCache.caches[k] = SQLiteTracesFileCache(cachedir)
+        else:
+            TracesFileCache.caches[k] = TracesFileCache(cachedir)
         
-    return TracesFileCache.caches[cachedir]
+    return TracesFileCache.caches[k]
+    
+def _header_record(tr):
+    return (tr.network, tr.station, tr.location, tr.channel, 
+            tr.tmin, tr.tmax, tr.deltat, tr.mtime, tr.meta)
+
+def _trace_from_header_record(record):
+    network, station, location, channel, tmin, tmax, deltat, mtime, meta = record
+    return trace.Trace(network, station, location, channel, tmin, tmax, deltat, 
+                       mtime=mtime, meta=meta)
+
+def _scan_headers(job):
+    '''Read trace headers of a file (runs in worker processes of the loader).'''
+
+    abspath, fileformat, substitutions, mtime = job
+    try:
+        traces = io.load(abspath, format=fileformat, getdata=False, substitutions=substitutions)
+    except (io.FileLoadError, OSError), xerror:
+        return job, None, str(xerror)
+
+    return job, [ _header_record(tr) for tr in traces ], None
+
+def _make_pool(nworkers, initializer=None):
+    try:
+        import multiprocessing
+        return multiprocessing.Pool(nworkers, initializer)
+
+    except (ImportError, OSError), e:
+        logger.warn('Cannot start worker processes, scanning files sequentially (%s)' % e)
+        return None
+
+# (pile, func, chopper_kwargs) of the running map_windows call, inherited by the
+# worker processes when they are forked
+_map_windows_job = None
+
+def _map_windows_init():
+    pile = _map_windows_job[0]
+    cache = pile.get_traces_file_cache()
+    if isinstance(cache, SQLiteTracesFileCache):
+        # the database connection of the parent process must not be shared
+        cache._local = threading.local()
+
+def _map_window(window):
+    '''Apply function of current map_windows job to a single window (runs in worker processes).'''
+
+    pile, func, kwargs = _map_windows_job
+    wmin, wmax = window
+    traces = []
+    for traces in pile.chopper(tmin=wmin, tmax=wmax, tinc=wmax-wmin, **kwargs):
+        pass
+
+    return func(traces)
+
+def loader(filenames, fileformat, cache, filename_attributes, show_progress=True, nworkers=1):
+    '''Create TracesFile objects for the given files, using cache where possible.
     
-def loader(filenames, fileformat, cache, filename_attributes, show_progress=True):
+    If *nworkers* is larger than 1, headers of files which are not found in the
+    cache are read in parallel, by a pool of *nworkers* worker processes.
+    '''
         
     if not filenames:
         logger.warn('No files to load from')
@@ -159,8 +549,14 @@ def loader(filenames, fileformat, cache, filename_attributes, show_progress=True
     if filename_attributes:
         regex = re.compile(filename_attributes)
     
+    pool = None
+    if nworkers > 1:
+        pool = _make_pool(nworkers)
+
     failures = []
-    for ifile, filename in enumerate(filenames):
+    jobs = []
+    ndone = 0
+    for filename in filenames:
         try:
             abspath = os.path.abspath(filename)
             
@@ -182,6 +578,10 @@ def loader(filenames, fileformat, cache, filename_attributes, show_progress=True
                 tfile = cache.get(abspath)
             
             if not tfile or tfile.mtime != mtime or substitutions:
+                if pool is not None:
+                    jobs.append((abspath, fileformat, substitutions, mtime))
+                    continue
+
                 tfile = TracesFile(None, abspath, fileformat, substitutions=substitutions, mtime=mtime)
                 if cache and not substitutions:
                     cache.put(abspath, tfile)
@@ -192,8 +592,35 @@ def loader(filenames, fileformat, cache, filename_attributes, show_progress=True
         else:
             yield tfile
         
-        if pbar: pbar.update(ifile+1)
-    
+        ndone += 1
+        if pbar: pbar.update(ndone)
+   
+    if pool is not None:
+        try:
+            chunksize = max(1, min(100, len(jobs) // (nworkers*4)))
+            for job, records, error in pool.imap(_scan_headers, jobs, chunksize):
+                abspath, fileformat, substitutions, mtime = job
+                if error is not None:
+                    failures.append(abspath)
+                    logger.warn(error)
+                else:
+                    traces = [ _trace_from_header_record(record) for record in records ]
+                    tfile = TracesFile(None, abspath, fileformat, substitutions=substitutions, 
+                                       mtime=mtime, traces=traces)
+                    if cache and not substitutions:
+                        cache.put(abspath, tfile)
+
+                    yield tfile
+
+                ndone += 1
+                if pbar: pbar.update(ndone)
+
+            pool.close()
+
+        finally:
+            pool.terminate()
+            pool.join()
+
     if pbar: pbar.finish()
     if failures:
         logger.warn('The following file%s caused problems and will be ignored:\n' % util.plural_s(len(failures)) + '\n'.join(failures))
@@ -201,6 +628,75 @@ def loader(filenames, fileformat, cache, filename_attributes, show_progress=True
     if cache:
         cache.dump_modified()
 
+class PileChange(object):
+
+    '''Description of the part of a pile affected by a modification.
+
+    Instances of this class are handed to the pile's listeners. The affected
+    part is given by the set of (network, station, location, channel) tuples
+    in :py:attr:`nslc_ids` and the time span :py:attr:`tmin` -
+    :py:attr:`tmax`. If *content* is None, the change is global, i.e. it
+    affects everything in the pile (:py:attr:`nslc_ids` is None then).
+    '''
+
+    def __init__(self, content=None):
+        self.tmin, self.tmax = None, None
+        if content is None:
+            self.nslc_ids = None
+        else:
+            self.nslc_ids = set()
+            self.update(content)
+
+    def update(self, content):
+        '''Extend change by traces or trace groups.'''
+
+        if self.nslc_ids is None:
+            return
+
+        for c in content:
+            if c.tmin is None or c.tmax is None:
+                continue
+
+            if isinstance(c, trace.Trace):
+                self.nslc_ids.add(c.nslc_id)
+            else:
+                self.nslc_ids.update(c.nslc_ids)
+
+            if self.tmin is None:
+                self.tmin, self.tmax = c.tmin, c.tmax
+            else:
+                self.tmin = min(self.tmin, c.tmin)
+                self.tmax = max(self.tmax, c.tmax)
+
+    def is_global(self):
+        return self.nslc_ids is None
+
+    def is_empty(self):
+        return self.nslc_ids is not None and self.tmin is None
+
+    def overlaps(self, tmin, tmax):
+        '''Check if change affects anything in the given time span.'''
+
+        if self.is_global():
+            return True
+
+        if self.is_empty():
+            return False
+
+        return tmax >= self.tmin and self.tmax >= tmin
+
+    def affects(self, nslc_id, tmin, tmax):
+        '''Check if change affects given channel in the given time span.'''
+
+        return self.overlaps(tmin, tmax) and (self.is_global() or nslc_id in self.nslc_ids)
+
+    def __str__(self):
+        if self.is_global():
+            return 'PileChange (global)'
+
+        return 'PileChange (%i channels, %s - %s)' % (
+            len(self.nslc_ids), util.gmctime(self.tmin), util.gmctime(self.tmax))
+
 class TracesGroup(object):
     
     '''Trace container base class.
@@ -250,6 +746,18 @@ class TracesGroup(object):
                 self.locations.add(c.location)
                 self.channels.add(c.channel)
                 self.nslc_ids.add(c.nslc_id)
+
+            elif isinstance(c, TraceHeaderTable):
+                if len(c) == 0:
+                    continue
+
+                for nslc_id in c.nslc_ids:
+                    network, station, location, channel = nslc_id
+                    self.networks.add(network)
+                    self.stations.add(station)
+                    self.locations.add(location)
+                    self.channels.add(channel)
+                    self.nslc_ids.add(nslc_id)
             
             if self.tmin is None:
                 self.tmin = c.tmin
@@ -266,24 +774,38 @@ class TracesGroup(object):
         
         self.nupdates += 1
     
-    def notify_listeners(self, what):
+    def notify_listeners(self, what, change=None):
         pass
     
-    def recursive_grow_update(self, content=None):
+    def recursive_grow_update(self, content=None, change=None):
         
         if content is not None:
             self.update(content, empty=False)
+            if change is None:
+                change = PileChange(content)
         
         if self.parent is not None:
-            self.parent.recursive_grow_update((self,))
+            self.parent.recursive_grow_update((self,), change)
             
-        self.notify_listeners('update')
+        self.notify_listeners('update', change)
     
     def recursive_full_update(self):
         assert False, 'should be implemented in derived class'
         
     def get_update_count(self):
         return self.nupdates
+
+    def get_data_cache(self):
+        if self.parent is not None:
+            return self.parent.get_data_cache()
+
+        return None
+
+    def get_traces_file_cache(self):
+        if self.parent is not None:
+            return self.parent.get_traces_file_cache()
+
+        return None
     
     def overlaps(self, tmin,tmax):
         #return not (tmax < self.tmin or self.tmax < tmin)
@@ -293,6 +815,14 @@ class TracesGroup(object):
         #return  not (tmax <= self.tmin or self.tmax < tmin) and (selector is None or selector(self))
         return  tmax >= self.tmin and self.tmax >= tmin and (group_selector is None or group_selector(self))
 
+    def relevant_nslc_ids(self, tmin, tmax):
+        '''Get ids of the channels which may have data in the given time span.'''
+
+        if self.tmin is None or not self.overlaps(tmin, tmax):
+            return set()
+
+        return set(self.nslc_ids)
+
     def _convert_tuples_to_sets(self):
         if not isinstance(self.networks, set):
             self.networks = set(self.networks)
@@ -323,6 +853,187 @@ class TracesGroup(object):
             self.nslc_ids = reuse(tuple(self.nslc_ids))
             self.have_tuples = True
             
+class TimeIndex(object):
+    
+    '''Lookup structure for time span queries on a collection of trace groups.
+    
+    The entries are kept sorted by their start time. Together with the
+    duration of the longest entry, this allows to find all entries overlapping
+    a given time span by bisection and a scan over the candidates, instead of
+    checking every entry.  Entries must be re-indexed with :py:meth:`update`
+    whenever their time span changes. The durations of all entries are
+    counted, so that the longest duration shrinks again when long entries are
+    removed.
+    '''
+
+    def __init__(self, entries=()):
+        self.clear()
+        for entry in entries:
+            self.add(entry)
+
+    def clear(self):
+        self._tmins = []
+        self._entries = []
+        self._keys = {}
+        self._durations = {}
+        self._maxdur = 0.
+
+    def add(self, entry):
+        if entry.tmin is None or entry.tmax is None:
+            return
+
+        tmin = entry.tmin
+        i = bisect.bisect_right(self._tmins, tmin)
+        self._tmins.insert(i, tmin)
+        self._entries.insert(i, entry)
+        dur = float(entry.tmax - tmin)
+        self._keys[id(entry)] = tmin, dur
+        self._durations[dur] = self._durations.get(dur, 0) + 1
+        self._maxdur = max(self._maxdur, dur)
+
+    def remove(self, entry):
+        if id(entry) not in self._keys:
+            return
+
+        tmin, dur = self._keys.pop(id(entry))
+        self._durations[dur] -= 1
+        if self._durations[dur] == 0:
+            del self._durations[dur]
+            if dur == self._maxdur:
+                self._maxdur = max(self._durations.keys() or [ 0. ])
+
+        i = bisect.bisect_left(self._tmins, tmin)
+        while self._entries[i] is not entry:
+            i += 1
+
+        del self._tmins[i]
+        del self._entries[i]
+
+    def update(self, entry):
+        self.remove(entry)
+        self.add(entry)
+
+    def iter_overlapping(self, tmin, tmax):
+        '''Iterate over entries which have overlap with given time span.
+        
+        The same criterion as in :py:meth:`TracesGroup.is_relevant` is
+        applied, i.e. the span boundaries are inclusive.
+        '''
+
+        ilo = bisect.bisect_left(self._tmins, tmin - self._maxdur)
+        ihi = bisect.bisect_right(self._tmins, tmax)
+        for entry in self._entries[ilo:ihi]:
+            if entry.tmax >= tmin:
+                yield entry
+
+    def __len__(self):
+        return len(self._entries)
+
+class DataCache(object):
+    
+    '''Limits the amount of waveform data kept loaded in a pile.
+    
+    Data of files which are no longer in use (see :py:meth:`TracesFile.use_data`
+    and :py:meth:`TracesFile.drop_data`) is not forgotten immediately, but
+    kept as long as the total size of loaded data does not exceed *max_bytes*,
+    so that it does not have to be re-read when it is needed again, e.g. for
+    overlapping windows. When the limit is exceeded, the data of the least
+    recently used files which are not in use is dropped. Data of files in use
+    is never dropped, so the files needed for the current window may exceed
+    the limit.
+
+    Memory mapped data (see :py:mod:`pyrocko.mmtrace`) does not count towards
+    *max_bytes*, but each mapped file holds an open file descriptor. At most
+    *max_mapped* mapped files which are not in use are kept.
+
+    The attributes *nhits*, *nmisses* and *nevictions* count how often
+    requested data was already loaded, had to be read, and has been dropped
+    to stay within the limits.
+    '''
+
+    def __init__(self, max_bytes=0, max_mapped=64):
+        self.max_bytes = max_bytes
+        self.max_mapped = max_mapped
+        self.nbytes = 0
+        self.nmapped = 0
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevictions = 0
+        # (number of bytes, whether mapped) per file, least recently used first
+        self._entries = OrderedDict()
+
+    def set_max_bytes(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.shrink()
+
+    def set_max_mapped(self, max_mapped):
+        self.max_mapped = max_mapped
+        self.shrink()
+
+    def loaded(self, file):
+        '''Register newly loaded data of a file.'''
+
+        self.nmisses += 1
+        self.discard(file)
+        nbytes = file.get_data_nbytes()
+        mapped = file.is_data_mapped()
+        self._entries[file] = nbytes, mapped
+        self.nbytes += nbytes
+        self.nmapped += mapped
+
+    def hit(self, file):
+        '''Register access to already loaded data of a file.'''
+
+        self.nhits += 1
+        if file in self._entries:
+            self._entries[file] = self._entries.pop(file)
+
+    def release(self, file):
+        '''Called when data of a file is no longer in use.'''
+
+        self.shrink()
+
+    def discard(self, file):
+        '''Forget about a file, e.g. after its data has been dropped.'''
+
+        if file in self._entries:
+            nbytes, mapped = self._entries.pop(file)
+            self.nbytes -= nbytes
+            self.nmapped -= mapped
+
+    def shrink(self):
+        '''Drop data of least recently used files, until within limits.'''
+
+        if self.nbytes <= self.max_bytes and self.nmapped <= self.max_mapped:
+            return
+
+        excess_bytes = self.nbytes - self.max_bytes
+        excess_mapped = self.nmapped - self.max_mapped
+        victims = []
+        for file, (nbytes, mapped) in self._entries.iteritems():
+            if excess_bytes <= 0 and excess_mapped <= 0:
+                break
+
+            if file.data_use_count == 0 and ((excess_bytes > 0 and nbytes > 0) or 
+                                             (excess_mapped > 0 and mapped)):
+                victims.append(file)
+                excess_bytes -= nbytes
+                excess_mapped -= mapped
+
+        for file in victims:
+            file.forget_data()
+            self.nevictions += 1
+
+    def clear(self):
+        for file in self._entries.keys():
+            if file.data_use_count == 0:
+                file.forget_data()
+
+    def __str__(self):
+        return 'DataCache: %i files, %i/%i bytes, %i/%i mapped, %i hits, %i misses, %i evictions' % (
+            len(self._entries), self.nbytes, self.max_bytes, self.nmapped, self.max_mapped, self.nhits,
+            self.nmisses, self.nevictions)
+
 class MemTracesFile(TracesGroup):
     
     '''This is needed to make traces without an actual disc file to be inserted
@@ -420,24 +1131,198 @@ class MemTracesFile(TracesGroup):
         s += 'channels: %s\n' % ', '.join(sl(self.channels))
         return s
 
-class TracesFile(TracesGroup):
-    def __init__(self, parent, abspath, format, substitutions=None, mtime=None):
-        TracesGroup.__init__(self, parent)
-        self.abspath = abspath
-        self.format = format
-        self.traces = []
-        self.data_loaded = False
-        self.data_use_count = 0
-        self.substitutions = substitutions
-        self.load_headers(mtime=mtime)
-        self.update(self.traces)
-        self.mtime = mtime
-        
-    def recursive_full_update(self):
-        self.update(self.traces)
-        
-        if self.parent is not None:
-            self.parent.recursive_full_update()
+class TraceHeaderTable(object):
+    
+    '''Compact storage of trace metainformation.
+    
+    Start and end times, sampling intervals and modification times of a set
+    of dataless traces are held in NumPy arrays and their codes as indices into
+    a list of unique (network, station, location, channel) tuples. Used by
+    :py:class:`TracesFile` to represent its traces while their data is not
+    loaded. :py:class:`pyrocko.trace.Trace` objects are only created on
+    request.
+    '''
+
+    def __init__(self, traces):
+        nslc_to_index = {}
+        self.nslc_ids = []
+        self.inslc = num.zeros(len(traces), dtype=num.int32)
+        for i, tr in enumerate(traces):
+            if tr.nslc_id not in nslc_to_index:
+                nslc_to_index[tr.nslc_id] = len(self.nslc_ids)
+                self.nslc_ids.append(tr.nslc_id)
+
+            self.inslc[i] = nslc_to_index[tr.nslc_id]
+        
+        self.tmins = num.array([ tr.tmin for tr in traces ], dtype=num.float64)
+        self.tmaxs = num.array([ tr.tmax for tr in traces ], dtype=num.float64)
+        self.deltats = num.array([ tr.deltat for tr in traces ], dtype=num.float64)
+        self.mtimes = num.array([ tr.mtime for tr in traces ], dtype=num.float64)
+        self.metas = None
+        if [ tr for tr in traces if tr.meta is not None ]:
+            self.metas = [ tr.meta for tr in traces ]
+
+        self.tmin, self.tmax = None, None
+        if traces:
+            self.tmin = float(self.tmins.min())
+            self.tmax = float(self.tmaxs.max())
+
+    @staticmethod
+    def can_hold(traces):
+        '''Check if traces can be represented (nanosecond times cannot).'''
+
+        for tr in traces:
+            if isinstance(tr.tmin, Nano):
+                return False
+
+        return True
+
+    def __len__(self):
+        return self.tmins.size
+
+    def get_deltats(self):
+        return set([ reuse(float(deltat)) for deltat in num.unique(self.deltats) ])
+
+    def overlapping(self, tmin, tmax):
+        '''Get indices of the entries overlapping with a time span.'''
+
+        return num.nonzero(num.logical_and(self.tmins <= tmax, self.tmaxs >= tmin))[0]
+
+    def iter_rows(self, indices=None):
+        '''Iterate over entries as tuples ``(network, station, location,
+        channel, tmin, tmax, deltat, mtime, meta)``.'''
+
+        if indices is None:
+            indices = xrange(len(self))
+
+        for i in indices:
+            meta = None
+            if self.metas is not None:
+                meta = self.metas[i]
+
+            yield self.nslc_ids[self.inslc[i]] + (
+                float(self.tmins[i]), float(self.tmaxs[i]), reuse(float(self.deltats[i])),
+                float(self.mtimes[i]), meta)
+
+    def iter_traces(self, indices=None):
+        '''Iterate over entries as new dataless :py:class:`pyrocko.trace.Trace` objects.'''
+
+        for network, station, location, channel, tmin, tmax, deltat, mtime, meta in self.iter_rows(indices):
+            yield trace.Trace(network, station, location, channel, tmin, tmax, deltat, 
+                              mtime=mtime, meta=meta)
+
+    def iter_traces_transient(self):
+        '''Iterate over entries as a single dataless trace, updated in place.
+
+        Meant for selector and gather functions, which only look at the trace
+        attributes; the yielded object must not be kept.
+        '''
+
+        tr = None
+        for network, station, location, channel, tmin, tmax, deltat, mtime, meta in self.iter_rows():
+            if tr is None:
+                tr = trace.Trace(network, station, location, channel, tmin, tmax, deltat, 
+                                 mtime=mtime, meta=meta)
+            else:
+                tr.network, tr.station, tr.location, tr.channel = network, station, location, channel
+                tr.tmin, tr.tmax, tr.deltat, tr.mtime, tr.meta = tmin, tmax, deltat, mtime, meta
+                tr._update_ids()
+
+            yield tr
+
+    def make_traces(self, indices=None):
+        '''Create dataless :py:class:`pyrocko.trace.Trace` objects.'''
+
+        return list(self.iter_traces(indices))
+
+class TracesFile(TracesGroup):
+    def __init__(self, parent, abspath, format, substitutions=None, mtime=None, traces=None):
+        TracesGroup.__init__(self, parent)
+        self.abspath = abspath
+        self.format = format
+        self._traces = []
+        self._headers = None
+        self._record_index = None
+        self.data_loaded = False
+        self.data_use_count = 0
+        self.substitutions = substitutions
+        if traces is None:
+            self.load_headers(mtime=mtime)
+        else:
+            self._set_dataless_traces(traces)
+
+        self._update_summary()
+        self.mtime = mtime
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_record_index'] = None
+        return state
+
+    def __setstate__(self, state):
+        self._record_index = None
+        if 'traces' in state:
+            # converted from cache files written by earlier versions
+            state = dict(state)
+            traces = state.pop('traces')
+            self.__dict__.update(state)
+            self._set_dataless_traces(traces)
+        else:
+            self.__dict__.update(state)
+
+    def _get_traces(self):
+        if self._headers is not None:
+            self._traces = self._headers.make_traces()
+            self._headers = None
+
+        return self._traces
+
+    traces = property(_get_traces, doc='''List of traces in the file.
+        
+        While data is not loaded, the headers of the traces are kept in a
+        compact :py:class:`TraceHeaderTable`. Accessing this property turns
+        them into a list of dataless traces, which is kept until data is
+        loaded and forgotten again.''')
+
+    def _iter_traces_transient(self):
+        if self._headers is not None:
+            return self._headers.iter_traces_transient()
+        else:
+            return iter(self._traces)
+
+    def get_ntraces(self):
+        if self._headers is not None:
+            return len(self._headers)
+        else:
+            return len(self._traces)
+
+    def iter_header_rows(self):
+        '''Iterate over trace headers as tuples, see :py:meth:`TraceHeaderTable.iter_rows`.'''
+
+        if self._headers is not None:
+            return self._headers.iter_rows()
+        else:
+            return ( tr.nslc_id + (tr.tmin, tr.tmax, tr.deltat, tr.mtime, tr.meta) for tr in self._traces )
+
+    def _set_dataless_traces(self, traces):
+        if TraceHeaderTable.can_hold(traces):
+            self._headers = TraceHeaderTable(traces)
+            self._traces = None
+        else:
+            self._headers = None
+            self._traces = traces
+
+    def _update_summary(self):
+        if self._headers is not None:
+            self.update((self._headers,))
+        else:
+            self.update(self._traces)
+
+    def recursive_full_update(self):
+        self._update_summary()
+        
+        if self.parent is not None:
+            self.parent.recursive_full_update()
         
         self.notify_listeners('fullupdate')
         
@@ -446,21 +1331,27 @@ class TracesFile(TracesGroup):
         if mtime is None:
             self.mtime = os.stat(self.abspath)[8]
         
-        self.traces = []
-        for tr in io.load(self.abspath, format=self.format, getdata=False, substitutions=self.substitutions):
-            self.traces.append(tr)
+        self._set_dataless_traces(
+            io.load(self.abspath, format=self.format, getdata=False, substitutions=self.substitutions))
             
         self.data_loaded = False
         self.data_use_count = 0
         
     def load_data(self, force=False):
+        cache = self.get_data_cache()
         if not self.data_loaded or force:
             logger.debug('loading data from file: %s' % self.abspath)
-            self.traces = []
+            self._traces = []
             for tr in io.load(self.abspath, format=self.format, getdata=True, substitutions=self.substitutions):
-                self.traces.append(tr)
+                self._traces.append(tr)
                 
+            self._headers = None
             self.data_loaded = True
+            if cache is not None:
+                cache.loaded(self)
+
+        elif cache is not None:
+            cache.hit(self)
     
     def use_data(self):
         if not self.data_loaded: raise Exception('Data not loaded')
@@ -468,74 +1359,191 @@ class TracesFile(TracesGroup):
         
     def drop_data(self):
         if self.data_loaded:
-            if self.data_use_count == 1:
-                logger.debug('forgetting data of file: %s' % self.abspath)
-                for tr in self.traces:
-                    tr.drop_data()
-                    
-                self.data_loaded = False
-                    
-            self.data_use_count -= 1    
+            self.data_use_count = max(0, self.data_use_count - 1)
+            if self.data_use_count == 0:
+                cache = self.get_data_cache()
+                if cache is not None:
+                    cache.release(self)
+                else:
+                    self.forget_data()
         else:
             self.data_use_count = 0
+
+    def forget_data(self):
+        '''Drop loaded data, regardless of whether it is in use.'''
+
+        if self.data_loaded:
+            logger.debug('forgetting data of file: %s' % self.abspath)
+            for tr in self._traces:
+                tr.drop_data()
+            
+            self._set_dataless_traces(self._traces)
+            self.data_loaded = False
+
+            cache = self.get_data_cache()
+            if cache is not None:
+                cache.discard(self)
+
+    def get_data_nbytes(self):
+        '''Get number of bytes used by the loaded data.
+
+        Data which is memory mapped from the file (see
+        :py:mod:`pyrocko.mmtrace`) is not counted, because the operating
+        system can drop it from memory whenever needed.
+        '''
+
+        if not self.data_loaded:
+            return 0
+
+        return sum([ tr.ydata.nbytes for tr in self._traces
+                     if tr.ydata is not None and not isinstance(tr.ydata, num.memmap) ])
+
+    def is_data_mapped(self):
+        '''Check if any of the loaded data is memory mapped from the file.'''
+
+        if not self.data_loaded:
+            return False
+
+        return any( isinstance(tr.ydata, num.memmap) for tr in self._traces )
             
     def reload_if_modified(self):
         mtime = os.stat(self.abspath)[8]
         if mtime != self.mtime:
             logger.debug('mtime=%i, reloading file: %s' % (mtime, self.abspath))
             self.mtime = mtime
+            self._record_index = None
             if self.data_loaded:
                 self.load_data(force=True)
             else:
                 self.load_headers()
             
-            self.update(self.traces)
+            self._update_summary()
             
             return True
             
         return False
        
     def get_newest_mtime(self, tmin, tmax, trace_selector=None):
-        mtime = None
-        for tr in self.traces:
-            if not trace_selector or trace_selector(tr):
-                mtime = max(mtime, self.mtime)
+        if trace_selector is None:
+            if self.tmin is not None:
+                return self.mtime
+            else:
+                return None
+
+        for tr in self._iter_traces_transient():
+            if trace_selector(tr):
+                return self.mtime
                 
-        return mtime
+        return None
+
+    def wants_partial_read(self, tmin, tmax):
+        '''Check if data for a time window should be read without loading the whole file.
+        
+        This is the case for Mini-SEED files which are not loaded yet, when the
+        window is shorter than ``config.pile_partial_read_fraction`` times the
+        time span of the file.
+        '''
+
+        return (self.format == 'mseed' and not self.data_loaded and self.tmin is not None and
+                tmax - tmin < config.pile_partial_read_fraction * float(self.tmax - self.tmin))
+
+    def get_record_index(self):
+        '''Get record index of the file, creating it if necessary.
+        
+        The index is kept with the file object and, if the pile has a traces
+        file cache, stored there and looked up in there for later sessions.
+        '''
+
+        if self._record_index is None:
+            cache = self.get_traces_file_cache()
+            index = None
+            if cache is not None and not self.substitutions:
+                index = cache.get_record_index(self.abspath, self.mtime)
+
+            if index is None:
+                logger.debug('creating record index for file: %s' % self.abspath)
+                index = mseed.get_record_index(self.abspath)
+                if cache is not None and not self.substitutions:
+                    cache.put_record_index(self.abspath, self.mtime, index)
+
+            self._record_index = index
+
+        return self._record_index
+
+    def load_data_partial(self, tmin, tmax, traces):
+        '''Read data of a time window, for the channels of the given traces only.
+        
+        Only the file records overlapping with the window, extended by one
+        sample interval on each side, are decoded. They are located with the
+        record index of the file. The returned traces are not kept in the file
+        and not accounted for in the data cache.
+        '''
+
+        logger.debug('loading partial data from file: %s' % self.abspath)
+        tpad = max([ tr.deltat for tr in traces ])
+        wanted = set([ tr.nslc_id for tr in traces ])
+        substitutions = self.substitutions or {}
+        codes = ('network', 'station', 'location', 'channel')
+
+        def nslc_selector(nslc):
+            return tuple([ substitutions.get(k, v) for (k, v) in zip(codes, nslc) ]) in wanted
+
+        loaded = mseed.load(self.abspath, tmin=tmin-tpad, tmax=tmax+tpad, nslc_selector=nslc_selector,
+                            record_index=self.get_record_index())
+        for tr in loaded:
+            io.make_substitutions(tr, self.substitutions)
+
+        return loaded
 
     def chop(self,tmin,tmax,trace_selector=None, snap=(round,round), load_data=True):
         chopped = []
         used = False
-        needed = [ tr for tr in self.traces if not trace_selector or trace_selector(tr) ]
+        if self._headers is not None:
+            candidates = self._headers.make_traces(self._headers.overlapping(tmin, tmax))
+        else:
+            candidates = self._traces
+
+        needed = [ tr for tr in candidates if not trace_selector or trace_selector(tr) ]
                 
         if needed:
-            if load_data:
+            if load_data and self.wants_partial_read(tmin, tmax):
+                traces = self.load_data_partial(tmin, tmax, needed)
+            elif load_data:
                 self.load_data()
                 used = True
+                traces = [ tr for tr in self._traces if not trace_selector or trace_selector(tr) ]
+            else:
+                traces = needed
 
-            for tr in self.traces:
-                if not trace_selector or trace_selector(tr):
-                    try:
-                        chopped.append(tr.chop(tmin,tmax,inplace=False,snap=snap))
-                    except trace.NoData:
-                        pass
+            for tr in traces:
+                try:
+                    chopped.append(tr.chop(tmin,tmax,inplace=False,snap=snap))
+                except trace.NoData:
+                    pass
             
         return chopped, used
         
     def get_deltats(self):
+        if self._headers is not None:
+            return self._headers.get_deltats()
+
         deltats = set()
-        for trace in self.traces:
+        for trace in self._traces:
             deltats.add(trace.deltat)
             
         return deltats
     
     def iter_traces(self):
-        for trace in self.traces:
-            yield trace
+        if self._headers is not None:
+            for trace in self._headers.iter_traces():
+                yield trace
+        else:
+            for trace in self._traces:
+                yield trace
     
     def gather_keys(self, gather, selector=None):
         keys = set()
-        for trace in self.traces:
+        for trace in self._iter_traces_transient():
             if selector is None or selector(trace):
                 keys.add(gather(trace))
             
@@ -549,7 +1557,7 @@ class TracesFile(TracesGroup):
         s = 'TracesFile\n'
         s += 'abspath: %s\n' % self.abspath
         s += 'file mtime: %s\n' % util.gmctime(self.mtime)
-        s += 'number of traces: %i\n' % len(self.traces)
+        s += 'number of traces: %i\n' % self.get_ntraces()
         s += 'timerange: %s - %s\n' % (util.gmctime(self.tmin), util.gmctime(self.tmax))
         s += 'networks: %s\n' % ', '.join(sl(self.networks))
         s += 'stations: %s\n' % ', '.join(sl(self.stations))
@@ -566,9 +1574,35 @@ class SubPile(TracesGroup):
     def __init__(self, parent):
         TracesGroup.__init__(self, parent)
         self.files = []
+        self.time_index = TimeIndex()
         self.empty()
+
+    def empty(self):
+        TracesGroup.empty(self)
+        self.nslc_spans = {}
+
+    def update(self, content, empty=True):
+        '''Update summary, including the time span covered by each channel.'''
+
+        TracesGroup.update(self, content, empty)
+        spans = self.nslc_spans
+        for file in content:
+            if file.tmin is None:
+                continue
+
+            for nslc_id in file.nslc_ids:
+                if nslc_id in spans:
+                    tmin, tmax = spans[nslc_id]
+                    spans[nslc_id] = min(tmin, file.tmin), max(tmax, file.tmax)
+                else:
+                    spans[nslc_id] = file.tmin, file.tmax
+
+    def relevant_nslc_ids(self, tmin, tmax):
+        return set( nslc_id for (nslc_id, (ctmin, ctmax)) in self.nslc_spans.iteritems()
+                    if tmax >= ctmin and ctmax >= tmin )
         
     def recursive_full_update(self):
+        self.time_index = TimeIndex(self.files)
         self.update(self.files)
         
         if self.parent is not None:
@@ -576,39 +1610,58 @@ class SubPile(TracesGroup):
         
         self.notify_listeners('fullupdate')
     
+    def recursive_grow_update(self, content=None, change=None):
+        if content is not None:
+            for file in content:
+                self.time_index.update(file)
+
+        TracesGroup.recursive_grow_update(self, content, change)
+
     def add_file(self, file):
         self.files.append(file)
+        self.time_index.add(file)
         file.set_parent(self)
         self.update((file,), empty=False)
         
     def remove_file(self, file):
         self.files.remove(file)
+        self.time_index.remove(file)
         file.set_parent(None)
         self.update(self.files)
     
     def remove_files(self, files):
         for file in files:
             self.files.remove(file)
+            self.time_index.remove(file)
             file.set_parent(None)
         self.update(self.files)
     
+    def iter_relevant_files(self, tmin, tmax, group_selector=None):
+        '''Iterate over files which overlap with given time span.
+        
+        Uses the subpile's time index, so that only candidate files are
+        checked.
+        '''
+
+        for file in self.time_index.iter_overlapping(tmin, tmax):
+            if group_selector is None or group_selector(file):
+                yield file
+
     def get_newest_mtime(self, tmin, tmax, group_selector=None, trace_selector=None):
         mtime = None
-        for file in self.files:
-            if file.is_relevant(tmin, tmax, group_selector):
-                mtime = max(mtime, file.get_newest_mtime(tmin, tmax, trace_selector))
+        for file in self.iter_relevant_files(tmin, tmax, group_selector):
+            mtime = max(mtime, file.get_newest_mtime(tmin, tmax, trace_selector))
                 
         return mtime
     
     def chop(self, tmin, tmax, group_selector=None, trace_selector=None, snap=(round,round), load_data=True):
         used_files = set()
         chopped = []
-        for file in self.files:
-            if file.is_relevant(tmin, tmax, group_selector):
-                chopped_, used = file.chop(tmin, tmax, trace_selector, snap, load_data)
-                chopped.extend( chopped_ )
-                if used:
-                    used_files.add(file)
+        for file in self.iter_relevant_files(tmin, tmax, group_selector):
+            chopped_, used = file.chop(tmin, tmax, trace_selector, snap, load_data)
+            chopped.extend( chopped_ )
+            if used:
+                used_files.add(file)
                 
         return chopped, used_files
         
@@ -626,8 +1679,14 @@ class SubPile(TracesGroup):
             
         return deltats
 
-    def iter_traces(self, load_data=False, return_abspath=False, group_selector=None, trace_selector=None):
-        for file in self.files:
+    def iter_traces(self, load_data=False, return_abspath=False, group_selector=None, trace_selector=None,
+                          tmin=None, tmax=None):
+        if tmin is not None and tmax is not None:
+            files = self.time_index.iter_overlapping(tmin, tmax)
+        else:
+            files = self.files
+
+        for file in files:
             
             if group_selector and not group_selector(file):
                 continue
@@ -654,10 +1713,20 @@ class SubPile(TracesGroup):
         for file in self.files:
             yield file
             
-    def reload_modified(self):
+    def reload_modified(self, change=None, files=None):
         modified = False
-        for file in self.files:
-            modified |= file.reload_if_modified()
+        if files is None:
+            files = self.files
+
+        for file in files:
+            if change is not None:
+                old = PileChange((file,))
+
+            if file.reload_if_modified():
+                self.time_index.update(file)
+                modified = True
+                if change is not None:
+                    change.update((old, file))
         
         if modified:
             self.update(self.files)
@@ -679,56 +1748,154 @@ class SubPile(TracesGroup):
         return s
 
              
+def dispatch_by_month(file):
+    tt = time.gmtime(int(file.tmin))
+    return (tt[0],tt[1])
+
+def dispatch_by_day(file):
+    tt = time.gmtime(int(file.tmin))
+    return (tt[0],tt[1],tt[2])
+
+def dispatch_by_station(file):
+    return tuple(sorted(set( nslc_id[:2] for nslc_id in file.nslc_ids )))
+
+def dispatch_by_station_month(file):
+    return (dispatch_by_station(file), dispatch_by_month(file))
+
+def dispatch_by_station_day(file):
+    return (dispatch_by_station(file), dispatch_by_day(file))
+
+dispatchers = {
+    'month': dispatch_by_month,
+    'day': dispatch_by_day,
+    'station': dispatch_by_station,
+    'station_month': dispatch_by_station_month,
+    'station_day': dispatch_by_station_day,
+}
+
 class Pile(TracesGroup):
-    def __init__(self):
+    '''Waveform archive lookup, data loading and caching infrastructure.
+
+    :param dispatch: how files are bucketed into subpiles, see
+        :py:meth:`set_dispatch`. Default is taken from
+        :py:attr:`config.pile_dispatch`.
+    '''
+
+    def __init__(self, dispatch=None):
         TracesGroup.__init__(self, None)
         self.subpiles = {}
+        self._files_by_path = {}
+        self._paths_by_dir = {}
+        self._dispatch_key = None
+        self.set_dispatch(dispatch)
+        self.time_index = TimeIndex()
         self.update(self.subpiles.values())
         self.open_files = {}
         self.listeners = []
+        self.data_cache = DataCache(config.pile_data_cache_size, config.pile_data_cache_max_mapped)
+        self.traces_file_cache = None
+        self._watch = None
+        self._watcher = None
+
+    def get_data_cache(self):
+        return self.data_cache
+
+    def get_traces_file_cache(self):
+        return self.traces_file_cache
+
+    def set_traces_file_cache(self, cache):
+        '''Set cache to be used for additional per-file information, like record indices.'''
+
+        self.traces_file_cache = cache
+
+    def set_data_cache_size(self, max_bytes):
+        '''Set maximum number of bytes of unused waveform data to keep loaded.'''
+
+        self.data_cache.set_max_bytes(max_bytes)
         
     def recursive_full_update(self):
+        self.time_index = TimeIndex(self.subpiles.values())
         self.update(self.subpiles.values())
-        self.notify_listeners('fullupdate')
+        self.notify_listeners('fullupdate', PileChange())
+
+    def recursive_grow_update(self, content=None, change=None):
+        if content is not None:
+            self._reindex(content)
+
+        TracesGroup.recursive_grow_update(self, content, change)
+
+    def _reindex(self, subpiles):
+        for subpile in subpiles:
+            self.time_index.update(subpile)
     
     def add_listener(self, obj):
+        '''Register a listener.
+        
+        The listener's method ``pile_changed(what, change)`` is called, 
+        whenever the pile is modified. *what* is one of ``'add'``, 
+        ``'remove'``, ``'modified'``, ``'update'`` or ``'fullupdate'``, 
+        *change* is a :py:class:`PileChange` object describing the affected
+        channels and time span.
+        '''
+
         self.listeners.append(weakref.ref(obj))
     
-    def notify_listeners(self, what):
+    def notify_listeners(self, what, change=None):
+        if change is None:
+            change = PileChange()
+
         for ref in self.listeners:
             obj = ref()
             if obj:
-                obj.pile_changed(what)
+                obj.pile_changed(what, change)
     
-    def load_files(self, filenames, filename_attributes=None, fileformat='mseed', cache=None, show_progress=True):
-        l = loader(filenames, fileformat, cache, filename_attributes, show_progress=show_progress)
+    def load_files(self, filenames, filename_attributes=None, fileformat='mseed', cache=None, show_progress=True,
+                         nworkers=1):
+        if cache is not None:
+            self.set_traces_file_cache(cache)
+
+        l = loader(filenames, fileformat, cache, filename_attributes, show_progress=show_progress, 
+                   nworkers=nworkers)
         self.add_files(l)
         
     def add_files(self, files):
         modified_subpiles = set()
+        change = PileChange([])
         for file in files:
             subpile = self.dispatch(file)
             subpile.add_file(file)
             modified_subpiles.add(subpile)
+            change.update((file,))
+            self._index_path(file)
         
+        self._reindex(modified_subpiles)
         self.update(modified_subpiles, empty=False)
-        self.notify_listeners('add')
+        self.notify_listeners('add', change)
         
     def add_file(self, file):
         subpile = self.dispatch(file)
         subpile.add_file(file)
+        self._index_path(file)
+        self._reindex((subpile,))
         self.update((file,), empty=False)
-        self.notify_listeners('add')
+        self.notify_listeners('add', PileChange((file,)))
     
     def remove_file(self, file):
         subpile = file.get_parent()
+        self.data_cache.discard(file)
         subpile.remove_file(file)
+        self._unindex_path(file)
+        self._reindex((subpile,))
         self.update(self.subpiles.values())
-        self.notify_listeners('remove')
+        self.notify_listeners('remove', PileChange((file,)))
         
     def remove_files(self, files):
         subpile_files = {}
+        change = PileChange([])
         for file in files:
+            self.data_cache.discard(file)
+            change.update((file,))
+            self._unindex_path(file)
             subpile = file.get_parent()
             if subpile not in subpile_files:
                 subpile_files[subpile] = []
@@ -738,15 +1905,88 @@ class Pile(TracesGroup):
         for subpile, files in subpile_files.iteritems():
             subpile.remove_files(files)
             
+        self._reindex(subpile_files.keys())
         self.update(self.subpiles.values()) 
-        self.notify_listeners('remove')
+        self.notify_listeners('remove', change)
+
+    def _index_path(self, file):
+        abspath = getattr(file, 'abspath', None)
+        if abspath is not None:
+            self._files_by_path[abspath] = file
+            self._paths_by_dir.setdefault(os.path.dirname(abspath), set()).add(abspath)
+
+    def _unindex_path(self, file):
+        abspath = getattr(file, 'abspath', None)
+        if abspath is not None and self._files_by_path.get(abspath) is file:
+            del self._files_by_path[abspath]
+            dirname = os.path.dirname(abspath)
+            self._paths_by_dir[dirname].discard(abspath)
+            if not self._paths_by_dir[dirname]:
+                del self._paths_by_dir[dirname]
+
+    def _files_below(self, paths):
+        '''Get files with given paths or lying in directories with given paths.
 
+        A file reported both by its own path and by the path of a removed
+        directory is only returned once.
+        '''
+
+        files = set()
+        dirs = set()
+        for path in paths:
+            if path in self._files_by_path:
+                files.add(self._files_by_path[path])
+            else:
+                dirs.add(path)
+
+        if dirs:
+            for dirname, dir_paths in self._paths_by_dir.iteritems():
+                if _is_below(dirname, dirs):
+                    files.update( self._files_by_path[path] for path in dir_paths )
+
+        return list(files)
         
-    def dispatch_key(self, file):
-       
+    def set_dispatch(self, dispatch=None):
+        '''Set how files are bucketed into subpiles.
         
-        tt = time.gmtime(int(file.tmin))
-        return (tt[0],tt[1])
+        Small buckets mean fewer files to look at per subpile, when searching
+        for data in a time span. Station buckets let the pile skip subpiles
+        by channel. The subpiles' summaries record which channels they hold
+        and the time span covered by each of them (see
+        :py:meth:`SubPile.relevant_nslc_ids`), so that group selectors can
+        prune by channel and time.
+
+        :param dispatch: one of ``'month'`` (default), ``'day'``, 
+            ``'station'``, ``'station_month'``, ``'station_day'``, or a 
+            function returning a bucket key for a given file. If None, 
+            :py:attr:`config.pile_dispatch` is used.
+
+        Files already in the pile are redistributed.
+        '''
+
+        if dispatch is None:
+            dispatch = config.pile_dispatch
+
+        if isinstance(dispatch, str):
+            if dispatch not in dispatchers:
+                raise ValueError('unknown dispatch method: %s' % dispatch)
+
+            dispatch = dispatchers[dispatch]
+
+        files = list(self.iter_files())
+        self._dispatch_key = dispatch
+        if files:
+            for subpile in self.subpiles.values():
+                subpile.remove_files(list(subpile.files))
+
+            self.subpiles = {}
+            for file in files:
+                self.dispatch(file).add_file(file)
+
+            self.recursive_full_update()
+
+    def dispatch_key(self, file):
+        return self._dispatch_key(file)
     
     def dispatch(self, file):
         k = self.dispatch_key(file)
@@ -755,27 +1995,46 @@ class Pile(TracesGroup):
             
         return self.subpiles[k]
         
+    def iter_relevant_subpiles(self, tmin, tmax, group_selector=None):
+        '''Iterate over subpiles which overlap with given time span.'''
+
+        for subpile in self.time_index.iter_overlapping(tmin, tmax):
+            if group_selector is None or group_selector(subpile):
+                yield subpile
+
     def get_newest_mtime(self, tmin, tmax, group_selector=None, trace_selector=None):
         mtime = None
-        for subpile in self.subpiles.values():
-            if subpile.is_relevant(tmin,tmax, group_selector):
-                mtime = max(mtime, subpile.get_newest_mtime(tmin, tmax, group_selector, trace_selector))
+        for subpile in self.iter_relevant_subpiles(tmin, tmax, group_selector):
+            mtime = max(mtime, subpile.get_newest_mtime(tmin, tmax, group_selector, trace_selector))
                 
         return mtime
         
-    def chop(self, tmin, tmax, group_selector=None, trace_selector=None, snap=(round,round), load_data=True):
+    def chop(self, tmin, tmax, group_selector=None, trace_selector=None, snap=(round,round), load_data=True,
+             selector=None):
+        '''Cut out traces in given time span.
+
+        If a :py:class:`util.NSLCSelector` is given as *selector*, subpiles and
+        files are skipped based on their summaries, before any data is loaded.
+        It may be combined with the *group_selector* and *trace_selector*
+        functions.
+        '''
+
+        if load_data:
+            self.data_cache.shrink()
+
+        group_selector, trace_selector = _apply_selector(selector, tmin, tmax, group_selector, trace_selector)
+
         chopped = []
         used_files = set()
-        for subpile in self.subpiles.values():
-            if subpile.is_relevant(tmin,tmax, group_selector):
-                _chopped, _used_files =  subpile.chop(tmin, tmax, group_selector, trace_selector, snap, load_data)
-                chopped.extend(_chopped)
-                used_files.update(_used_files)
+        for subpile in self.iter_relevant_subpiles(tmin, tmax, group_selector):
+            _chopped, _used_files =  subpile.chop(tmin, tmax, group_selector, trace_selector, snap, load_data)
+            chopped.extend(_chopped)
+            used_files.update(_used_files)
                 
         return chopped, used_files
 
     def _process_chopped(self, chopped, degap, want_incomplete, wmax, wmin, tpad):
-        chopped.sort(lambda a,b: cmp(a.full_id, b.full_id))
+        chopped.sort(key=lambda tr: tr.full_id)
         if degap:
             chopped = degapper(chopped)
             
@@ -803,48 +2062,59 @@ class Pile(TracesGroup):
         return chopped
             
     def chopper(self, tmin=None, tmax=None, tinc=None, tpad=0., group_selector=None, trace_selector=None,
-                      want_incomplete=True, degap=True, keep_current_files_open=False, accessor_id=None, snap=(round,round), load_data=True):
+                      want_incomplete=True, degap=True, keep_current_files_open=False, accessor_id=None, snap=(round,round), load_data=True,
+                      prefetch=0, selector=None):
+        '''Iterate over the traces of the pile in successive time windows.
+
+        If *prefetch* is larger than zero, the data for up to *prefetch*
+        windows ahead is read by a background thread, while the caller
+        processes the current window. The pile must not be modified while such
+        a prefetching chopper is running.
+
+        A :py:class:`util.NSLCSelector` given as *selector* is passed on to 
+        :py:meth:`chop`.
+
+        Files kept open for *accessor_id* by a previous call are only dropped
+        when they are not excluded by *group_selector*, so that a part of the
+        pile can be re-read without unloading the rest.
+        '''
         
-        if tmin is None:
-            tmin = self.tmin+tpad
-                
-        if tmax is None:
-            tmax = self.tmax-tpad
-            
-        if tinc is None:
-            tinc = tmax-tmin
+        tmin, tmax, tinc, tpad = self._window_params(tmin, tmax, tinc, tpad)
         
         if not self.is_relevant(tmin-tpad,tmax+tpad,group_selector): return
+        if selector is not None and not selector.match_group(self, tmin-tpad, tmax+tpad): return
                 
         if accessor_id not in self.open_files:
             self.open_files[accessor_id] = set()
                 
         open_files = self.open_files[accessor_id]
         
-        iwin = 0
-        while True:
-            chopped = []
-            wmin, wmax = tmin+iwin*tinc, min(tmin+(iwin+1)*tinc, tmax)
-            eps = tinc*1e-6
-            if wmin >= tmax-eps: break
-            chopped, used_files = self.chop(wmin-tpad, wmax+tpad, group_selector, trace_selector, snap, load_data) 
-            for file in used_files - open_files:
-                # increment datause counter on newly opened files
-                file.use_data()
+        if prefetch > 0:
+            windows = self._iter_windows(tmin, tmax, tinc)
+            for processed in self._prefetching_chopper(windows, tpad, group_selector, trace_selector, 
+                                                       want_incomplete, degap, snap, load_data, prefetch, 
+                                                       open_files, selector):
+                yield processed
+
+        else:
+            for wmin, wmax in self._iter_windows(tmin, tmax, tinc):
+                chopped, used_files = self.chop(wmin-tpad, wmax+tpad, group_selector, trace_selector, snap, load_data,
+                                                selector) 
+                for file in used_files - open_files:
+                    # increment datause counter on newly opened files
+                    file.use_data()
+                    
+                open_files.update(used_files)
                 
-            open_files.update(used_files)
-            
-            processed = self._process_chopped(chopped, degap, want_incomplete, wmax, wmin, tpad)
-            yield processed
-                        
-            unused_files = open_files - used_files
-            
-            while unused_files:
-                file = unused_files.pop()
-                file.drop_data()
-                open_files.remove(file)
+                processed = self._process_chopped(chopped, degap, want_incomplete, wmax, wmin, tpad)
+                yield processed
+                            
+                unused_files = self._unused_files(open_files, used_files, group_selector)
                 
-            iwin += 1
+                while unused_files:
+                    file = unused_files.pop()
+                    file.drop_data()
+                    open_files.remove(file)
         
         if not keep_current_files_open:
             while open_files:
@@ -852,6 +2122,176 @@ class Pile(TracesGroup):
                 file.drop_data()
         
         
+    def _unused_files(self, open_files, used_files, group_selector):
+        return set( file for file in open_files - used_files 
+                    if group_selector is None or group_selector(file) )
+
+    def _window_params(self, tmin=None, tmax=None, tinc=None, tpad=0., *args, **kwargs):
+        if tmin is None:
+            tmin = self.tmin+tpad
+                
+        if tmax is None:
+            tmax = self.tmax-tpad
+            
+        if tinc is None:
+            tinc = tmax-tmin
+
+        return tmin, tmax, tinc, tpad
+
+    def _iter_windows(self, tmin, tmax, tinc):
+        iwin = 0
+        while True:
+            wmin, wmax = tmin+iwin*tinc, min(tmin+(iwin+1)*tinc, tmax)
+            eps = tinc*1e-6
+            if wmin >= tmax-eps: break
+            yield wmin, wmax
+            iwin += 1
+
+    def _prefetching_chopper(self, windows, tpad, group_selector, trace_selector, want_incomplete, degap, 
+                             snap, load_data, prefetch, open_files, selector=None):
+        
+        # All loading and dropping of file data is done by the worker thread
+        # while it is alive. Each prefetched window holds a use count on the
+        # files it needs. When the window is handed to the caller, these are
+        # taken over by open_files or given back through the release queue.
+
+        chopped_queue = Queue.Queue(prefetch)
+        release_queue = Queue.Queue()
+        stop = threading.Event()
+        
+        def drop(files):
+            for file in files:
+                file.drop_data()
+
+        def work():
+            try:
+                try:
+                    for wmin, wmax in windows:
+                        while True:
+                            try:
+                                files = release_queue.get_nowait()
+                            except Queue.Empty:
+                                break
+
+                            if files is None:
+                                # stop requested, leave sentinel for the final loop
+                                release_queue.put(None)
+                                break
+
+                            drop(files)
+                            
+                        if stop.isSet():
+                            break
+
+                        chopped, used_files = self.chop(wmin-tpad, wmax+tpad, group_selector, trace_selector, 
+                                                        snap, load_data, selector)
+                        for file in used_files:
+                            file.use_data()
+
+                        chopped_queue.put((wmin, wmax, chopped, used_files))
+
+                except Exception:
+                    chopped_queue.put(sys.exc_info())
+
+            finally:
+                chopped_queue.put(None)
+                while True:
+                    files = release_queue.get()
+                    if files is None:
+                        break
+
+                    drop(files)
+        
+        thread = threading.Thread(target=work)
+        thread.setDaemon(True)
+        thread.start()
+        try:
+            while True:
+                item = chopped_queue.get()
+                if item is None:
+                    break
+
+                if len(item) == 3:
+                    raise item[0], item[1], item[2]
+
+                wmin, wmax, chopped, used_files = item
+                release_queue.put(used_files & open_files)
+                open_files.update(used_files)
+
+                processed = self._process_chopped(chopped, degap, want_incomplete, wmax, wmin, tpad)
+                yield processed
+
+                unused_files = self._unused_files(open_files, used_files, group_selector)
+                open_files.difference_update(unused_files)
+                release_queue.put(unused_files)
+
+        finally:
+            stop.set()
+            release_queue.put(None)
+            pinned = []
+            while thread.isAlive() or not chopped_queue.empty():
+                try:
+                    item = chopped_queue.get(timeout=0.1)
+                    if item is not None and len(item) == 4:
+                        pinned.append(item[3])
+
+                except Queue.Empty:
+                    pass
+
+            thread.join()
+            for files in pinned:
+                drop(files)
+
+    def map_windows(self, func, tmin=None, tmax=None, tinc=None, tpad=0., nworkers=1, **kwargs):
+        '''Apply a function to the traces of successive time windows, using several processes.
+
+        :param func: function to be called with the list of traces of each
+            window, like they are yielded by :py:meth:`chopper`
+        :param nworkers: number of worker processes
+
+        The windows are defined by *tmin*, *tmax*, *tinc* and *tpad* as with
+        :py:meth:`chopper`. Other keyword arguments, e.g. *want_incomplete*,
+        *degap*, *group_selector* or *trace_selector*, are passed on to it.
+
+        The worker processes are forked from the current process, so they share
+        the trace headers of the pile, but read the waveform data on their
+        own. *func* does not need to be picklable, but its results must be.
+
+        :returns: list of the results of *func*, in the order of the windows
+        '''
+
+        global _map_windows_job
+
+        tmin, tmax, tinc, tpad = self._window_params(tmin, tmax, tinc, tpad)
+
+        group_selector = kwargs.get('group_selector', None)
+        if not self.is_relevant(tmin-tpad,tmax+tpad,group_selector): return []
+
+        selector = kwargs.get('selector', None)
+        if selector is not None and not selector.match_group(self, tmin-tpad, tmax+tpad): return []
+
+        pool = None
+        if nworkers > 1:
+            _map_windows_job = (self, func, dict(kwargs, tpad=tpad))
+            pool = _make_pool(nworkers, _map_windows_init)
+
+        if pool is None:
+            _map_windows_job = None
+            return [ func(traces) for traces in self.chopper(tmin, tmax, tinc, tpad, **kwargs) ]
+
+        try:
+            nwindows = int(math.ceil((tmax-tmin)/tinc))
+            chunksize = max(1, min(16, nwindows // (nworkers*4)))
+            results = pool.map(_map_window, self._iter_windows(tmin, tmax, tinc), chunksize)
+            pool.close()
+
+        finally:
+            pool.terminate()
+            pool.join()
+            _map_windows_job = None
+
+        return results
+
     def all(self, *args, **kwargs):
         alltraces = []
         for traces in self.chopper( *args, **kwargs ):
@@ -865,19 +2305,46 @@ class Pile(TracesGroup):
                 yield trace
     
     def chopper_grouped(self, gather, progress=None, *args, **kwargs):
+        '''Iterate over the traces of the pile in successive time windows, grouped by a gather key.
+
+        :param gather: function giving the key of a trace, e.g. ``lambda tr:
+            (tr.network, tr.station, tr.location)``
+        :param progress: label of a progress bar, if one should be shown
+        :param by_window: if ``True``, the output is ordered window by window
+            instead of key by key (keyword argument only)
+
+        Other arguments are passed on to :py:meth:`chopper`; *prefetch* is
+        ignored.
+
+        By default, for each key in key order, the traces of that key are
+        yielded for all time windows, as :py:meth:`chopper` would do with a
+        trace selector for the key. The files holding each key are collected
+        in a single pass over the pile. If the pile is chopped as a single
+        window (no *tinc* given), files holding traces of several keys are
+        kept loaded until their last key has been processed, so that each
+        file is read only once. With several windows, files are dropped when
+        they are not needed for the following windows of the current key.
+
+        With *by_window*, the pile is traversed once, and for each window, one
+        list of traces per key is yielded in key order, so that each file is
+        read at most once per window.
+        '''
+
+        by_window = kwargs.pop('by_window', False)
+
         keys = self.gather_keys(gather)
         if len(keys) == 0: return
-        outer_group_selector = None
-        if 'group_selector' in kwargs:
-            outer_group_selector = kwargs['group_selector']
-            
-        outer_trace_selector = None
-        if 'trace_selector' in kwargs:
-            outer_trace_selector = kwargs['trace_selector']
-        
-        # the use of this gather-cache makes it impossible to modify the pile
-        # during chopping
-        gather_cache = {}
+
+        if by_window:
+            groups = self._chopper_grouped_by_window(gather, keys, *args, **kwargs)
+            tmin, tmax, tinc, tpad = self._window_params(*args, **kwargs)
+            nsteps = 0
+            for window in self._iter_windows(tmin, tmax, tinc):
+                nsteps += 1
+        else:
+            groups = self._chopper_grouped_by_key(gather, keys, *args, **kwargs)
+            nsteps = len(keys)
+
         pbar = None
         progressbar = util.progressbar_module()
         if progress and progressbar and config.show_progress:
@@ -885,29 +2352,105 @@ class Pile(TracesGroup):
                         progressbar.Bar(marker='-',left='[',right=']'), ' ',
                         progressbar.Percentage(), ' ',]
                 
-            pbar = progressbar.ProgressBar(widgets=widgets, maxval=len(keys)).start()
+            pbar = progressbar.ProgressBar(widgets=widgets, maxval=max(1, nsteps)).start()
         
-        for ikey, key in enumerate(keys):
-            def tsel(tr):
-                return gather(tr) == key and (outer_trace_selector is None or 
-                                              outer_trace_selector(tr))
-                    
-            def gsel(gr):
-                if gr not in gather_cache:
-                    gather_cache[gr] = gr.gather_keys(gather)
-                        
-                return key in gather_cache[gr] and (outer_group_selector is None or
-                                                    outer_group_selector(gr))
-            
-            kwargs['trace_selector'] = tsel
-            kwargs['group_selector'] = gsel
-            
-            for traces in self.chopper(*args, **kwargs):
-                yield traces
-                
-            if pbar: pbar.update(ikey+1)
+        for istep, traces in groups:
+            yield traces
+
+            if pbar: pbar.update(istep+1)
         
         if pbar: pbar.finish()
+
+    def _chopper_grouped_by_key(self, gather, keys, tmin=None, tmax=None, tinc=None, tpad=0., group_selector=None,
+                                trace_selector=None, want_incomplete=True, degap=True, keep_current_files_open=False,
+                                accessor_id=None, snap=(round,round), load_data=True, prefetch=0, selector=None):
+
+        tmin, tmax, tinc, tpad = self._window_params(tmin, tmax, tinc, tpad)
+        group_selector, trace_selector = _apply_selector(selector, tmin-tpad, tmax+tpad, group_selector, 
+                                                         trace_selector)
+
+        # the files of all keys are collected in a single pass; this makes it
+        # impossible to modify the pile during chopping
+        key_files = {}
+        nkeys_left = {}
+        for subpile in self.iter_relevant_subpiles(tmin-tpad, tmax+tpad, group_selector):
+            for file in subpile.iter_relevant_files(tmin-tpad, tmax+tpad, group_selector):
+                file_keys = file.gather_keys(gather)
+                for key in file_keys:
+                    key_files.setdefault(key, []).append(file)
+
+                nkeys_left[file] = len(file_keys)
+
+        if accessor_id not in self.open_files:
+            self.open_files[accessor_id] = set()
+                
+        open_files = self.open_files[accessor_id]
+        windows = list(self._iter_windows(tmin, tmax, tinc))
+
+        for ikey, key in enumerate(keys):
+            if key not in key_files:
+                continue
+
+            def tsel(tr):
+                return gather(tr) == key and (trace_selector is None or trace_selector(tr))
+
+            index = TimeIndex(key_files[key])
+            key_open_files = set()
+            for iwin, (wmin, wmax) in enumerate(windows):
+                if load_data:
+                    self.data_cache.shrink()
+
+                chopped = []
+                for file in index.iter_overlapping(wmin-tpad, wmax+tpad):
+                    chopped_, used = file.chop(wmin-tpad, wmax+tpad, tsel, snap, load_data)
+                    chopped.extend(chopped_)
+                    if used:
+                        key_open_files.add(file)
+                        if file not in open_files:
+                            file.use_data()
+                            open_files.add(file)
+
+                yield ikey, self._process_chopped(chopped, degap, want_incomplete, wmax, wmin, tpad)
+
+                if keep_current_files_open:
+                    continue
+
+                if iwin+1 < len(windows):
+                    tnext = windows[iwin+1][0]-tpad
+                else:
+                    tnext = None
+
+                for file in list(key_open_files):
+                    if tnext is not None and file.tmax >= tnext:
+                        continue
+
+                    if len(windows) == 1 and nkeys_left[file] > 1:
+                        continue
+
+                    key_open_files.remove(file)
+                    if file in open_files:
+                        file.drop_data()
+                        open_files.remove(file)
+
+            for file in key_files[key]:
+                nkeys_left[file] -= 1
+                if nkeys_left[file] == 0 and file in open_files and not keep_current_files_open:
+                    file.drop_data()
+                    open_files.remove(file)
+
+        if not keep_current_files_open:
+            while open_files:
+                file = open_files.pop()
+                file.drop_data()
+
+    def _chopper_grouped_by_window(self, gather, keys, *args, **kwargs):
+        for iwin, traces in enumerate(self.chopper(*args, **kwargs)):
+            by_key = {}
+            for tr in traces:
+                by_key.setdefault(gather(tr), []).append(tr)
+
+            for key in keys:
+                yield iwin, by_key.get(key, [])
         
     def gather_keys(self, gather, selector=None):
         keys = set()
@@ -923,10 +2466,26 @@ class Pile(TracesGroup):
             
         return sorted(list(deltats))
     
-    def iter_traces(self, load_data=False, return_abspath=False, group_selector=None, trace_selector=None):
-        for subpile in self.subpiles.values():
+    def iter_traces(self, load_data=False, return_abspath=False, group_selector=None, trace_selector=None,
+                          tmin=None, tmax=None, selector=None):
+        '''Iterate over all traces in the pile.
+        
+        If *tmin* and *tmax* are given, only files overlapping with that time
+        span are considered, which is looked up in the subpiles' time indices.
+        A :py:class:`util.NSLCSelector` may be given as *selector* to skip
+        subpiles and files by their summaries.
+        '''
+
+        group_selector, trace_selector = _apply_selector(selector, tmin, tmax, group_selector, trace_selector)
+
+        if tmin is not None and tmax is not None:
+            subpiles = self.time_index.iter_overlapping(tmin, tmax)
+        else:
+            subpiles = self.subpiles.values()
+
+        for subpile in subpiles:
             if not group_selector or group_selector(subpile):
-                for tr in subpile.iter_traces(load_data, return_abspath, group_selector, trace_selector):
+                for tr in subpile.iter_traces(load_data, return_abspath, group_selector, trace_selector, tmin, tmax):
                     yield tr
     
     def iter_files(self):
@@ -935,15 +2494,117 @@ class Pile(TracesGroup):
                 yield file
    
     def reload_modified(self):
+        '''Reload files which have been modified since they have been loaded.
+
+        If the pile is set up to watch files and directories (see 
+        :py:meth:`watch`), files appearing and disappearing under the watched
+        paths are also added and removed.
+
+        :returns: True if anything has changed
+        '''
+
+        if self._watch is not None:
+            return self._reload_watched()
+
+        return self._reload_files()
+
+    def _reload_files(self, files=None):
+        if files is None:
+            subpile_files = dict( (subpile, None) for subpile in self.subpiles.values() )
+        else:
+            subpile_files = {}
+            for file in files:
+                subpile_files.setdefault(file.get_parent(), []).append(file)
+
         modified = False
-        for subpile in self.subpiles.values():
-            modified |= subpile.reload_modified()
+        change = PileChange([])
+        for subpile, files in subpile_files.iteritems():
+            if subpile.reload_modified(change, files):
+                self.time_index.update(subpile)
+                modified = True
         
         if modified:
             self.update(self.subpiles.values())
-            self.notify_listeners('modified')
+            self.notify_listeners('modified', change)
             
         return modified
+
+    def watch(self, paths, regex=None, selector=None, fileformat='mseed', cache=None, filename_attributes=None,
+              backend=None):
+        '''Let :py:meth:`reload_modified` follow changes below given paths.
+        
+        After calling this method, :py:meth:`reload_modified` additionally
+        adds new files and removes deleted files found under *paths*. Changes
+        are tracked incrementally with inotify, where available, so that
+        checking an idle archive is cheap. Otherwise, the directories are
+        rescanned on each call. Watching starts with the first call to
+        :py:meth:`reload_modified`, which rescans everything once.
+
+        :param paths: files and/or directories to watch
+        :param regex, selector: select files as in :py:func:`util.select_files`
+        :param fileformat, cache, filename_attributes: used to load new files,
+            as in :py:meth:`load_files`
+        :param backend: ``'inotify'``, ``'polling'`` or None for automatic 
+            choice
+        '''
+
+        self.unwatch()
+        if isinstance(paths, str):
+            paths = [ paths ]
+
+        self._watch = dict(paths=list(paths), regex=regex, selector=selector, fileformat=fileformat, cache=cache,
+                           filename_attributes=filename_attributes, backend=backend)
+
+    def unwatch(self):
+        '''Stop watching paths.'''
+
+        if self._watcher is not None:
+            self._watcher.close()
+
+        self._watch = None
+        self._watcher = None
+
+    def _reload_watched(self):
+        w = self._watch
+        if self._watcher is None:
+            self._watcher = file_watcher.get_file_watcher(w['paths'], backend=w['backend'])
+            events = None
+        else:
+            events = self._watcher.poll()
+            if events is not None and not events[0] and not events[1]:
+                return False
+
+        files_by_path = self._files_by_path
+        if events is None:
+            logger.debug('rescanning watched paths')
+            present = set(util.select_files(w['paths'], w['selector'], w['regex'], show_progress=False))
+            removed = [ file for (path, file) in files_by_path.iteritems() 
+                        if self._watcher.is_watched(path) and path not in present ]
+
+            reload_files = None
+            new = [ path for path in present if path not in files_by_path ]
+
+        else:
+            changed, removed_paths = events
+            removed = self._files_below(removed_paths)
+            reload_files = [ files_by_path[path] for path in changed 
+                             if path in files_by_path and os.path.isfile(path) ]
+
+            new = util.select_files([ path for path in changed if path not in files_by_path and os.path.isfile(path) ],
+                                    w['selector'], w['regex'], show_progress=False)
+
+        if removed:
+            self.remove_files(removed)
+
+        modified = False
+        if reload_files is None or reload_files:
+            modified = self._reload_files(reload_files)
+
+        if new:
+            self.add_files(loader(sorted(new), w['fileformat'], w['cache'], w['filename_attributes'], 
+                                  show_progress=False))
+
+        return bool(removed or modified or new)
     
     def get_tmin(self):
         return self.tmin
@@ -980,9 +2641,36 @@ class Pile(TracesGroup):
         from pyrocko.snuffler import snuffle
         snuffle(self, **kwargs)
 
+def _apply_selector(selector, tmin, tmax, group_selector, trace_selector):
+    '''Combine :py:class:`util.NSLCSelector` with group and trace selector functions.'''
+
+    if selector is None:
+        return group_selector, trace_selector
+
+    def gselector(group):
+        return selector.match_group(group, tmin, tmax) and (group_selector is None or group_selector(group))
+
+    def tselector(tr):
+        return selector.match_trace(tr) and (trace_selector is None or trace_selector(tr))
+
+    return gselector, tselector
+
+def _is_below(path, paths):
+    '''Check if path or any of its parent directories is in the set paths.'''
+
+    while True:
+        if path in paths:
+            return True
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+
+        path = parent
+
 def make_pile( paths=None, selector=None, regex=None,
         fileformat = 'mseed',
-        cachedirname='/tmp/pyrocko_cache_%s' % os.environ['USER'], show_progress=True ):
+        cachedirname='/tmp/pyrocko_cache_%s' % os.environ['USER'], show_progress=True, nworkers=1 ):
     
     '''Create pile from given file and directory names.
     
@@ -997,6 +2685,8 @@ def make_pile( paths=None, selector=None, regex=None,
     :param cachedirname: loader cache is stored under this directory. It is
         created as neccessary.
     :param show_progress: show progress bar and other progress information
+    :param nworkers: number of worker processes to use for reading the headers
+        of files not found in the cache
     '''
     if isinstance(paths, str):
         paths = [ paths ]
@@ -1008,7 +2698,7 @@ def make_pile( paths=None, selector=None, regex=None,
 
     cache = get_cache(cachedirname)
     p = Pile()
-    p.load_files( sorted(fns), cache=cache, fileformat=fileformat, show_progress=show_progress)
+    p.load_files( sorted(fns), cache=cache, fileformat=fileformat, show_progress=show_progress, nworkers=nworkers)
     return p
 
 
@@ -535,8 +535,11 @@ def MakePileOverviewClass(base):
             self.active_event_marker = None
             self.ignore_releases = 0
             self.message = None
-            self.reloaded = False
             self.pile_has_changed = False
+            # time span of pile changes per channel, None for a global change
+            self.pile_changes = {}
+            self.overview = None
+            self.overview_outdated = False
             self.phase_names = { 1: 'P', 2: 'S', 3: 'R', 4: 'Q', 5: '?' } 
 
             self.tax = TimeAx()
@@ -700,6 +703,8 @@ def MakePileOverviewClass(base):
             self.menuitem_watch.setCheckable(True)
             self.menuitem_watch.setChecked(False)
             self.menu.addAction(self.menuitem_watch)
+            self.connect( self.menuitem_watch, SIGNAL("toggled(bool)"), self.togglewatch )
+            self.watch_args = None
             
             self.menu.addSeparator()
             
@@ -1019,16 +1024,70 @@ def MakePileOverviewClass(base):
                 if pile is not None:
                      pile.remove_file(mtf)
                    
+        def set_watch(self, paths, **kwargs):
+            '''Set paths to be watched for new and removed files in watch mode.
+            
+            The arguments are passed to :py:meth:`pyrocko.pile.Pile.watch`,
+            while "Watch Files" is checked.
+            '''
+
+            self.watch_args = (paths, kwargs)
+            self.togglewatch(self.menuitem_watch.isChecked())
+
+        def togglewatch(self, checked):
+            if checked and self.watch_args is not None:
+                paths, kwargs = self.watch_args
+                self.pile.watch(paths, **kwargs)
+            else:
+                self.pile.unwatch()
+
         def periodical(self):
             if self.menuitem_watch.isChecked():
                 if self.pile.reload_modified():
                     self.update()
+
+            self.update_overview()
+
+        def update_overview(self):
+            '''Bring overview a step closer to the contents of the pile.
+
+            Only one time window of the overview is rebuilt per call, so that
+            the GUI stays responsive while a large archive is processed.
+            '''
+
+            if self.overview is None:
+                return
+
+            if self.overview_outdated or self.overview.is_pending():
+                self.overview_outdated = False
+                if self.overview.update(self.pile, max_windows=1):
+                    self.update()
     
         def get_pile(self):
             return self.pile
         
-        def pile_changed(self, what):
+        def pile_changed(self, what, change=None):
             self.pile_has_changed = True
+            if change is None or change.is_global():
+                self.pile_changes = None
+
+            elif self.pile_changes is not None and not change.is_empty():
+                for nslc_id in change.nslc_ids:
+                    span = self.pile_changes.get(nslc_id)
+                    if span is None:
+                        self.pile_changes[nslc_id] = [ change.tmin, change.tmax ]
+                    else:
+                        span[0] = min(span[0], change.tmin)
+                        span[1] = max(span[1], change.tmax)
+
+            self.overview_outdated = True
+
+        def set_overview(self, overview):
+            '''Use min/max overview to draw envelopes when zoomed out too far to show traces.'''
+
+            self.overview = overview
+            self.overview_outdated = overview is not None
+            self.update()
            
         def set_gathering(self, gather=None, order=None, color=None):
             
@@ -1042,7 +1101,12 @@ def MakePileOverviewClass(base):
                 color = lambda tr: tr.location
             
             self.gather = gather
-            keys = self.pile.gather_keys(gather, self.trace_filter) 
+            pairs = self.pile.gather_keys(lambda tr: (gather(tr), tr.nslc_id), self.trace_filter) 
+            keys = set( key for (key, nslc_id) in pairs )
+            self.key_to_nslc_ids = {}
+            for key, nslc_id in pairs:
+                self.key_to_nslc_ids.setdefault(key, set()).add(nslc_id)
+
             self.color_gather = color
             self.color_keys = self.pile.gather_keys(color)
             previous_ntracks = self.ntracks
@@ -1071,6 +1135,24 @@ def MakePileOverviewClass(base):
 
             if self.tmin == working_system_time_range[0] and self.tmax == working_system_time_range[1]:
                 self.set_time_range(self.pile.get_tmin(), self.pile.get_tmax())
+
+        def shown_tracks_selector(self):
+            '''Get selector for the channels of the currently shown tracks.
+            
+            Gives None while the pile has changed and the tracks have not yet
+            been regathered, because channels may have been added to the shown
+            tracks.
+            '''
+
+            if self.shown_tracks_range is None or self.pile_has_changed:
+                return None
+
+            l, h = self.shown_tracks_range
+            nslc_ids = set()
+            for key in self.track_keys[l:h]:
+                nslc_ids.update(self.key_to_nslc_ids.get(key, ()))
+
+            return pyrocko.util.NSLCSelector(nslc_ids=nslc_ids)
         
         def set_time_range(self, tmin, tmax):
             if tmin is None:
@@ -1368,7 +1450,7 @@ def MakePileOverviewClass(base):
     
             elif keytext == 'r':
                 if self.pile.reload_modified():
-                    self.reloaded = True
+                    self.update()
     
             elif key_event.key() == Qt.Key_Backspace:
                 self.remove_markers(self.selected_markers())
@@ -1671,7 +1753,9 @@ def MakePileOverviewClass(base):
             else:
                 tselector = selector
 
-            traces = list(self.pile.iter_traces(group_selector=selector, trace_selector=tselector))
+            tmin, tmax = time_projection.get_in_range()
+            traces = list(self.pile.iter_traces(group_selector=selector, trace_selector=tselector,
+                                                tmin=tmin, tmax=tmax))
             traces.sort( key=operator.attrgetter('full_id') ) 
 
             def drawbox(itrack, istyle, traces):
@@ -1780,12 +1864,18 @@ def MakePileOverviewClass(base):
                 
                 processed_traces = self.prepare_cutout(self.tmin, self.tmax, 
                                                     trace_selector=self.trace_selector, 
-                                                    degap=self.menuitem_degap.isChecked())
+                                                    degap=self.menuitem_degap.isChecked(),
+                                                    selector=self.shown_tracks_selector())
                 
                 color_lookup = dict([ (k,i) for (i,k) in enumerate(self.color_keys) ])
                 
                 self.track_to_nslc_ids = {}
                 min_max_for_annot = {}
+                if not processed_traces and self.overview is not None:
+                    ndecimate, tpad, tsee = self.see_data_params()
+                    if (self.tmax - self.tmin) >= tsee:
+                        self.draw_overview(p, self.time_projection, track_projections, min_max_for_annot)
+
                 if processed_traces:
                     yscaler = pyrocko.plot.AutoScaler()
                     data_ranges = pyrocko.trace.minmax(processed_traces, key=self.scaling_key, mode=self.scaling_base)
@@ -1879,6 +1969,68 @@ def MakePileOverviewClass(base):
             
             self.timer_draw.stop()
         
+        def draw_overview(self, p, time_projection, track_projections, min_max_for_annot):
+            '''Draw min/max envelopes of the shown tracks from the overview.
+
+            The overview is only read here, it is updated by
+            :py:meth:`update_overview`.
+            '''
+
+            tmin, tmax = time_projection.get_in_range()
+            umin, umax = time_projection.get_out_range()
+            tblock = (tmax-tmin) / max(1., (umax-umin)) * 2.
+
+            l, h = self.shown_tracks_range
+            nslc_ids = set()
+            for key in self.track_keys[l:h]:
+                nslc_ids.update(self.key_to_nslc_ids.get(key, ()))
+
+            data_ranges = self.overview.minmax(nslc_ids, tmin, tmax, key=self.scaling_key, mode=self.scaling_base)
+            if not self.menuitem_fixscalerange.isChecked():
+                self.old_data_ranges = data_ranges
+            else:
+                data_ranges.update(self.old_data_ranges)
+
+            self.apply_scaling_hooks(data_ranges)
+
+            yscaler = pyrocko.plot.AutoScaler()
+            color = pyrocko.plot.tango_colors['aluminium4']
+            p.setPen(QPen(QColor(*color)))
+            p.setBrush(QBrush(QColor(*color)))
+            for nslc_id in sorted(nslc_ids):
+                header = pyrocko.trace.Trace(*nslc_id, **dict(tmin=tmin, tmax=tmax, ydata=None))
+                gt = self.gather(header)
+                if gt not in self.key_to_row or self.key_to_row[gt] not in track_projections:
+                    continue
+
+                k = self.scaling_key(header)
+                env = self.overview.get_envelope(nslc_id, tmin, tmax, tblock)
+                if env is None or k not in data_ranges:
+                    continue
+
+                itrack = self.key_to_row[gt]
+                self.track_to_nslc_ids.setdefault(itrack, set()).add(nslc_id)
+                track_projection = track_projections[itrack]
+                ymin, ymax, yinc = yscaler.make_scale( data_ranges[k] )
+                track_projection.set_in_range(ymax, ymin)
+
+                if itrack not in min_max_for_annot:
+                    min_max_for_annot[itrack] = (ymin, ymax)
+                elif min_max_for_annot[itrack] != (ymin, ymax):
+                    min_max_for_annot[itrack] = None
+
+                t, tb, vmin, vmax, rms = env
+                ibreaks = num.nonzero(num.diff(t) > tb*1.5)[0] + 1
+                for it1, it2 in zip(num.concatenate(([0], ibreaks)), num.concatenate((ibreaks, [t.size]))):
+                    tt = num.repeat(t[it1:it2], 2)
+                    tt[1::2] += tb
+                    udata = time_projection(num.concatenate((tt, tt[::-1])))
+                    vdata = track_projection(self.gain*num.concatenate((num.repeat(vmax[it1:it2], 2),
+                                                                        num.repeat(vmin[it1:it2], 2)[::-1])))
+                    p.drawPolygon(make_QPolygonF(udata, vdata))
+
+            p.setBrush(Qt.NoBrush)
+
         def see_data_params(self):
 
             # determine padding and downampling requirements
@@ -1899,7 +2051,100 @@ def MakePileOverviewClass(base):
             return ndecimate, tpad, tsee
 
 
-        def prepare_cutout(self, tmin, tmax, trace_selector=None, degap=True):
+        def prepare_processed_traces(self, tmin, tmax, tpad, group_selector=None, trace_selector=None, degap=True,
+                                     show_traces=True, accessor_id=None, keep_current_files_open=False, selector=None):
+            '''Get filtered (and rotated) traces for given time span, without chopping to the view.'''
+            
+            fft_filtering = self.menuitem_fft_filtering.isChecked()
+            lphp = self.menuitem_lphp.isChecked()
+
+            processed_traces = []
+            to_filter = []
+
+            if show_traces:
+
+                for traces in self.pile.chopper( tmin=tmin, tmax=tmax, tpad=tpad,
+                                                want_incomplete=True,
+                                                degap=degap,
+                                                keep_current_files_open=keep_current_files_open, 
+                                                group_selector=group_selector,
+                                                trace_selector=trace_selector,
+                                                selector=selector,
+                                                accessor_id=accessor_id):
+                    for trace in traces:
+                        if not (trace.meta and 'tabu' in trace.meta and trace.meta['tabu']):
+                            to_filter.append(trace)
+
+                        processed_traces.append(trace)
+
+                if fft_filtering:
+                    if self.lowpass is not None or self.highpass is not None:
+                        for trace in to_filter:
+                            high, low = 1./(trace.deltat*len(trace.ydata)),  1./(2.*trace.deltat)
+
+                            if self.lowpass is not None:
+                                low = self.lowpass
+                            if self.highpass is not None:
+                                high = self.highpass
+
+                            trace.bandpass_fft(high, low)
+
+                else:
+                    if self.lowpass is not None and self.menuitem_allowdownsampling.isChecked():
+                        ndecimate2 = []
+                        for trace in to_filter:
+                            deltat_target = 1./self.lowpass * 0.1
+                            ndecimate = max(1, int(math.floor(deltat_target / trace.deltat)))
+                            ndecimate2.append(int(math.log(ndecimate,2)))
+
+                        for i in range(max([0] + ndecimate2)):
+                            pyrocko.trace.downsample_many(
+                                [ trace for (trace, n) in zip(to_filter, ndecimate2) if n > i ], 2)
+
+                    bandpass, lowpass, highpass = [], [], []
+                    for trace in to_filter:
+                        if not lphp and (self.lowpass is not None and self.highpass is not None and
+                            self.lowpass < 0.5/trace.deltat and
+                            self.highpass < 0.5/trace.deltat and
+                            self.highpass < self.lowpass):
+                            bandpass.append(trace)
+                        else:
+                            if self.lowpass is not None:
+                                if self.lowpass < 0.5/trace.deltat:
+                                    lowpass.append(trace)
+
+                            if self.highpass is not None:
+                                if self.lowpass is None or self.highpass < self.lowpass:
+                                    if self.highpass < 0.5/trace.deltat:
+                                        highpass.append(trace)
+
+                    # same filter for many traces: filter in batches
+                    if bandpass:
+                        pyrocko.trace.filter_many(bandpass, 'band', 2, (self.highpass, self.lowpass))
+                    if lowpass:
+                        pyrocko.trace.filter_many(lowpass, 'low', 4, self.lowpass)
+                    if highpass:
+                        pyrocko.trace.filter_many(highpass, 'high', 4, self.highpass)
+
+            if self.rotate != 0.0:
+                phi = self.rotate/180.*math.pi
+                cphi = math.cos(phi)
+                sphi = math.sin(phi)
+                for a in processed_traces:
+                    for b in processed_traces: 
+                        if (a.network == b.network and a.station == b.station and a.location == b.location and
+                            a.channel.lower().endswith('n') and b.channel.lower().endswith('e') and
+                            abs(a.deltat-b.deltat) < a.deltat*0.001 and abs(a.tmin-b.tmin) < a.deltat*0.01 and
+                            len(a.get_ydata()) == len(b.get_ydata())):
+
+                            aydata = a.get_ydata()*cphi+b.get_ydata()*sphi
+                            bydata =-a.get_ydata()*sphi+b.get_ydata()*cphi
+                            a.set_ydata(aydata)
+                            b.set_ydata(bydata)
+
+            return processed_traces
+
+        def prepare_cutout(self, tmin, tmax, trace_selector=None, degap=True, selector=None):
             
             self.timer_cutout.start()
             
@@ -1922,93 +2167,58 @@ def MakePileOverviewClass(base):
             # state vector to decide if cached traces can be used
             vec = (tmin, tmax, trace_selector, degap, self.lowpass, self.highpass, fft_filtering, lphp,
                 show_traces, self.rotate, self.shown_tracks_range,
-                ads, self.pile.get_update_count())
-                
+                ads, selector)
+            
+            changes, self.pile_changes = self.pile_changes, {}
+
+            def clip_tpad(tmin, tmax):
+                return max(self.min_deltat*5., min(tmax-tmin, tpad))
+
             if (self.old_vec and 
                 self.old_vec[0] <= vec[0] and vec[1] <= self.old_vec[1] and
-                vec[2:] == self.old_vec[2:] and not (self.reloaded or self.menuitem_watch.isChecked())):
-                logger.debug('Using cached traces')
-                processed_traces = self.old_processed_traces
-                
+                vec[2:] == self.old_vec[2:]):
+
+                # only refresh tracks affected by changes to the pile
+                ctmin, ctmax = self.old_vec[:2]
+                if changes is not None:
+                    nslc_ids = set( nslc_id for (nslc_id, (tmin_, tmax_)) in changes.iteritems()
+                                    if tmax_ >= ctmin and ctmax >= tmin_ )
+
+                if changes is None:
+                    processed_traces = self.old_processed_traces = None
+                    
+                elif nslc_ids:
+                    if self.rotate != 0.0:
+                        nsls = set( nslc_id[:3] for nslc_id in nslc_ids )
+                        affected = lambda nslc_id: nslc_id[:3] in nsls
+                    else:
+                        affected = lambda nslc_id: nslc_id in nslc_ids
+
+                    logger.debug('Refreshing cached traces of %i channels' % len(nslc_ids))
+                    processed_traces = [ tr for tr in self.old_processed_traces if not affected(tr.nslc_id) ]
+                    processed_traces.extend( 
+                        self.prepare_processed_traces(ctmin, ctmax, clip_tpad(ctmin, ctmax), 
+                            group_selector=lambda gr: any(affected(nslc_id) for nslc_id in gr.nslc_ids),
+                            trace_selector=lambda tr: affected(tr.nslc_id) and (
+                                    trace_selector is None or trace_selector(tr)),
+                            degap=degap, show_traces=show_traces, accessor_id=id(self), 
+                            keep_current_files_open=True, selector=selector) )
+
+                    self.old_processed_traces = processed_traces
+
+                else:
+                    logger.debug('Using cached traces')
+                    processed_traces = self.old_processed_traces
+
             else:
+                processed_traces = None
+
+            if processed_traces is None:
                 self.old_vec = vec
-                
-                tpad = min(tmax-tmin, tpad)
-                tpad = max(self.min_deltat*5., tpad)
-                    
-                processed_traces = []
-                
-                if show_traces:
-                    
-                    for traces in self.pile.chopper( tmin=tmin, tmax=tmax, tpad=tpad,
-                                                    want_incomplete=True,
-                                                    degap=degap,
-                                                    keep_current_files_open=True, 
-                                                    trace_selector=trace_selector,
-                                                    accessor_id=id(self)):
-                        for trace in traces:
-                            
-                            if not (trace.meta and 'tabu' in trace.meta and trace.meta['tabu']):
-                            
-                                if fft_filtering:
-                                    if self.lowpass is not None or self.highpass is not None:
-                                        high, low = 1./(trace.deltat*len(trace.ydata)),  1./(2.*trace.deltat)
-                                        
-                                        if self.lowpass is not None:
-                                            low = self.lowpass
-                                        if self.highpass is not None:
-                                            high = self.highpass
-                                            
-                                        trace.bandpass_fft(high, low)
-                                    
-                                else:
-                                    if self.lowpass is not None:
-                                        deltat_target = 1./self.lowpass * 0.1
-                                        ndecimate = max(1, int(math.floor(deltat_target / trace.deltat)))
-                                        ndecimate2 = int(math.log(ndecimate,2))
-                                        
-                                    else:
-                                        ndecimate = 1
-                                        ndecimate2 = 0
-                                    
-                                    if ndecimate2 > 0 and self.menuitem_allowdownsampling.isChecked():
-                                        for i in range(ndecimate2):
-                                            trace.downsample(2)
-                                    
-                                    
-                                    if not lphp and (self.lowpass is not None and self.highpass is not None and
-                                        self.lowpass < 0.5/trace.deltat and
-                                        self.highpass < 0.5/trace.deltat and
-                                        self.highpass < self.lowpass):
-                                        trace.bandpass(2,self.highpass, self.lowpass)
-                                    else:
-                                        if self.lowpass is not None:
-                                            if self.lowpass < 0.5/trace.deltat:
-                                                trace.lowpass(4,self.lowpass)
-                                        
-                                        if self.highpass is not None:
-                                            if self.lowpass is None or self.highpass < self.lowpass:
-                                                if self.highpass < 0.5/trace.deltat:
-                                                    trace.highpass(4,self.highpass)
-                            
-                            processed_traces.append(trace)
-                    
-                if self.rotate != 0.0:
-                    phi = self.rotate/180.*math.pi
-                    cphi = math.cos(phi)
-                    sphi = math.sin(phi)
-                    for a in processed_traces:
-                        for b in processed_traces: 
-                            if (a.network == b.network and a.station == b.station and a.location == b.location and
-                                a.channel.lower().endswith('n') and b.channel.lower().endswith('e') and
-                                abs(a.deltat-b.deltat) < a.deltat*0.001 and abs(a.tmin-b.tmin) < a.deltat*0.01 and
-                                len(a.get_ydata()) == len(b.get_ydata())):
-                                
-                                aydata = a.get_ydata()*cphi+b.get_ydata()*sphi
-                                bydata =-a.get_ydata()*sphi+b.get_ydata()*cphi
-                                a.set_ydata(aydata)
-                                b.set_ydata(bydata)
-                                
+                processed_traces = self.prepare_processed_traces(tmin, tmax, clip_tpad(tmin, tmax), 
+                    trace_selector=trace_selector, degap=degap, show_traces=show_traces, 
+                    accessor_id=id(self), keep_current_files_open=True, selector=selector)
+
                 self.old_processed_traces = processed_traces
             
             chopped_traces = []
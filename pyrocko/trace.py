@@ -4,7 +4,7 @@
 '''
 
 import util, evalresp
-import time, math, copy, logging, sys
+import os, time, math, copy, logging, sys
 import numpy as num
 from util import reuse
 from scipy import signal
@@ -39,7 +39,7 @@ class Trace(object):
     are silently truncated when the trace is stored
     '''
 
-    cached_frequencies = {}
+    cached_frequencies = util.LRUCache(maxsize=64, maxbytes=32*1024**2)
         
     def __init__(self, network='', station='STA', location='', channel='', 
                  tmin=0., tmax=None, deltat=1., ydata=None, mtime=None, meta=None):
@@ -397,31 +397,34 @@ class Trace(object):
         :param demean: whether to demean the signal before filtering.
         '''
 
-        newdeltat = self.deltat*ndecimate
-        if snap:
-            ilag = (math.ceil(self.tmin / newdeltat) * newdeltat - self.tmin)/self.deltat
-            
-        if snap and ilag > 0 and ilag < self.ydata.size:
-            data = self.ydata.astype(num.float64)
-            self.tmin += ilag*self.deltat
-        else:
-            data = self.ydata.astype(num.float64)
-        
+        data = self.ydata.astype(num.float64)
         if demean:
             data -= num.mean(data)
         
         result = util.decimate(data, ndecimate, ftype='fir', zi=initials)
         if initials is None:
-            self.ydata, finals = result, None
+            ydata, finals = result, None
         else:
-            self.ydata, finals = result
+            ydata, finals = result
             
+        self._set_decimated(ydata, ndecimate, snap)
+        
+        return finals
+
+    def _set_decimated(self, ydata, ndecimate, snap):
+        '''Set data decimated by *ndecimate* and update timing accordingly.'''
+
+        if snap:
+            newdeltat = self.deltat*ndecimate
+            ilag = (math.ceil(self.tmin / newdeltat) * newdeltat - self.tmin)/self.deltat
+            if ilag > 0 and ilag < self.ydata.size:
+                self.tmin += ilag*self.deltat
+
+        self.ydata = ydata
         self.deltat = reuse(self.deltat*ndecimate)
         self.tmax = self.tmin+(len(self.ydata)-1)*self.deltat
         self._update_ids()
         
-        return finals
-        
     def downsample_to(self, deltat, snap=False, allow_upsample_max=1, initials=None, demean=True):
         '''Downsample to given sampling rate.
 
@@ -483,62 +486,61 @@ class Trace(object):
             if raise_exception:
                 raise AboveNyquist(message)
             
-    def lowpass(self, order, corner, nyquist_warn=True, nyquist_exception=False, demean=True):
+    def lowpass(self, order, corner, nyquist_warn=True, nyquist_exception=False, demean=True, sos=False,
+                zero_phase=False):
         '''Apply Butterworth lowpass to the trace.
         
         :param order: order of the filter
         :param corner: corner frequency of the filter
+        :param sos: whether to filter in second-order sections, which is
+            numerically stable also for high orders and corners far below
+            the Nyquist frequency
+        :param zero_phase: whether to filter forward and backward, so that
+            the phase is not distorted (the effective order is doubled)
 
         Mean is removed before filtering.
         '''
         self.nyquist_check(corner, 'Corner frequency of lowpass', nyquist_warn, nyquist_exception)
-        (b,a) = _get_cached_filter_coefs(order, [corner*2.0*self.deltat], btype='low')
-        if len(a) != order+1 or len(b) != order+1:
-            logger.warn('Erroneous filter coefficients returned by scipy.signal.butter(). You may need to downsample the signal before filtering.')
-
-        data = self.ydata.astype(num.float64)
-        if demean:
-            data -= num.mean(data)
-        self.drop_growbuffer()
-        self.ydata = signal.lfilter(b,a, data)
+        self._butterworth('low', order, [corner], demean, sos, zero_phase)
         
-    def highpass(self, order, corner, nyquist_warn=True, nyquist_exception=False, demean=True):
+    def highpass(self, order, corner, nyquist_warn=True, nyquist_exception=False, demean=True, sos=False,
+                 zero_phase=False):
         '''Apply butterworth highpass to the trace.
 
         :param order: order of the filter
         :param corner: corner frequency of the filter
+        :param sos: whether to filter in second-order sections, see :py:meth:`lowpass`
+        :param zero_phase: whether to filter forward and backward, see :py:meth:`lowpass`
         
         Mean is removed before filtering.
         '''
 
         self.nyquist_check(corner, 'Corner frequency of highpass', nyquist_warn, nyquist_exception)
-        (b,a) = _get_cached_filter_coefs(order, [corner*2.0*self.deltat], btype='high')
-        data = self.ydata.astype(num.float64)
-        if len(a) != order+1 or len(b) != order+1:
-            logger.warn('Erroneous filter coefficients returned by scipy.signal.butter(). You may need to downsample the signal before filtering.')
-        if demean:
-            data -= num.mean(data)
-        self.drop_growbuffer()
-        self.ydata = signal.lfilter(b,a, data)
+        self._butterworth('high', order, [corner], demean, sos, zero_phase)
         
-    def bandpass(self, order, corner_hp, corner_lp, demean=True):
+    def bandpass(self, order, corner_hp, corner_lp, demean=True, sos=False, zero_phase=False):
         '''Apply butterworth bandpass to the trace.
         
         :param order: order of the filter
         :param corner_hp: lower corner frequency of the filter
         :param corner_lp: upper corner frequency of the filter
+        :param sos: whether to filter in second-order sections, see :py:meth:`lowpass`
+        :param zero_phase: whether to filter forward and backward, see :py:meth:`lowpass`
 
         Mean is removed before filtering.
         '''
 
         self.nyquist_check(corner_hp, 'Lower corner frequency of bandpass')
         self.nyquist_check(corner_lp, 'Higher corner frequency of bandpass')
-        (b,a) = _get_cached_filter_coefs(order, [corner*2.0*self.deltat for corner in (corner_hp, corner_lp)], btype='band')
+        self._butterworth('band', order, [corner_hp, corner_lp], demean, sos, zero_phase)
+
+    def _butterworth(self, btype, order, corners, demean, sos, zero_phase):
+        coefs = _get_butterworth_coefs(order, [corner*2.0*self.deltat for corner in corners], btype, sos)
         data = self.ydata.astype(num.float64)
         if demean:
             data -= num.mean(data)
         self.drop_growbuffer()
-        self.ydata = signal.lfilter(b,a, data)
+        self.ydata = _apply_filter(coefs, data, sos, zero_phase)
     
     def abshilbert(self):
         self.ydata = num.abs(hilbert(self.ydata))
@@ -562,22 +564,45 @@ class Trace(object):
 
     def _get_cached_freqs(self, nf, deltaf):
         ck = (nf, deltaf)
-        if ck not in Trace.cached_frequencies:
-            Trace.cached_frequencies[ck] = num.arange(nf, dtype=num.float)*deltaf
-        return Trace.cached_frequencies[ck]
+        freqs = Trace.cached_frequencies.get(ck)
+        if freqs is None:
+            freqs = num.arange(nf, dtype=num.float)*deltaf
+            freqs.flags.writeable = False
+            Trace.cached_frequencies[ck] = freqs
+
+        return freqs
         
     def bandpass_fft(self, corner_hp, corner_lp):
-        '''Apply boxcar bandbpass to trace (in spectral domain).'''
+        '''Apply boxcar bandbpass to trace (in spectral domain).
+
+        Long traces are filtered block-wise with the overlap-save method, see
+        :py:meth:`transfer`. In this case the boxcar is resolved with a
+        frequency spacing of one tenth of *corner_hp*. Within about
+        ``5/(corner_hp*deltat)`` samples of the trace ends the result then
+        differs from the single FFT, which wraps around cyclically, because
+        the data is taken to be zero outside of the trace.
+        '''
 
         n = len(self.ydata)
-        n2 = nextpow2(n)
+        if corner_hp > 0.:
+            nfir = nextpow2(10./(corner_hp*self.deltat))
+            if _use_overlap_save(n, nfir):
+                freqs = self._get_cached_freqs(nfir/2+1, 1./(self.deltat*nfir))
+                coefs = num.logical_and(corner_hp < freqs, freqs < corner_lp).astype(num.float)
+                coefs[0] = 0.0
+                data = _overlap_save(self.ydata.astype(num.float64), coefs, nfir)
+                self.drop_growbuffer()
+                self.ydata = data
+                return
+
+        n2 = nextfastlen(n)
         data = num.zeros(n2, dtype=num.float64)
         data[:n] = self.ydata
         fdata = num.fft.rfft(data)
         freqs = self._get_cached_freqs(len(fdata), 1./(self.deltat*n2))
         fdata[0] = 0.0
         fdata *= num.logical_and(corner_hp < freqs, freqs < corner_lp)
-        data = num.fft.irfft(fdata)
+        data = num.fft.irfft(fdata, n2)
         self.drop_growbuffer()
         self.ydata = data[:n]
         
@@ -739,6 +764,13 @@ class Trace(object):
         :param transfer_function: FrequencyResponse object; must provide a method 'evaluate(freqs)', which returns the
                                   transfer function coefficients at the frequencies 'freqs'.
         :param cut_off_fading:    whether to cut off rise/fall interval in output trace.
+
+        For traces longer than :py:data:`_overlap_save_min_samples` samples,
+        the transfer function is applied block-wise with the overlap-save
+        method, as a FIR filter which resolves the tapers given by
+        *freqlimits* with at least 8 frequency samples. This bounds the size
+        of the FFTs, instead of transforming the whole padded trace at once.
+        See also :py:meth:`FilterChain.add_transfer`.
         '''
     
         if transfer_function is None:
@@ -748,16 +780,24 @@ class Trace(object):
             raise TraceTooShort('Trace %s.%s.%s.%s too short for fading length setting. trace length = %g, fading length = %g' % (self.nslc_id + (self.tmax-self.tmin, tfade)))
 
         ndata = self.ydata.size
-        ntrans = nextpow2(ndata*1.2)
-        coefs = self._get_tapered_coefs(ntrans, freqlimits, transfer_function)
-        
         data = self.ydata
-        data_pad = num.zeros(ntrans, dtype=num.float)
-        data_pad[:ndata]  = data - data.mean()
-        data_pad[:ndata] *= costaper(0.,tfade, self.deltat*(ndata-1)-tfade, self.deltat*ndata, ndata, self.deltat)
-        fdata = num.fft.rfft(data_pad)
-        fdata *= coefs
-        ddata = num.fft.irfft(fdata)
+        taper = _get_cached_costaper(0.,tfade, self.deltat*(ndata-1)-tfade, self.deltat*ndata, ndata, self.deltat)
+
+        nfir = _transfer_nfir(self.deltat, freqlimits)
+        if nfir is not None and _use_overlap_save(ndata, nfir):
+            coefs = self._get_tapered_coefs(nfir, freqlimits, transfer_function)
+            ddata = _overlap_save((data - data.mean()) * taper, coefs, nfir)
+
+        else:
+            ntrans = nextfastlen(ndata*1.2)
+            coefs = self._get_tapered_coefs(ntrans, freqlimits, transfer_function)
+            data_pad = num.zeros(ntrans, dtype=num.float)
+            data_pad[:ndata]  = data - data.mean()
+            data_pad[:ndata] *= taper
+            fdata = num.fft.rfft(data_pad)
+            fdata *= coefs
+            ddata = num.fft.irfft(fdata, ntrans)
+
         output = self.copy()
         output.ydata = ddata[:ndata]
         if cut_off_fading:
@@ -769,10 +809,12 @@ class Trace(object):
             output.ydata = output.ydata.copy()
         return output
         
-    def spectrum(self, pad_to_pow2=False, tfade=None):
+    def spectrum(self, pad_to_pow2=False, tfade=None, pad_to_fastlen=False):
         '''Get FFT spectrum of trace.
 
         :param pad_to_pow2: whether to zero-pad the data to next larger power-of-two length
+        :param pad_to_fastlen: whether to zero-pad the data to the next larger
+            length for which the FFT is fast, see :py:func:`nextfastlen`
         :param tfade: ``None`` or a time length in seconds, to apply cosine shaped tapers to both
 
         :returns: a tuple with (frequencies, values)
@@ -781,13 +823,15 @@ class Trace(object):
         
         if pad_to_pow2:
             ntrans = nextpow2(ndata)
+        elif pad_to_fastlen:
+            ntrans = nextfastlen(ndata)
         else:
             ntrans = ndata
 
         if tfade is None:
             ydata = self.ydata
         else:
-            ydata = self.ydata * costaper(0., tfade, self.deltat*(ndata-1)-tfade, self.deltat*ndata, ndata, self.deltat)
+            ydata = self.ydata * _get_cached_costaper(0., tfade, self.deltat*(ndata-1)-tfade, self.deltat*ndata, ndata, self.deltat)
             
         fydata = num.fft.rfft(ydata, ntrans)
         df = 1./(ntrans*self.deltat)
@@ -795,18 +839,7 @@ class Trace(object):
         return fxdata, fydata
         
     def _get_tapered_coefs(self, ntrans, freqlimits, transfer_function):
-    
-        deltaf = 1./(self.deltat*ntrans)
-        nfreqs = ntrans/2 + 1
-        transfer = num.ones(nfreqs, dtype=num.complex)
-        hi = snapper(nfreqs, deltaf)
-        a,b,c,d = freqlimits
-        freqs = num.arange(hi(d)-hi(a), dtype=num.float)*deltaf + hi(a)*deltaf
-        transfer[hi(a):hi(d)] = transfer_function.evaluate(freqs)
-        
-        tapered_transfer = costaper(a,b,c,d, nfreqs, deltaf)*transfer
-        tapered_transfer[0] = 0.0 # don't introduce static offsets
-        return tapered_transfer
+        return _get_cached_tapered_coefs(self.deltat, ntrans, freqlimits, transfer_function)
         
     def fill_template(self, template, **additional):
         '''Fill string template with trace metadata.
@@ -878,6 +911,10 @@ class AboveNyquist(Exception):
     '''This exception is raised by some :py:class:`Trace` operations when given frequencies are above the Nyquist frequency.'''
     pass
 
+class FilteringError(Exception):
+    '''This exception is raised when a requested filtering method is not available.'''
+    pass
+
 class TraceTooShort(Exception):
     '''This exception is raised by some :py:class:`Trace` operations when the trace is too short.'''
     pass
@@ -962,6 +999,12 @@ def degapper(traces, maxgap=5, fillmethod='interpolate', deoverlap='use_second')
     This method will combine adjacent traces, which match in their network, 
     station, location and channel attributes. Overlapping parts are handled
     according to the `deoverlap` argument.
+
+    The traces are processed as one batch: in a first pass over the sorted
+    input, the layout of each output trace (positions of the pieces, gap 
+    fillers and overlap regions) is planned, then the data of each output
+    trace is assembled into a single preallocated array. The input list is
+    not modified.
     
     :param traces:      input traces, must be sorted by their full_id attribute.
     :param maxgap:      maximum number of samples to interpolate.
@@ -973,82 +1016,476 @@ def degapper(traces, maxgap=5, fillmethod='interpolate', deoverlap='use_second')
     :returns:           list of traces
     '''
 
-    in_traces = traces 
-    out_traces = []
-    if not in_traces: return out_traces
-    out_traces.append(in_traces.pop(0))
-    while in_traces:
-        
-        a = out_traces[-1]
-        b = in_traces.pop(0)
-        
-        avirt, bvirt = a.ydata is None, b.ydata is None
-        assert avirt == bvirt, 'traces given to degapper() must either all have data or have no data.'
-        virtual = avirt and bvirt
+    if deoverlap not in ('use_second', 'use_first', 'crossfade_cos'):
+        assert False, 'unknown deoverlap method'
 
-        if (a.nslc_id == b.nslc_id and a.deltat == b.deltat and 
-            a.data_len() >= 1 and b.data_len() >= 1 and 
-            (virtual or a.ydata.dtype == b.ydata.dtype)):
-            
-            dist = (b.tmin-(a.tmin+(a.data_len()-1)*a.deltat))/a.deltat
-            idist = int(round(dist))
-            if abs(dist - idist) > 0.05 and idist <= maxgap:
-                pass #logger.warn('Cannot degap traces with displaced sampling (%s,%s,%s,%s)' % a.nslc_id)
-            else:
-                if 1 < idist <= maxgap:
-                    if not virtual:
-                        if fillmethod == 'interpolate':
-                            filler = a.ydata[-1] + (((1.+num.arange(idist-1,dtype=num.float))/idist)*(b.ydata[0]-a.ydata[-1])).astype(a.ydata.dtype)
-                        elif fillmethod == 'zeros':
-                            filler = num.zeros(idist-1,dtype=a.ydist.dtype)
-                        a.ydata = num.concatenate((a.ydata,filler,b.ydata))
-                    a.tmax = b.tmax
-                    if a.mtime and b.mtime:
-                        a.mtime = max(a.mtime, b.mtime)
-                    continue
+    out_traces = []
+    if not traces: return out_traces
+
+    virtual = traces[0].ydata is None
+    for tr in traces:
+        assert (tr.ydata is None) == virtual, \
+            'traces given to degapper() must either all have data or have no data.'
+
+    runs = []
+    a = None
+    for b in traces:
+        if a is not None:
+            if (a.nslc_id == b.nslc_id and a.deltat == b.deltat and 
+                alen >= 1 and b.data_len() >= 1 and 
+                (virtual or a.ydata.dtype == b.ydata.dtype)):
+
+                dist = (b.tmin-(a.tmin+(alen-1)*a.deltat))/a.deltat
+                idist = int(round(dist))
+                if abs(dist - idist) > 0.05 and idist <= maxgap:
+                    pass #logger.warn('Cannot degap traces with displaced sampling (%s,%s,%s,%s)' % a.nslc_id)
+                else:
+                    merged = True
+                    if 1 < idist <= maxgap:
+                        if not virtual:
+                            ops.append(('fill', alen, idist-1, b.ydata[0]))
+                            ops.append(('copy', alen+idist-1, b.ydata))
+                            alen += idist-1 + b.ydata.size
 
-                elif idist == 1:
-                    if not virtual:
-                        a.ydata = num.concatenate((a.ydata,b.ydata))
-                    a.tmax = b.tmax
-                    if a.mtime and b.mtime:
-                        a.mtime = max(a.mtime, b.mtime)
-                    continue
-                    
-                elif idist <= 0:
-                    if b.tmax > a.tmax:
+                    elif idist == 1:
                         if not virtual:
-                            na = a.ydata.size
-                            n = -idist+1
-                            if deoverlap == 'use_second':
-                                a.ydata = num.concatenate((a.ydata[:-n], b.ydata))
-                            elif deoverlap in ('use_first', 'crossfade_cos'):
-                                a.ydata = num.concatenate((a.ydata, b.ydata[n:]))
-                            else:
-                                assert False, 'unknown deoverlap method'
-
-                            if deoverlap == 'crossfade_cos':
-                                n = -idist+1
-                                taper = 0.5-0.5*num.cos((1.+num.arange(n))/(1.+n)*num.pi)
-                                a.ydata[na-n:na] *= 1.-taper
-                                a.ydata[na-n:na] += b.ydata[:n] * taper
+                            ops.append(('copy', alen, b.ydata))
+                            alen += b.ydata.size
 
-                        a.tmax = b.tmax
-                        if a.mtime and b.mtime:
-                            a.mtime = max(a.mtime, b.mtime)
-                        continue
+                    elif idist <= 0:
+                        if b.tmax > tmax:
+                            if not virtual:
+                                n = -idist+1
+                                if deoverlap == 'use_second':
+                                    ops.append(('copy', alen-n, b.ydata))
+                                    alen += b.ydata.size - n
+                                else:
+                                    ops.append(('copy', alen, b.ydata[n:]))
+                                    if deoverlap == 'crossfade_cos':
+                                        ops.append(('crossfade', alen-n, n, b.ydata[:n]))
+                                    alen += b.ydata.size - n
+                        else:
+                            # make short second trace vanish
+                            continue
                     else:
-                        # make short second trace vanish
+                        merged = False
+
+                    if merged:
+                        tmax = b.tmax
+                        if mtime and b.mtime:
+                            mtime = max(mtime, b.mtime)
+                        if virtual:
+                            alen = int(round((tmax-a.tmin)/a.deltat)) + 1
+                        run[2:] = alen, tmax, mtime
                         continue
-                    
-        if b.data_len() >= 1:
-            out_traces.append(b)
-            
+
+            if b.data_len() < 1:
+                continue
+
+        a = b
+        ops = []
+        alen = a.data_len()
+        tmax = a.tmax
+        mtime = a.mtime
+        run = [a, ops, alen, tmax, mtime]
+        runs.append(run)
+        
+    for run in runs:
+        a, ops, alen, tmax, mtime = run
+        if ops:
+            ydata = num.empty(alen, dtype=a.ydata.dtype)
+            ydata[:a.ydata.size] = a.ydata
+            for op in ops:
+                if op[0] == 'copy':
+                    _, pos, data = op
+                    ydata[pos:pos+data.size] = data
+                elif op[0] == 'fill':
+                    _, pos, n, b0 = op
+                    if fillmethod == 'interpolate':
+                        a1 = ydata[pos-1]
+                        ydata[pos:pos+n] = a1 + (((1.+num.arange(n,dtype=num.float))/(n+1))*(b0-a1)).astype(ydata.dtype)
+                    elif fillmethod == 'zeros':
+                        ydata[pos:pos+n] = 0
+                elif op[0] == 'crossfade':
+                    _, pos, n, data = op
+                    taper = 0.5-0.5*num.cos((1.+num.arange(n))/(1.+n)*num.pi)
+                    ydata[pos:pos+n] *= 1.-taper
+                    ydata[pos:pos+n] += data * taper
+
+            a.ydata = ydata
+
+        a.tmax = tmax
+        a.mtime = mtime
+        out_traces.append(a)
+        
     for tr in out_traces:
         tr._update_ids()
     
     return out_traces
 
+_stack_max_samples = 2**18
+
+def _iter_stacked(traces, demean):
+    '''Group traces by sampling interval and length and stack their data.
+
+    Groups are split into batches of at most about :py:data:`_stack_max_samples`
+    samples, to keep the temporary arrays small.
+
+    :returns: iterator yielding tuples ``(deltat, group, data)``, where
+        *data* is a 2D float64 array with the samples of the traces in
+        *group* as rows
+    '''
+
+    groups = {}
+    for tr in traces:
+        groups.setdefault((tr.deltat, tr.ydata.size), []).append(tr)
+
+    for (deltat, n), group in sorted(groups.iteritems()):
+        nbatch = max(1, _stack_max_samples // max(1, n))
+        for ibatch in xrange(0, len(group), nbatch):
+            batch = group[ibatch:ibatch+nbatch]
+            data = num.empty((len(batch), n), dtype=num.float64)
+            for i, tr in enumerate(batch):
+                data[i] = tr.ydata
+
+            if demean and n != 0:
+                data -= num.mean(data, axis=1)[:,num.newaxis]
+
+            yield deltat, batch, data
+
+def filter_many(traces, btype, order, corners, demean=True, nyquist_warn=True, nyquist_exception=False, sos=False,
+                zero_phase=False):
+    '''Apply a Butterworth filter to many traces at once.
+
+    Gives the same results as calling :py:meth:`Trace.lowpass`,
+    :py:meth:`Trace.highpass` or :py:meth:`Trace.bandpass` on each trace, but
+    traces with equal sampling interval and number of samples are stacked
+    into a 2D array and filtered with a single call to
+    :py:func:`scipy.signal.lfilter`. The traces are modified in place.
+
+    :param traces: list of traces
+    :param btype: ``'low'``, ``'high'`` or ``'band'``
+    :param order: order of the filter
+    :param corners: corner frequency of the filter, for ``'band'`` a tuple
+        with lower and upper corner frequency
+    :param demean: whether to remove the mean before filtering
+    :param sos: whether to filter in second-order sections, see :py:meth:`Trace.lowpass`
+    :param zero_phase: whether to filter forward and backward, see :py:meth:`Trace.lowpass`
+    '''
+
+    if btype == 'band':
+        corners = tuple(corners)
+        checks = zip(corners, ('Lower corner frequency of bandpass', 'Higher corner frequency of bandpass'))
+    else:
+        corners = (corners,)
+        checks = [ (corners[0], 'Corner frequency of %spass' % btype) ]
+
+    for tr in traces:
+        for corner, intro in checks:
+            tr.nyquist_check(corner, intro, nyquist_warn, nyquist_exception)
+
+    for deltat, group, data in _iter_stacked(traces, demean):
+        coefs = _get_butterworth_coefs(order, [ corner*2.0*deltat for corner in corners ], btype, sos)
+        filtered = _apply_filter(coefs, data, sos, zero_phase, axis=1)
+        for i, tr in enumerate(group):
+            tr.drop_growbuffer()
+            tr.ydata = filtered[i].copy()
+
+def downsample_many(traces, ndecimate, snap=False, demean=True):
+    '''Downsample many traces at once by a given integer factor.
+
+    Batched version of :py:meth:`Trace.downsample`, filtering traces with
+    equal sampling interval and number of samples in a single call. The
+    traces are modified in place.
+
+    :param ndecimate: decimation factor, avoid values larger than 8
+    :param snap: whether to put the new sampling instances closest to multiples of the sampling rate.
+    :param demean: whether to demean the signal before filtering.
+    '''
+
+    b, a, n = util.decimate_coeffs(ndecimate, None, 'fir')
+    for deltat, group, data in _iter_stacked(traces, demean):
+        decimated = signal.lfilter(b, a, data, axis=1)[:,n/2::ndecimate]
+        for i, tr in enumerate(group):
+            tr._set_decimated(decimated[i].copy(), ndecimate, snap)
+
+def downsample_to_many(traces, deltat, snap=False, allow_upsample_max=1, demean=True):
+    '''Downsample many traces to a given sampling interval.
+
+    Batched version of :py:meth:`Trace.downsample_to`. Traces, for which the
+    ratio of the sampling intervals is an integer, are processed with
+    :py:func:`downsample_many`, all others individually. The traces are
+    modified in place.
+
+    :returns: list of tuples ``(trace, exception)`` for the traces which could
+        not be downsampled, *exception* being the
+        :py:exc:`util.UnavailableDecimation` raised for the trace
+    '''
+
+    failed = []
+    by_deci_seq = {}
+    for tr in traces:
+        ratio = deltat/tr.deltat
+        rratio = round(ratio)
+        if abs(rratio - ratio)/ratio > 0.0001:
+            try:
+                tr.downsample_to(deltat, snap=snap, allow_upsample_max=allow_upsample_max, demean=demean)
+            except util.UnavailableDecimation, e:
+                failed.append((tr, e))
+        else:
+            try:
+                by_deci_seq.setdefault(tuple(util.decitab(int(rratio))), []).append(tr)
+            except util.UnavailableDecimation, e:
+                failed.append((tr, e))
+
+    for deci_seq, group in by_deci_seq.iteritems():
+        for ndecimate in deci_seq:
+            if ndecimate != 1:
+                downsample_many(group, ndecimate, snap=snap, demean=demean)
+
+    return failed
+
+class _FilterStage(object):
+    '''Causal filter step of a :py:class:`FilterChain`, keeping its state.'''
+
+    def __init__(self, coefs, sos):
+        self.coefs = coefs
+        self.sos = sos
+        self.zi = None
+
+    def process(self, data, tmin, deltat):
+        if self.sos:
+            if self.zi is None:
+                self.zi = signal.sosfilt_zi(self.coefs) * data[0]
+            data, self.zi = signal.sosfilt(self.coefs, data, zi=self.zi)
+        else:
+            b, a = self.coefs
+            if self.zi is None:
+                self.zi = signal.lfilter_zi(b, a) * data[0]
+            data, self.zi = signal.lfilter(b, a, data, zi=self.zi)
+
+        return data, tmin, deltat
+
+class _DecimationStage(object):
+    '''Decimation step of a :py:class:`FilterChain`, keeping its state.
+
+    Besides the state of the anti-aliasing filter, the position of the next
+    output sample is tracked, so that pieces of arbitrary length can be
+    processed.
+    '''
+
+    def __init__(self, ndecimate, snap):
+        self.b, _, self.n = util.decimate_coeffs(ndecimate, None, 'fir')
+        self.ndecimate = ndecimate
+        self.snap = snap
+        self.zi = None
+        self.ioff = None
+
+    def process(self, data, tmin, deltat):
+        q, n = self.ndecimate, self.n
+        if self.zi is None:
+            self.zi = signal.lfilter_zi(self.b, [1.]) * data[0]
+            self.ioff = n/2
+            if self.snap:
+                newdeltat = deltat*q
+                self.ioff += int(round((math.ceil(tmin/newdeltat)*newdeltat - tmin)/deltat)) % q
+
+        y, self.zi = signal.lfilter(self.b, [1.], data, zi=self.zi)
+        ydata = y[self.ioff::q].copy()
+        tmin = tmin + (self.ioff - n/2)*deltat
+        self.ioff += ydata.size*q - data.size
+        return ydata, tmin, reuse(deltat*q)
+
+class _OverlapSaveStage(object):
+    '''Frequency domain filter step of a :py:class:`FilterChain`.'''
+
+    def __init__(self, coefs, nfir):
+        self.filter = _OverlapSave(_fir_from_response(coefs, nfir))
+        self.nfir = nfir
+
+    def process(self, data, tmin, deltat):
+        return self.filter.process(data), tmin - (self.nfir/2)*deltat, deltat
+
+class _ChannelState(object):
+    def __init__(self, stages, deltat):
+        self.stages = stages
+        self.deltat = deltat
+        self.tnext = None
+
+    def continues(self, tr):
+        return abs(tr.deltat - self.deltat) < self.deltat*1e-6 and \
+                abs(tr.tmin - self.tnext) < 0.5*self.deltat
+
+class FilterChain(object):
+    '''Chain of causal filters for continuous data arriving in pieces.
+
+    The state of the filters is kept for each channel between calls to
+    :py:meth:`process`, so that a continuous stream, e.g. the successive
+    windows of :py:meth:`pyrocko.pile.Pile.chopper`, can be filtered without
+    padding and without transients at the window boundaries::
+
+        chain = trace.FilterChain()
+        chain.add_highpass(4, 0.01)
+        chain.add_downsample_to(1.0)
+        for traces in p.chopper(tinc=3600.):
+            for tr in chain.process(traces):
+                ...
+
+    When a piece does not continue where the previous piece of its channel
+    ended (gap, overlap or change of sampling rate), the filters of the
+    channel are restarted. Filters are started in steady state for the
+    first sample of a stream, the mean is not removed.
+
+    :param sos: whether to filter in second-order sections, see
+        :py:meth:`Trace.lowpass`
+    '''
+
+    def __init__(self, sos=True, nyquist_warn=True, nyquist_exception=False):
+        self._steps = []
+        self._states = {}
+        self._sos = sos
+        self._nyquist_warn = nyquist_warn
+        self._nyquist_exception = nyquist_exception
+
+    def add_lowpass(self, order, corner):
+        '''Append Butterworth lowpass to the chain.'''
+
+        self._add_step('filter', ('low', order, [corner]))
+
+    def add_highpass(self, order, corner):
+        '''Append Butterworth highpass to the chain.'''
+
+        self._add_step('filter', ('high', order, [corner]))
+
+    def add_bandpass(self, order, corner_hp, corner_lp):
+        '''Append Butterworth bandpass to the chain.'''
+
+        self._add_step('filter', ('band', order, [corner_hp, corner_lp]))
+
+    def add_downsample_to(self, deltat, snap=False):
+        '''Append downsampling to a given sampling interval to the chain.
+
+        The ratio of target and input sampling interval must be an integer,
+        see :py:meth:`Trace.downsample_to`.
+        '''
+
+        self._add_step('downsample', (deltat, snap))
+
+    def add_transfer(self, freqlimits, transfer_function=None, nfir=None):
+        '''Append application of a frequency response to the chain.
+
+        The tapered response is applied as a FIR filter of length *nfir*
+        with the overlap-save method, see :py:meth:`Trace.transfer`. By
+        default, *nfir* is chosen such that the tapers given by *freqlimits*
+        are resolved with at least 8 frequency samples. The output is
+        corrected for the delay of the filter.
+        '''
+
+        if transfer_function is None:
+            transfer_function = FrequencyResponse()
+
+        self._add_step('transfer', (freqlimits, transfer_function, nfir))
+
+    def _add_step(self, kind, args):
+        self._steps.append((kind, args))
+        self.reset()
+
+    def reset(self, nslc_id=None):
+        '''Forget the filter states of one or all channels.'''
+
+        if nslc_id is None:
+            self._states.clear()
+        else:
+            self._states.pop(nslc_id, None)
+
+    def _make_stages(self, tr):
+        stages = []
+        deltat = tr.deltat
+        for kind, args in self._steps:
+            if kind == 'filter':
+                btype, order, corners = args
+                for corner in corners:
+                    if corner >= 0.5/deltat:
+                        message = 'Corner frequency of %spass (%g Hz) is equal to or higher than nyquist frequency (%g Hz). (Trace %s)' \
+                            % (btype, corner, 0.5/deltat, tr.name())
+                        if self._nyquist_warn:
+                            logger.warn(message)
+                        if self._nyquist_exception:
+                            raise AboveNyquist(message)
+
+                coefs = _get_butterworth_coefs(order, [ corner*2.0*deltat for corner in corners ], btype, self._sos)
+                stages.append(_FilterStage(coefs, self._sos))
+
+            elif kind == 'downsample':
+                target_deltat, snap = args
+                ratio = target_deltat/deltat
+                rratio = round(ratio)
+                if abs(rratio - ratio)/ratio > 0.0001:
+                    raise util.UnavailableDecimation('ratio = %g' % ratio)
+
+                for ndecimate in util.decitab(int(rratio)):
+                    if ndecimate != 1:
+                        stages.append(_DecimationStage(ndecimate, snap))
+                        deltat *= ndecimate
+
+            elif kind == 'transfer':
+                freqlimits, transfer_function, nfir = args
+                if nfir is None:
+                    nfir = _transfer_nfir(deltat, freqlimits)
+                    if nfir is None:
+                        raise FilteringError('Tapers of width zero in freqlimits %s need an explicit nfir' % repr(freqlimits))
+
+                coefs = _tapered_coefs(deltat, nfir, freqlimits, transfer_function)
+                stages.append(_OverlapSaveStage(coefs, nfir))
+
+        return stages
+
+    def process(self, traces):
+        '''Run the chain on the next pieces of data.
+
+        The traces are modified in place. Several traces of the same channel
+        must be given in chronological order.
+
+        :param traces: list of traces
+        :returns: list of the traces which still contain samples after
+            processing (downsampling may consume short pieces completely)
+        '''
+
+        processed = []
+        for tr in traces:
+            if tr.ydata is None or tr.ydata.size == 0:
+                continue
+
+            state = self._states.get(tr.nslc_id)
+            if state is None or not state.continues(tr):
+                if state is not None:
+                    logger.debug('Restarting filters for %s (discontinuity at %s)' % 
+                        ('.'.join(tr.nslc_id), util.time_to_str(tr.tmin)))
+
+                state = _ChannelState(self._make_stages(tr), tr.deltat)
+                self._states[tr.nslc_id] = state
+
+            state.tnext = tr.tmax + tr.deltat
+
+            data, tmin, deltat = tr.ydata.astype(num.float64), tr.tmin, tr.deltat
+            for stage in state.stages:
+                data, tmin, deltat = stage.process(data, tmin, deltat)
+                if data.size == 0:
+                    break
+
+            tr.drop_growbuffer()
+            tr.ydata = data
+            if data.size == 0:
+                continue
+
+            tr.tmin = tmin
+            tr.deltat = deltat
+            tr.tmax = tmin+(data.size-1)*deltat
+            tr._update_ids()
+            processed.append(tr)
+
+        return processed
+
 def rotate(traces, azimuth, in_channels, out_channels):
     '''2D rotation of traces.
     
@@ -1428,6 +1865,20 @@ class FrequencyResponse(object):
     def evaluate(self, freqs):
         coefs = num.ones(freqs.size, dtype=num.complex)
         return coefs
+
+    def get_cache_key(self):
+        '''Get hashable key identifying the response by its current parameters.
+
+        Responses with equal keys are assumed to give equal values, which
+        allows :py:meth:`Trace.transfer` to reuse evaluated responses.
+        Returns ``None`` if the response should not be cached; derived
+        classes which do not override this method are not cached.
+        '''
+
+        if type(self) is FrequencyResponse:
+            return (FrequencyResponse,)
+
+        return None
    
 class InverseEvalresp(FrequencyResponse):
     '''Calls evalresp and generates values of the inverse instrument response for 
@@ -1459,6 +1910,14 @@ class InverseEvalresp(FrequencyResponse):
         transfer = x[0][4]
         return 1./transfer
 
+    def get_cache_key(self):
+        try:
+            mtime = os.stat(self.respfile)[8]
+        except OSError:
+            return None
+
+        return (self.__class__, self.respfile, mtime, self.nslc_id, float(self.instant), self.target)
+
 class PoleZeroResponse(FrequencyResponse):
     '''Evaluates frequency response from pole-zero representation.
 
@@ -1487,6 +1946,9 @@ class PoleZeroResponse(FrequencyResponse):
             a /= jomeg-p
         
         return a
+
+    def get_cache_key(self):
+        return (self.__class__, tuple(self.zeros), tuple(self.poles), self.constant)
         
 class SampledResponse(FrequencyResponse):
     '''Interpolates frequency response given at a set of sampled frequencies.
@@ -1539,6 +2001,9 @@ class IntegrationResponse(FrequencyResponse):
     def evaluate(self, freqs):
         return self._gain / (1.0j * 2. * num.pi*freqs)**self._n
 
+    def get_cache_key(self):
+        return (self.__class__, self._n, self._gain)
+
 class DifferentiationResponse(FrequencyResponse):
     '''The differentiation response, optionally multiplied by a constant gain.
 
@@ -1554,6 +2019,9 @@ class DifferentiationResponse(FrequencyResponse):
     def evaluate(self, freqs):
         return self._gain * (1.0j * 2. * num.pi * freqs)**self._n
 
+    def get_cache_key(self):
+        return (self.__class__, self._n, self._gain)
+
 class AnalogFilterResponse(FrequencyResponse):
     '''Frequency response of an analog filter.
     
@@ -1566,6 +2034,9 @@ class AnalogFilterResponse(FrequencyResponse):
     def evaluate(self, freqs):
         return signal.freqs(self._b, self._a, freqs/(2.*pi))[1]
 
+    def get_cache_key(self):
+        return (self.__class__, tuple(self._b), tuple(self._a))
+
 class MultiplyResponse(FrequencyResponse):
     '''Multiplication of two :py:class:`FrequencyResponse` objects.'''
 
@@ -1576,21 +2047,165 @@ class MultiplyResponse(FrequencyResponse):
     def evaluate(self, freqs):
         return self._a.evaluate(freqs) * self._b.evaluate(freqs)
 
+    def get_cache_key(self):
+        ka, kb = self._a.get_cache_key(), self._b.get_cache_key()
+        if ka is None or kb is None:
+            return None
+
+        return (self.__class__, ka, kb)
+
 if sys.version_info >= (2,5):
     from need_python_2_5.trace import *
 
-cached_coefficients = {}
-def _get_cached_filter_coefs(order, corners, btype):
-    ck = (order, tuple(corners), btype)
+cached_coefficients = util.LRUCache(maxsize=256)
+def _get_cached_filter_coefs(order, corners, btype, output='ba'):
+    '''Get Butterworth filter design, as ``(b, a)`` or second-order sections.
+
+    :param corners: corner frequencies, normalized to the Nyquist frequency
+    :param output: ``'ba'`` or ``'sos'``
+    '''
+
+    ck = (order, tuple(corners), btype, output)
     if ck not in cached_coefficients:
-        if len(corners) == 0:
-            cached_coefficients[ck] = signal.butter(order, corners[0], btype=btype)
+        if output == 'sos' and not hasattr(signal, 'sosfilt'):
+            raise FilteringError('filtering in second-order sections needs scipy >= 0.16')
+
+        if len(corners) == 1:
+            cached_coefficients[ck] = signal.butter(order, corners[0], btype=btype, output=output)
         else:
-            cached_coefficients[ck] = signal.butter(order, corners, btype=btype)
+            cached_coefficients[ck] = signal.butter(order, corners, btype=btype, output=output)
 
     return cached_coefficients[ck]
+
+def _get_butterworth_coefs(order, corners, btype, sos):
+    if sos:
+        return _get_cached_filter_coefs(order, corners, btype, output='sos')
+
+    (b,a) = _get_cached_filter_coefs(order, corners, btype)
+    if btype != 'band' and (len(a) != order+1 or len(b) != order+1):
+        logger.warn('Erroneous filter coefficients returned by scipy.signal.butter(). You may need to downsample the signal before filtering or use sos=True.')
+
+    return (b,a)
+
+def _apply_filter(coefs, data, sos, zero_phase, axis=-1):
+    if sos:
+        if zero_phase:
+            if not hasattr(signal, 'sosfiltfilt'):
+                raise FilteringError('zero-phase filtering in second-order sections needs scipy >= 0.18')
+
+            return signal.sosfiltfilt(coefs, data, axis=axis)
+        else:
+            return signal.sosfilt(coefs, data, axis=axis)
+    else:
+        b, a = coefs
+        if zero_phase:
+            return signal.filtfilt(b, a, data, axis=axis)
+        else:
+            return signal.lfilter(b, a, data, axis=axis)
     
     
+def _tapered_coefs(deltat, ntrans, freqlimits, transfer_function):
+    deltaf = 1./(deltat*ntrans)
+    nfreqs = ntrans/2 + 1
+    transfer = num.ones(nfreqs, dtype=num.complex)
+    hi = snapper(nfreqs, deltaf)
+    a,b,c,d = freqlimits
+    freqs = num.arange(hi(d)-hi(a), dtype=num.float)*deltaf + hi(a)*deltaf
+    transfer[hi(a):hi(d)] = transfer_function.evaluate(freqs)
+    
+    tapered_transfer = costaper(a,b,c,d, nfreqs, deltaf)*transfer
+    tapered_transfer[0] = 0.0 # don't introduce static offsets
+    return tapered_transfer
+
+cached_tapered_coefs = util.LRUCache(maxsize=16, maxbytes=64*1024**2)
+def _get_cached_tapered_coefs(deltat, ntrans, freqlimits, transfer_function):
+    '''Get tapered transfer function coefficients, see :py:func:`_tapered_coefs`.
+
+    The coefficients are cached under the key given by
+    :py:meth:`FrequencyResponse.get_cache_key`, so that repeated
+    restitution of windows of equal length with an unchanged response
+    evaluates it only once. Responses without a key are not cached. The
+    returned array is read-only.
+    '''
+
+    key = transfer_function.get_cache_key()
+    if key is None:
+        return _tapered_coefs(deltat, ntrans, freqlimits, transfer_function)
+
+    ck = (deltat, ntrans, tuple(freqlimits), key)
+    coefs = cached_tapered_coefs.get(ck)
+    if coefs is None:
+        coefs = _tapered_coefs(deltat, ntrans, freqlimits, transfer_function)
+        coefs.flags.writeable = False
+        cached_tapered_coefs[ck] = coefs
+
+    return coefs
+
+_overlap_save_min_samples = 2**21
+
+def _use_overlap_save(ndata, nfir):
+    return ndata >= _overlap_save_min_samples and 8*nfir <= ndata
+
+def _transfer_nfir(deltat, freqlimits):
+    a,b,c,d = freqlimits
+    width = min(b-a, d-c)
+    if width <= 0.:
+        return None
+
+    return nextpow2(8./(width*deltat))
+
+def _fir_from_response(coefs, nfir):
+    '''Get FIR filter of length *nfir* from real FFT coefficients.
+
+    The impulse response is centered at sample ``nfir/2``.
+    '''
+
+    return num.roll(num.fft.irfft(coefs, nfir), nfir/2)
+
+class _OverlapSave(object):
+    '''Block-wise FIR filtering with the overlap-save method.
+
+    The last ``nfir-1`` input samples are kept between calls to
+    :py:meth:`process`, so that a continuous signal can be filtered in pieces.
+    The FFT length is fixed, independent of the length of the pieces.
+    '''
+
+    def __init__(self, fir, nfft=None):
+        self.nfir = fir.size
+        if nfft is None:
+            nfft = max(nextpow2(4*self.nfir), 2**12)
+
+        self.nfft = nfft
+        self.ffir = num.fft.rfft(fir, nfft)
+        self.history = None
+
+    def process(self, data):
+        nh = self.nfir - 1
+        if self.history is None:
+            self.history = num.empty(nh, dtype=num.float)
+            self.history[:] = data[0]
+
+        x = num.concatenate((self.history, data))
+        y = num.empty(data.size, dtype=num.float)
+        nstep = self.nfft - nh
+        for ibeg in xrange(0, data.size, nstep):
+            n = min(nstep, data.size - ibeg)
+            fseg = num.fft.rfft(x[ibeg:ibeg+nh+n], self.nfft)
+            y[ibeg:ibeg+n] = num.fft.irfft(fseg*self.ffir, self.nfft)[nh:nh+n]
+
+        self.history = x[x.size-nh:].copy()
+        return y
+
+def _overlap_save(data, coefs, nfir):
+    '''Apply response given by real FFT coefficients to *data* with the
+    overlap-save method, without delay.'''
+
+    ols = _OverlapSave(_fir_from_response(coefs, nfir))
+    ols.history = num.zeros(nfir-1, dtype=num.float)
+    ydata = ols.process(data)
+    tail = ols.process(num.zeros(nfir/2, dtype=num.float))
+    return num.concatenate((ydata[nfir/2:], tail))
+
 class _globals:
     _numpy_has_correlate_flip_bug = None
 
@@ -1679,9 +2294,36 @@ def moving_sum(x,n, mode='valid'):
 def nextpow2(i):
     return 2**int(math.ceil(math.log(i)/math.log(2.)))
     
+def nextfastlen(i):
+    '''Get smallest 5-smooth integer (``2**p * 3**q * 5**r``) larger or equal to *i*.
+
+    FFTs of such lengths are fast and the next one is usually much closer
+    to *i* than the next power of two.
+    '''
+
+    n = int(math.ceil(i))
+    if n <= 1:
+        return 1
+
+    best = nextpow2(n)
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p235 = p35
+            while p235 < n:
+                p235 *= 2
+
+            best = min(best, p235)
+            p35 *= 3
+
+        p5 *= 5
+
+    return best
+
 def snapper(nmax, delta, snapfun=math.ceil):
     def snap(x):
-        return max(0,min(snapfun(x/delta),nmax))
+        return max(0,min(int(snapfun(x/delta)),nmax))
     return snap
 
 def costaper(a,b,c,d, nfreqs, deltaf):
@@ -1693,6 +2335,19 @@ def costaper(a,b,c,d, nfreqs, deltaf):
     
     return tap
 
+cached_costapers = util.LRUCache(maxsize=16, maxbytes=32*1024**2)
+def _get_cached_costaper(a,b,c,d, nfreqs, deltaf):
+    '''Cached version of :py:func:`costaper`. The returned array is read-only.'''
+
+    ck = (a,b,c,d, nfreqs, deltaf)
+    tap = cached_costapers.get(ck)
+    if tap is None:
+        tap = costaper(a,b,c,d, nfreqs, deltaf)
+        tap.flags.writeable = False
+        cached_costapers[ck] = tap
+
+    return tap
+
 def t2ind(t,tdelta, snap=round):
     return int(snap(t/tdelta))
 
@@ -289,7 +289,7 @@ def decitab(n):
 
     if n > GlobalVars.decitab_nmax:
         mk_decitab(n*2)
-    if n not in GlobalVars.decitab: raise UnavailableDecimation('ratio = %g' % ratio)
+    if n not in GlobalVars.decitab: raise UnavailableDecimation('ratio = %g' % n)
     return GlobalVars.decitab[n]
 
 def ctimegm(s, format="%Y-%m-%d %H:%M:%S"):
@@ -486,8 +486,95 @@ def reuse(x):
     if not x in grs:
         grs[x] = x
     return grs[x]
-    
-    
+
+class LRUCache(object):
+    '''Dict-like cache with bounded size.
+
+    When more than *maxsize* entries are stored, or, if *maxbytes* is given,
+    the values sum up to more than *maxbytes* bytes, the least recently used
+    entries are dropped. The size of a value is taken from its ``nbytes``
+    attribute, as present on NumPy arrays. Values larger than *maxbytes* are
+    not stored at all.
+
+    Example::
+
+        cache = LRUCache(maxsize=100)
+        if key not in cache:
+            cache[key] = expensive_computation(key)
+        value = cache[key]
+    '''
+
+    def __init__(self, maxsize=128, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._entries = {}
+        self._tick = 0
+        self._nbytes = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, key):
+        entry = self._entries[key]
+        self._tick += 1
+        entry[0] = self._tick
+        return entry[1]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_nbytes(self):
+        '''Get number of bytes used by the stored values.'''
+
+        return self._nbytes
+
+    def __setitem__(self, key, value):
+        if key in self._entries:
+            self._nbytes -= self._entries.pop(key)[2]
+
+        nbytes = getattr(value, 'nbytes', 0)
+        if self.maxbytes is not None and nbytes > self.maxbytes:
+            return
+
+        self._tick += 1
+        self._entries[key] = [ self._tick, value, nbytes ]
+        self._nbytes += nbytes
+        if len(self._entries) > self.maxsize or (self.maxbytes is not None and self._nbytes > self.maxbytes):
+            self._shrink()
+
+    def _shrink(self):
+        # drop oldest entries down to 3/4 of the limits in one go, so that
+        # this is not done on every insertion
+        nkeep = max(1, self.maxsize*3/4)
+        nbytes_keep = None
+        if self.maxbytes is not None:
+            nbytes_keep = self.maxbytes*3/4
+
+        entries = sorted(self._entries.iteritems(), key=lambda item: item[1][0], reverse=True)
+        n, nbytes = 0, 0
+        for k, entry in entries:
+            if n == 0 or (n < nkeep and (nbytes_keep is None or nbytes + entry[2] <= nbytes_keep)):
+                n += 1
+                nbytes += entry[2]
+            else:
+                break
+
+        for k, entry in entries[n:]:
+            del self._entries[k]
+
+        self._nbytes = nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+
+
 class Anon:
     '''Dict-to-object utility.
 
@@ -683,7 +770,7 @@ def _nslc_pattern(pattern):
 def match_nslc(patterns, nslc):
     '''Match network-station-location-channel code against pattern or list of patterns.
     
-    :param patterns: pattern or list of patterns
+    :param patterns: pattern or list of patterns, or a :py:class:`NSLCSelector` object
     :param nslc: tuple with (network, station, location, channel) as strings
 
     :returns: ``True`` if the pattern matches or if any of the given patterns match; or ``False``.
@@ -696,6 +783,9 @@ def match_nslc(patterns, nslc):
     
     '''
     
+    if isinstance(patterns, NSLCSelector):
+        return patterns.match_nslc(nslc)
+
     if isinstance(patterns, str):
         patterns = [ patterns ]
     
@@ -722,6 +812,110 @@ def match_nslcs(patterns, nslcs):
 
     return matching
 
+class NSLCSelector(object):
+    '''Selection of channels and time span, which can be checked against whole trace groups.
+
+    :param patterns: pattern or list of patterns as in :py:func:`match_nslc`
+        or ``None`` to not restrict by pattern
+    :param nslc_ids: collection of (network, station, location, channel)
+        tuples or ``None`` to not restrict to explicit channel ids
+    :param tmin: start of time span or ``None``
+    :param tmax: end of time span or ``None``
+
+    A channel is selected if it matches any of the patterns and if it is one
+    of the explicitly given channel ids.
+
+    Besides single traces, the selector can be checked against trace groups
+    (files, subpiles, piles), using their summaries of contained channel ids.
+    The :py:class:`pile.Pile` methods ``chop``, ``chopper`` and
+    ``iter_traces`` accept a selector, to skip groups before any data is
+    loaded.
+
+    Example::
+
+        selector = NSLCSelector('GR.*.*.BH?', tmin=tmin, tmax=tmax)
+        selector.match_nslc(('GR','HAM3','','BHZ'))   # -> True
+    '''
+
+    def __init__(self, patterns=None, nslc_ids=None, tmin=None, tmax=None):
+        if isinstance(patterns, str):
+            patterns = [ patterns ]
+
+        if patterns is not None:
+            patterns = tuple(patterns)
+
+        if nslc_ids is not None:
+            nslc_ids = frozenset(nslc_ids)
+
+        self.patterns = patterns
+        self.nslc_ids = nslc_ids
+        self.tmin = tmin
+        self.tmax = tmax
+        self._matches = {}
+
+    def match_nslc(self, nslc):
+        '''Check if channel is selected.'''
+
+        if nslc not in self._matches:
+            self._matches[nslc] = (
+                (self.nslc_ids is None or nslc in self.nslc_ids) and
+                (self.patterns is None or match_nslc(self.patterns, nslc)))
+
+        return self._matches[nslc]
+
+    def match_span(self, tmin, tmax):
+        '''Check if time span overlaps with selected time span.'''
+
+        return (self.tmin is None or tmax >= self.tmin) and (self.tmax is None or tmin <= self.tmax)
+
+    def match_trace(self, tr):
+        '''Check if trace is selected.'''
+
+        return self.match_span(tr.tmin, tr.tmax) and self.match_nslc(tr.nslc_id)
+
+    def match_group(self, group, tmin=None, tmax=None):
+        '''Check if trace group may contain selected data.
+
+        :param group: object with attributes ``tmin`` and ``tmax`` and a 
+            method ``relevant_nslc_ids(tmin, tmax)``, like the trace groups
+            in :py:mod:`pile`
+        :param tmin: additional restriction of time span or ``None``
+        :param tmax: additional restriction of time span or ``None``
+        '''
+
+        if group.tmin is None or group.tmax is None:
+            return False
+
+        gtmin, gtmax = group.tmin, group.tmax
+        for t in (tmin, self.tmin):
+            if t is not None:
+                gtmin = max(gtmin, t)
+
+        for t in (tmax, self.tmax):
+            if t is not None:
+                gtmax = min(gtmax, t)
+
+        if gtmax < gtmin:
+            return False
+
+        for nslc in group.relevant_nslc_ids(gtmin, gtmax):
+            if self.match_nslc(nslc):
+                return True
+
+        return False
+
+    def _key(self):
+        return (self.patterns, self.nslc_ids, self.tmin, self.tmax)
+
+    def __eq__(self, other):
+        return isinstance(other, NSLCSelector) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self._key())
+
 class SoleError(Exception):
     '''Exception raised by objects of type :py:class:`Sole`, when an concurrent instance is running.'''
 
@@ -0,0 +1,38 @@
+import time, copy
+from pyrocko import trace
+import numpy as num
+
+def timeit(f, duration=1.0):
+    f()
+    b = time.time()
+    n = 0
+    while (time.time() - b) < duration:
+        f()
+        n += 1
+    return (time.time() - b)/n
+
+def mksegments(nsegments, nstations=1, nsamples_per_segment=400, overlap=0, gap=0):
+    '''Make traces looking like data read from short (512 byte) mseed records.'''
+
+    deltat = 0.01
+    tmin = 1234567890.
+    traces = []
+    for ista in range(nstations):
+        t = tmin
+        for iseg in range(nsegments):
+            ydata = num.random.randint(-1000, 1000, nsamples_per_segment).astype(num.int32)
+            traces.append(trace.Trace(station='S%03i' % ista, tmin=t, deltat=deltat, ydata=ydata))
+            t += (nsamples_per_segment - overlap + gap) * deltat
+
+    traces.sort(key=lambda tr: tr.full_id)
+    return traces
+
+def degap(traces):
+    trace.degapper([ copy.copy(tr) for tr in traces ])
+
+print '%10s %10s %10s %12s' % ('segments', 'stations', 'situation', 'time [s]')
+for nsegments in (100, 1000, 5000):
+    for nstations in (1, 10):
+        for situation, kwargs in [ ('contiguous', {}), ('overlaps', dict(overlap=10)), ('gaps', dict(gap=3)) ]:
+            traces = mksegments(nsegments, nstations, **kwargs)
+            print '%10i %10i %10s %12.4f' % (nsegments, nstations, situation, timeit(lambda: degap(traces)))
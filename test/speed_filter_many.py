@@ -0,0 +1,32 @@
+import time
+from pyrocko import trace
+import numpy as num
+
+def timeit(f, duration=1.0):
+    f()
+    b = time.time()
+    n = 0
+    while (time.time() - b) < duration:
+        f()
+        n += 1
+    return (time.time() - b)/n
+
+def mktraces(ntraces, nsamples):
+    tmin = 1234567890.
+    ydata = num.random.randint(-1000, 1000, nsamples).astype(num.int32)
+    return [ trace.Trace(station='S%04i' % i, tmin=tmin, deltat=0.01, ydata=ydata.copy()) for i in xrange(ntraces) ]
+
+def single(traces):
+    for tr in traces:
+        tr.lowpass(4, 5.)
+        tr.highpass(4, 0.1)
+
+def many(traces):
+    trace.filter_many(traces, 'low', 4, 5.)
+    trace.filter_many(traces, 'high', 4, 0.1)
+
+print '%8s %8s %12s %12s' % ('traces', 'samples', 'single [s]', 'many [s]')
+for ntraces in (10, 100, 1000):
+    for nsamples in (100, 1000, 10000):
+        traces = mktraces(ntraces, nsamples)
+        print '%8i %8i %12.4f %12.4f' % (ntraces, nsamples, timeit(lambda: single(traces)), timeit(lambda: many(traces)))
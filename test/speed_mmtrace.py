@@ -0,0 +1,46 @@
+import time, os, tempfile, shutil
+from pyrocko import pile, io, trace, config
+import numpy as num
+
+def timeit(f, duration=1.0):
+    f()
+    b = time.time()
+    n = 0
+    while (time.time() - b) < duration:
+        f()
+        n += 1
+    return (time.time() - b)/n
+
+config.show_progress = False
+
+# one day of 1 kHz data would be too much for a quick test, use 2 hours
+tmin = 1234567890.
+deltat = 0.001
+nsamples = 2*3600*1000
+ydata = num.cumsum(num.random.randint(-50, 51, nsamples)).astype(num.int32)
+traces = [ trace.Trace(station='STA', tmin=tmin, deltat=deltat, ydata=ydata) ]
+
+tempdir = tempfile.mkdtemp()
+
+print '%-8s %10s %14s %14s' % ('format', 'window [s]', 'load all [s]', 'chop [s]')
+for format, fn in [ ('mseed', 'data.mseed'), ('mmtrace', 'data.mmtr') ]:
+    fn = os.path.join(tempdir, fn)
+    io.save(traces, fn, format=format, **(format == 'mseed' and dict(encoding='steim2') or {}))
+    p = pile.Pile()
+    p.load_files([fn], fileformat=format, show_progress=False)
+
+    def load_all():
+        for f in p.iter_files():
+            f.load_data(force=True)
+            f.forget_data()
+
+    for twin in (10., 600.):
+        def chop():
+            t = tmin + num.random.uniform(0., nsamples*deltat - twin)
+            chopped, used = p.chop(t, t+twin)
+            for f in used:
+                f.drop_data()
+
+        print '%-8s %10g %14.4f %14.4f' % (format, twin, timeit(load_all), timeit(chop))
+
+shutil.rmtree(tempdir)
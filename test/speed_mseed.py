@@ -0,0 +1,63 @@
+import time, sys, os, tempfile, shutil
+from pyrocko import mseed, trace
+import numpy as num
+
+def timeit(f, duration=1.0):
+    f()
+    b = time.time()
+    n = 0
+    while (time.time() - b) < duration:
+        f()
+        n += 1
+    return (time.time() - b)/n
+
+def mktraces(n):
+    tmin = 1234567890.
+    ydata = num.cumsum(num.random.randint(-50, 51, n)).astype(num.int32)
+    return [ trace.Trace(station='STA', tmin=tmin, deltat=0.01, ydata=ydata) ]
+
+def with_dtype(traces, dtype):
+    converted = []
+    for tr in traces:
+        tr = tr.copy()
+        tr.set_ydata(tr.get_ydata().astype(dtype))
+        converted.append(tr)
+
+    return converted
+
+if len(sys.argv) > 1:
+    # integer compression only makes sense for integer data, round everything else
+    traces = []
+    for fn in sys.argv[1:]:
+        for tr in mseed.load(fn):
+            if tr.ydata.dtype != num.int32:
+                tr.set_ydata(num.round(tr.ydata).astype(num.int32))
+            traces.append(tr)
+else:
+    traces = mktraces(2**20)
+
+nsamples = sum([ tr.data_len() for tr in traces ])
+nbytes_raw = nsamples * 4
+
+tempdir = tempfile.mkdtemp()
+fn = os.path.join(tempdir, 'test.mseed')
+
+print '%-8s %6s %12s %12s %8s' % ('encoding', 'reclen', 'write [MB/s]', 'read [MB/s]', 'ratio')
+for encoding, dtype in [ ('steim1', num.int32), ('steim2', num.int32), ('int32', num.int32),
+                         ('int16', num.int32), ('float32', num.float32), ('float64', num.float64) ]:
+
+    trs = with_dtype(traces, dtype)
+
+    for reclen in (512, 4096):
+        try:
+            twrite = timeit(lambda: mseed.save(trs, fn, reclen=reclen, encoding=encoding))
+        except mseed.MSeedError, e:
+            # e.g. int16 encoding with samples out of range
+            print '%-8s %6i %s' % (encoding, reclen, e)
+            continue
+
+        tread = timeit(lambda: mseed.load(fn))
+        ratio = float(nbytes_raw) / os.stat(fn)[6]
+        print '%-8s %6i %12.1f %12.1f %8.2f' % (encoding, reclen, nbytes_raw/twrite/1e6, nbytes_raw/tread/1e6, ratio)
+
+shutil.rmtree(tempdir)
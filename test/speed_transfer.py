@@ -0,0 +1,25 @@
+import time
+from pyrocko import trace
+import numpy as num
+
+def timeit(f, duration=1.0):
+    f()
+    b = time.time()
+    n = 0
+    while (time.time() - b) < duration:
+        f()
+        n += 1
+    return (time.time() - b)/n
+
+resp = trace.PoleZeroResponse([0j, 0j], [-0.1+0.1j, -0.1-0.1j], 1.)
+freqlimits = (0.01, 0.02, 20., 40.)
+deltat = 0.005
+
+def transfer(tr, min_samples):
+    trace._overlap_save_min_samples = min_samples
+    tr.transfer(100., freqlimits, resp)
+
+print '%10s %12s %16s' % ('samples', 'fft [s]', 'overlap-save [s]')
+for nsamples in (2**18, 2**20, 2**22, 2**23+12345):
+    tr = trace.Trace(deltat=deltat, ydata=num.random.normal(size=nsamples))
+    print '%10i %12.4f %16.4f' % (nsamples, timeit(lambda: transfer(tr, 2**40)), timeit(lambda: transfer(tr, 0)))
@@ -7,6 +7,7 @@ from test_moment_tensor import MomentTensorTestCase
 from test_trace import TraceTestCase
 from test_model import ModelTestCase
 from test_util import UtilTestCase
+from test_overview import OverviewTestCase
 
 import unittest
 
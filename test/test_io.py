@@ -1,4 +1,4 @@
-from pyrocko import mseed, trace, util, io
+from pyrocko import mseed, mmtrace, trace, util, io
 import unittest
 import numpy as num
 import time
@@ -39,6 +39,196 @@ class IOTestCase( unittest.TestCase ):
             os.remove(fn)
         shutil.rmtree(tempdir)
                 
+    def testReadZeroCopy(self):
+        tmin = time.time()
+        deltat = 0.5
+        traces1 = []
+        for i, dtype in enumerate((num.int32, num.float32, num.float64)):
+            for j in range(3):
+                ydata = (num.random.random(1500)*1000.).astype(dtype)
+                traces1.append(trace.Trace('', 'S%i' % i, '', 'Z', tmin=tmin+j*1000.,
+                    deltat=deltat, ydata=ydata))
+
+        tempdir = tempfile.mkdtemp()
+        fns = mseed.save(traces1, pjoin(tempdir, '%(station)s'))
+        for fn in fns:
+            trs_zc = mseed.mseed_ext.get_traces(fn, True, True)
+            trs_copy = mseed.mseed_ext.get_traces(fn, True, False)
+            assert len(trs_zc) == len(trs_copy) == 3
+            for a, b in zip(trs_zc, trs_copy):
+                assert a[:8] == b[:8]
+                assert a[8].dtype == b[8].dtype
+                assert num.all(a[8] == b[8])
+
+        shutil.rmtree(tempdir)
+
+    def testReadPartial(self):
+        tmin = 1234567890.
+        traces1 = [ trace.Trace('', sta, '', 'Z', tmin=tmin, deltat=1.0,
+            ydata=num.arange(10000, dtype=num.int32)) for sta in ('A', 'B') ]
+
+        tempdir = tempfile.mkdtemp()
+        fn = mseed.save(traces1, pjoin(tempdir, 'data'))[0]
+        traces2 = mseed.load(fn, tmin=tmin+5000., tmax=tmin+5010.,
+            nslc_selector=lambda nslc: nslc[1] == 'B')
+
+        assert len(traces2) == 1
+        tr = traces2[0]
+        assert tr.station == 'B'
+        assert tr.tmin <= tmin+5000. and tmin+5010. <= tr.tmax
+        assert tr.ydata.size < 10000
+        assert num.all(tr.ydata == num.arange(10000)[int(tr.tmin-tmin):int(tr.tmax-tmin)+1])
+        shutil.rmtree(tempdir)
+
+    def testRecordIndex(self):
+        tmin = 1234567890.
+        traces1 = [ trace.Trace('', sta, '', 'Z', tmin=tmin, deltat=1.0,
+            ydata=num.arange(10000, dtype=num.int32)) for sta in ('A', 'B') ]
+
+        tempdir = tempfile.mkdtemp()
+        fn = mseed.save(traces1, pjoin(tempdir, 'data'))[0]
+        index = mseed.get_record_index(fn)
+        assert set(index.nslc_ids) == set([ tr.nslc_id for tr in traces1 ])
+        assert num.sum(index.nsamples) == 20000
+
+        def sel(nslc):
+            return nslc[1] == 'B'
+
+        isel = index.select(tmin+5000., tmin+5010., sel)
+        assert 0 < isel.size < len(index)/2
+
+        traces2 = mseed.load(fn, tmin=tmin+5000., tmax=tmin+5010., nslc_selector=sel)
+        traces3 = mseed.load(fn, tmin=tmin+5000., tmax=tmin+5010., nslc_selector=sel,
+            record_index=index)
+
+        assert len(traces2) == len(traces3) == 1
+        assert traces2[0] == traces3[0]
+        assert mseed.load(fn, tmin=tmin+20000., record_index=index) == []
+        shutil.rmtree(tempdir)
+
+    def testWriter(self):
+        tmin = 1234567890.
+        deltat = 0.01
+        ydata = num.cumsum(num.random.randint(-100, 100, 20000)).astype(num.int32)
+
+        tempdir = tempfile.mkdtemp()
+        fn = pjoin(tempdir, 'stream.mseed')
+        for i, (ibeg, iend) in enumerate([(0, 7000), (7000, 12345), (12345, 20000)]):
+            writer = mseed.Writer(fn, reclen=512, encoding='steim2', append=i!=0)
+            for j in xrange(ibeg, iend, 1000):
+                tr = trace.Trace('', 'STA', '', 'Z', tmin=tmin+j*deltat, deltat=deltat,
+                    ydata=ydata[j:min(j+1000, iend)].copy())
+                writer.write(tr)
+
+            writer.close()
+
+        index = mseed.get_record_index(fn)
+        assert num.all(index.reclens == 512)
+        traces = mseed.load(fn)
+        assert len(traces) == 1
+        assert abs(traces[0].tmin - tmin) < deltat*0.01
+        assert num.all(traces[0].ydata == ydata)
+
+        writer = mseed.Writer(fn, encoding='steim2')
+        try:
+            writer.write(trace.Trace(ydata=num.zeros(10, dtype=num.float32)))
+        except mseed.MSeedError, e:
+            pass
+
+        assert isinstance(e, mseed.MSeedError)
+        del e
+
+        # samples which do not fit into int16 must not wrap around silently
+        writer = mseed.Writer(fn, encoding='int16')
+        try:
+            writer.write(trace.Trace(ydata=num.array([0, 40000, -70000, 5], dtype=num.int32)))
+            writer.close()
+        except mseed.MSeedError, e:
+            pass
+
+        assert isinstance(e, mseed.MSeedError)
+        shutil.rmtree(tempdir)
+
+    def testSaveEncodings(self):
+        tmin = 1234567890.
+        ydata = num.cumsum(num.random.randint(-100, 100, 5000)).astype(num.int32)
+        tr = trace.Trace('', 'STA', '', 'Z', tmin=tmin, deltat=0.01, ydata=ydata)
+
+        tempdir = tempfile.mkdtemp()
+        fn = pjoin(tempdir, 'data.mseed')
+        for encoding in ('steim1', 'steim2', 'int32', 'int16'):
+            for reclen in (256, 4096):
+                io.save([tr], fn, encoding=encoding, reclen=reclen)
+                assert num.all(mseed.get_record_index(fn).reclens == reclen)
+                assert num.all(io.load(fn)[0].ydata == ydata)
+
+        for encoding, reclen in (('float32', 4096), ('steim2', 1000)):
+            try:
+                mseed.save([tr], fn, encoding=encoding, reclen=reclen)
+            except mseed.MSeedError, e:
+                pass
+
+            assert isinstance(e, mseed.MSeedError)
+            del e
+
+        tr_big = trace.Trace('', 'STA', '', 'Z', tmin=tmin, deltat=0.01,
+            ydata=num.array([0, 40000, -70000, 5], dtype=num.int32))
+        try:
+            io.save([tr_big], fn, encoding='int16')
+        except mseed.MSeedError, e:
+            pass
+
+        assert isinstance(e, mseed.MSeedError)
+        shutil.rmtree(tempdir)
+
+    def testMMTrace(self):
+        tmin = 1234567890.123
+        traces1 = []
+        for i, dtype in enumerate((num.int16, num.int32, num.int64, num.float32, num.float64)):
+            ydata = (num.random.random(1000+i*777)*1000.).astype(dtype)
+            traces1.append(trace.Trace('N', 'S%i' % i, 'LO', 'HHZ', tmin=tmin+i, deltat=0.5, ydata=ydata))
+
+        traces1.append(trace.Trace('N', 'HF', '', 'Z', tmin=tmin, deltat=0.0001, ydata=num.arange(5000)))
+        traces1.append(trace.Trace('N', 'EMPTY', '', 'Z', tmin=tmin, deltat=1., ydata=num.zeros(0)))
+
+        tempdir = tempfile.mkdtemp()
+        fn = pjoin(tempdir, 'data.mmtr')
+        assert io.save(traces1, fn, format='from_extension') == [ fn ]
+        for getdata in (True, False):
+            for mmap in (True, False):
+                traces2 = list(mmtrace.load(fn, load_data=getdata, mmap=mmap))
+                assert len(traces2) == len(traces1)
+                for a, b in zip(traces1, traces2):
+                    assert a.nslc_id == b.nslc_id and a.deltat == b.deltat
+                    assert a.tmin == b.tmin and a.tmax == b.tmax
+                    if getdata:
+                        assert a.ydata.dtype == b.ydata.dtype
+                        assert num.all(a.ydata == b.ydata)
+                    else:
+                        assert b.ydata is None
+
+        for tr, offset, dtype, nsamples in mmtrace.iload_headers(fn):
+            assert offset % mmtrace.page_size == 0
+
+        traces2 = io.load(fn, format='from_extension')
+        assert isinstance(traces2[0].ydata, num.memmap)
+        assert not traces2[0].ydata.flags.writeable
+        chopped = traces2[0].chop(tmin+10., tmin+20., inplace=False)
+        assert num.all(chopped.ydata == traces1[0].chop(tmin+10., tmin+20., inplace=False).ydata)
+
+        # rewriting a file must not invalidate existing maps
+        io.save(traces1[:1], fn, format='mmtrace')
+        assert num.all(traces2[1].ydata == traces1[1].ydata)
+
+        open(fn, 'ab').write('garbage')
+        try:
+            io.load(fn, format='mmtrace')
+        except io.FileLoadError, e:
+            pass
+
+        assert isinstance(e, io.FileLoadError)
+        shutil.rmtree(tempdir)
+
     def testReadNonexistant(self):
         try:
             trs = mseed.load('/tmp/thisfileshouldnotexist')
@@ -0,0 +1,98 @@
+from pyrocko import trace, pile, io, overview, config, util
+
+import unittest
+import numpy as num
+import tempfile, shutil, os, time
+from os.path import join as pjoin
+
+def mktrace(station, tmin, nsamples, deltat=0.5):
+    ydata = num.random.randint(-1000, 1000, nsamples).astype(num.int32)
+    return trace.Trace('N', station, '', 'Z', tmin=tmin, deltat=deltat, ydata=ydata)
+
+class OverviewTestCase( unittest.TestCase ):
+
+    def testBlocks(self):
+        config.show_progress = False
+        datadir = tempfile.mkdtemp()
+        tr = mktrace('A', 1000010., 40000)
+        io.save([tr], pjoin(datadir, 'a.mseed'))
+        p = pile.make_pile(datadir, show_progress=False)
+
+        ov = overview.Overview(tbase=60., factor=4, nlevels=4)
+        assert ov.update(p)
+        assert not ov.update(p)
+        assert ov.get_nslc_ids() == [ tr.nslc_id ]
+
+        t = tr.get_xdata()
+        y = tr.get_ydata().astype(num.float)
+        for tblock, tb_want in ((10., 60.), (240., 240.), (1000., 960.), (1e6, 3840.)):
+            tb_, tb, vmin, vmax, rms = ov.get_envelope(tr.nslc_id, 0., 2e6, tblock)
+            assert tb == tb_want
+            ib = num.floor(t/tb)
+            assert num.all(num.unique(ib) == tb_/tb)
+            for i in xrange(tb_.size):
+                mask = ib == tb_[i]/tb
+                assert vmin[i] == y[mask].min() and vmax[i] == y[mask].max()
+                assert abs(rms[i] - num.sqrt(num.mean(y[mask]**2))) < 1e-6
+
+        assert ov.get_envelope(tr.nslc_id, 0., 1000.) is None
+        assert ov.get_envelope(('X', 'Y', '', 'Z'), 0., 2e6) is None
+
+        ranges = ov.minmax([ tr.nslc_id ], tr.tmin, tr.tmax)
+        assert ranges == trace.minmax([tr])
+        ranges = ov.minmax([ tr.nslc_id ], tr.tmin, tr.tmax, key=lambda tr: None, mode=2)
+        mean, std = y.mean(), y.std()
+        assert num.allclose(ranges[None], (mean-2*std, mean+2*std))
+        shutil.rmtree(datadir)
+
+    def testIncrementalUpdate(self):
+        config.show_progress = False
+        datadir = tempfile.mkdtemp()
+        ovdir = pjoin(datadir, 'overview')
+        tmin = 1234567890.
+        for i in xrange(5):
+            io.save([ mktrace('A', tmin+i*5000., 10000) ], pjoin(datadir, 'a%i.mseed' % i))
+
+        io.save([ mktrace('B', tmin+3000., 30000) ], pjoin(datadir, 'b.mseed'))
+
+        p = pile.make_pile(datadir, regex=r'\.mseed$', show_progress=False)
+        ov = overview.Overview(ovdir, tbase=60., factor=4, nlevels=4)
+        ov.update(p)
+        ov.save()
+
+        time.sleep(1.1)
+        io.save([ mktrace('A', tmin+2*5000., 10000) ], pjoin(datadir, 'a2.mseed'))
+        os.unlink(pjoin(datadir, 'a4.mseed'))
+        io.save([ mktrace('C', tmin+50000., 1000) ], pjoin(datadir, 'c.mseed'))
+
+        p = pile.make_pile(datadir, regex=r'\.mseed$', show_progress=False)
+        ov = overview.Overview(ovdir)
+        assert ov.nlevels == 4
+
+        # step by step, interrupted by saving and reloading
+        assert ov.update(p, max_windows=1)
+        assert ov.is_pending()
+        ov.save()
+        ov = overview.Overview(ovdir)
+        assert ov.is_pending()
+        nsteps = 1
+        while ov.is_pending():
+            assert ov.update(p, max_windows=1)
+            nsteps += 1
+
+        assert nsteps > 2
+        assert not ov.update(p)
+
+        ov_fresh = overview.Overview(tbase=60., factor=4, nlevels=4)
+        ov_fresh.update(p)
+        assert ov.get_nslc_ids() == ov_fresh.get_nslc_ids()
+        for nslc_id in ov.get_nslc_ids():
+            for ilevel in xrange(ov.nlevels):
+                for a, b in zip(ov.channels[nslc_id].levels[ilevel], ov_fresh.channels[nslc_id].levels[ilevel]):
+                    assert num.all(a == b)
+
+        shutil.rmtree(datadir)
+
+if __name__ == "__main__":
+    util.setup_logging('test_overview', 'warning')
+    unittest.main()
@@ -76,6 +76,600 @@ class PileTestCase( unittest.TestCase ):
         pile.get_cache(cachedir).clean()
         shutil.rmtree(datadir)
     
+    def testParallelLoading(self):
+        import shutil
+        config.show_progress = False
+        tmin = 1234567890
+        datadir = makeManyFiles(50, 100, ['xx'], ['aaa', 'bbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p1 = pile.Pile()
+        p1.load_files(filenames=filenames, show_progress=False)
+        p2 = pile.Pile()
+        p2.load_files(filenames=filenames, show_progress=False, nworkers=2)
+        
+        def headers(p):
+            return sorted([ (tr.nslc_id, tr.tmin, tr.tmax, tr.deltat) for tr in p.iter_traces() ])
+
+        assert headers(p1) == headers(p2)
+        assert p1.tmin == p2.tmin and p1.tmax == p2.tmax
+        shutil.rmtree(datadir)
+
+    def testCache(self):
+        import shutil
+        tmin = 1234567890
+        datadir = makeManyFiles(20, 100, ['xx'], ['aaa', 'bbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        for backend in ('sqlite', 'pickle'):
+            cachedir = pjoin(datadir, '_cache_%s_' % backend)
+            p1 = pile.Pile()
+            p1.load_files(filenames=filenames, show_progress=False, 
+                          cache=pile.get_cache(cachedir, backend=backend))
+            
+            # fresh cache object, reading what has been written above
+            del pile.TracesFileCache.caches[cachedir, backend]
+            cache = pile.get_cache(cachedir, backend=backend)
+            for fn in filenames:
+                tfile = cache.get(os.path.abspath(fn))
+                assert tfile is not None
+                assert tfile.mtime == os.stat(fn)[8]
+                trs = list(tfile.iter_traces())
+                assert len(trs) == 1
+                assert isinstance(trs[0].tmin, float)
+
+            p2 = pile.Pile()
+            p2.load_files(filenames=filenames, show_progress=False, cache=cache)
+            assert p1.tmin == p2.tmin and p1.tmax == p2.tmax
+            assert set(p1.nslc_ids) == set(p2.nslc_ids)
+
+            os.remove(filenames[0])
+            cache.clean()
+            assert cache.get(os.path.abspath(filenames[0])) is None
+            filenames = filenames[1:]
+
+        shutil.rmtree(datadir)
+
+    def testHeaderTable(self):
+        import shutil
+        tmin = 1234567890
+        datadir = makeManyFiles(1, 100, ['xx'], ['aaa'], ['zzz'], tmin)
+        fn = util.select_files([datadir], show_progress=False)[0]
+        traces = io.load(fn)
+        traces.append(trace.Trace('yy', 'bbb', '', 'zzz', tmin=tmin+300, deltat=0.5, ydata=num.ones(10, dtype=num.int32)))
+        io.save(traces, fn)
+        
+        tfile = pile.TracesFile(None, fn, 'mseed', mtime=os.stat(fn)[8])
+        assert isinstance(tfile._headers, pile.TraceHeaderTable)
+        assert set(tfile.nslc_ids) == set([ tr.nslc_id for tr in traces ])
+        assert tfile.get_deltats() == set([1.0, 0.5])
+        assert (tfile.tmin, tfile.tmax) == (tmin, tmin+304.5)
+
+        # internal queries work on the table
+        assert tfile.gather_keys(lambda tr: tr.nslc_id) == set([ tr.nslc_id for tr in traces ])
+        assert tfile.gather_keys(lambda tr: tr.station, lambda tr: tr.deltat == 0.5) == set(['bbb'])
+        assert tfile.get_newest_mtime(tmin, tmin+10, lambda tr: tr.network == 'yy') == tfile.mtime
+        assert tfile.get_newest_mtime(tmin, tmin+10, lambda tr: tr.network == 'zz') is None
+        chopped, used = tfile.chop(tmin+10, tmin+60, load_data=False)
+        assert not used and len(chopped) == 1
+        assert tfile.get_ntraces() == 2
+        assert isinstance(tfile._headers, pile.TraceHeaderTable)
+
+        # the list of traces is created once and kept
+        for a, b in zip(tfile.traces, traces):
+            assert (a.nslc_id, a.tmin, a.tmax, a.deltat) == (b.nslc_id, b.tmin, b.tmax, b.deltat)
+            assert a.ydata is None
+
+        assert tfile.traces is tfile.traces
+
+        chopped, used = tfile.chop(tmin+10, tmin+60)
+        assert used and tfile._headers is None
+        assert len(chopped) == 1 and chopped[0].ydata.size == 50
+        tfile.use_data()
+        tfile.drop_data()
+        assert isinstance(tfile._headers, pile.TraceHeaderTable)
+        assert len(tfile.traces) == 2
+        shutil.rmtree(datadir)
+
+    def testDataCache(self):
+        import shutil
+        tmin = 1234567890
+        nsamples = 1000
+        datadir = makeManyFiles(10, nsamples, ['xx'], ['aaa'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+        nbytes_file = nsamples * 8
+        p.set_data_cache_size(3*nbytes_file)
+        cache = p.get_data_cache()
+        
+        for i in range(2):
+            for traces in p.chopper(tmin=tmin, tmax=tmin+3*nsamples-1, tinc=nsamples*0.5):
+                pass
+
+        assert cache.nmisses == 3
+        assert cache.nhits > 0
+
+        for traces in p.chopper(tinc=nsamples*0.5):
+            pass
+
+        assert cache.nbytes <= 3*nbytes_file
+        assert len([ f for f in p.iter_files() if f.data_loaded ]) == 3
+
+        p.set_data_cache_size(0)
+        assert cache.nbytes == 0
+        assert len([ f for f in p.iter_files() if f.data_loaded ]) == 0
+        shutil.rmtree(datadir)
+
+    def testPartialRead(self):
+        import shutil
+        tmin = 1234567890.
+        nsamples = 20000
+        traces = []
+        for cha in 'ne':
+            ydata = num.random.randint(-1000, 1000, nsamples).astype(num.int32)
+            traces.append(trace.Trace('xx', 'aaa', '', cha, tmin=tmin, deltat=0.5, ydata=ydata))
+
+        datadir = tempfile.mkdtemp()
+        io.save(traces, pjoin(datadir, 'data.mseed'), format='mseed')
+        p = pile.Pile()
+        p.load_files(filenames=[pjoin(datadir, 'data.mseed')], show_progress=False)
+        tfile = list(p.iter_files())[0]
+
+        wmin, wmax = tmin+1000.3, tmin+1050.3
+        assert tfile.wants_partial_read(wmin, wmax)
+        chopped, used = tfile.chop(wmin, wmax, trace_selector=lambda tr: tr.channel == 'e')
+        assert not used and not tfile.data_loaded
+        assert len(chopped) == 1 and chopped[0].channel == 'e'
+        tr_partial = chopped[0]
+
+        assert len(tfile.get_record_index()) > 0
+
+        for backend in ('pickle', 'sqlite'):
+            cachedir = pjoin(datadir, 'cache_%s' % backend)
+            cache = pile.get_cache(cachedir, backend=backend)
+            p = pile.Pile()
+            p.load_files(filenames=[pjoin(datadir, 'data.mseed')], cache=cache, show_progress=False)
+            tfile = list(p.iter_files())[0]
+            chopped, used = tfile.chop(wmin, wmax, trace_selector=lambda tr: tr.channel == 'e')
+            assert num.all(chopped[0].ydata == tr_partial.ydata)
+            index = cache.get_record_index(tfile.abspath, tfile.mtime)
+            assert num.all(index.offsets == tfile.get_record_index().offsets)
+            del pile.TracesFileCache.caches[cachedir, backend]
+
+        tfile.load_data()
+        assert not tfile.wants_partial_read(wmin, wmax)
+        chopped, used = tfile.chop(wmin, wmax, trace_selector=lambda tr: tr.channel == 'e')
+        tr_full = chopped[0]
+        assert tr_partial.tmin == tr_full.tmin
+        assert num.all(tr_partial.ydata == tr_full.ydata)
+        shutil.rmtree(datadir)
+
+    def testPrefetch(self):
+        import shutil
+        tmin = 1234567890
+        nsamples = 1000
+        datadir = makeManyFiles(20, nsamples, ['xx'], ['aaa', 'bbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+
+        def summary(traces):
+            return [ (tr.nslc_id, tr.tmin, tr.tmax, num.sum(tr.ydata)) for tr in traces ]
+
+        for tinc in (nsamples*0.3, nsamples*2.5):
+            want = [ summary(traces) for traces in p.chopper(tinc=tinc) ]
+            have = [ summary(traces) for traces in p.chopper(tinc=tinc, prefetch=3) ]
+            assert want == have
+            for f in p.iter_files():
+                assert f.data_use_count == 0 and not f.data_loaded
+
+        for traces in p.chopper(tinc=nsamples*0.3, prefetch=3):
+            break
+
+        del traces
+        assert len([ f for f in p.iter_files() if f.data_use_count > 1 ]) == 0
+        shutil.rmtree(datadir)
+
+    def testPrefetchPartialReadSQLite(self):
+        import shutil
+        tmin = 1234567890.
+        nsamples = 20000
+        traces = []
+        for cha in 'ne':
+            ydata = num.random.randint(-1000, 1000, nsamples).astype(num.int32)
+            traces.append(trace.Trace('xx', 'aaa', '', cha, tmin=tmin, deltat=0.5, ydata=ydata))
+
+        datadir = tempfile.mkdtemp()
+        fn = pjoin(datadir, 'data.mseed')
+        io.save(traces, fn, format='mseed')
+        cachedir = pjoin(datadir, 'cache')
+
+        def summary(traces):
+            return [ (tr.nslc_id, tr.tmin, tr.tmax, num.sum(tr.ydata)) for tr in traces ]
+
+        want = None
+        for i in range(2):
+            # second pass gets the record index from the cache
+            cache = pile.get_cache(cachedir, backend='sqlite')
+            p = pile.Pile()
+            p.load_files(filenames=[fn], cache=cache, show_progress=False)
+            tfile = list(p.iter_files())[0]
+            assert tfile.wants_partial_read(tmin+1000., tmin+1100.)
+            have = [ summary(traces) for traces in p.chopper(tinc=100., prefetch=2) ]
+            if want is None:
+                want = [ summary(traces) for traces in p.chopper(tinc=100.) ]
+
+            assert have == want
+            assert cache.get_record_index(tfile.abspath, tfile.mtime) is not None
+            del pile.TracesFileCache.caches[cachedir, 'sqlite']
+
+        shutil.rmtree(datadir)
+
+    def testMapWindows(self):
+        import shutil
+        tmin = 1234567890
+        nsamples = 1000
+        datadir = makeManyFiles(20, nsamples, ['xx'], ['aaa', 'bbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+
+        func = lambda traces: sorted([ (tr.nslc_id, tr.tmin, tr.data_len()) for tr in traces ])
+        for want_incomplete in (True, False):
+            kwargs = dict(tinc=nsamples*0.7, tpad=10., want_incomplete=want_incomplete)
+            want = [ func(traces) for traces in p.chopper(**kwargs) ]
+            assert p.map_windows(func, nworkers=1, **kwargs) == want
+            assert p.map_windows(func, nworkers=3, **kwargs) == want
+
+        shutil.rmtree(datadir)
+
+    def testChopperGrouped(self):
+        import shutil
+        tmin = 1234567890
+        nsamples = 1000
+        datadir = makeManyFiles(30, nsamples, ['xx'], ['aaa', 'bbb', 'ccc'], ['n', 'e'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+
+        gather = lambda tr: tr.station
+        keys = p.gather_keys(gather)
+        tinc = nsamples*2.5
+        per_key = {}
+        for key in keys:
+            per_key[key] = list(p.chopper(tinc=tinc, trace_selector=lambda tr: gather(tr) == key))
+
+        want = []
+        for key in keys:
+            want.extend( [ (tr.nslc_id, tr.tmin, tr.tmax) for tr in traces ] for traces in per_key[key] )
+
+        have = [ [ (tr.nslc_id, tr.tmin, tr.tmax) for tr in traces ] 
+                 for traces in p.chopper_grouped(gather, tinc=tinc) ]
+
+        assert want == have
+
+        nwindows = len(per_key[keys[0]])
+        want = []
+        for iwin in range(nwindows):
+            for key in keys:
+                want.append([ (tr.nslc_id, tr.tmin, tr.tmax) for tr in per_key[key][iwin] ])
+
+        have = [ [ (tr.nslc_id, tr.tmin, tr.tmax) for tr in traces ] 
+                 for traces in p.chopper_grouped(gather, tinc=tinc, by_window=True) ]
+
+        assert want == have
+
+        # without tinc, as used by eventdata: one group per key, in key order
+        want = []
+        for key in keys:
+            for traces in p.chopper(trace_selector=lambda tr: gather(tr) == key):
+                want.append([ (tr.nslc_id, tr.tmin, tr.tmax) for tr in traces ])
+
+        have = [ [ (tr.nslc_id, tr.tmin, tr.tmax) for tr in traces ] 
+                 for traces in p.chopper_grouped(gather) ]
+
+        assert len(have) == len(keys)
+        assert want == have
+
+        have = [ [ (tr.nslc_id, tr.tmin, tr.tmax) for tr in traces ] 
+                 for traces in p.chopper_grouped(gather, trace_selector=lambda tr: tr.station != 'bbb') ]
+
+        assert len(have) == len(keys)
+        for key, traces in zip(keys, have):
+            assert (key == 'bbb') == (traces == [])
+
+        assert not any( f.data_loaded for f in p.iter_files() )
+        shutil.rmtree(datadir)
+
+    def testChopperGroupedLoads(self):
+        import shutil
+        tmin = 1234567890.
+        datadir = tempfile.mkdtemp()
+        traces = []
+        for iblock in range(3):
+            for sta in ('aaa', 'bbb', 'ccc'):
+                traces.append(trace.Trace('xx', sta, '', 'z', tmin=tmin+iblock*1000., deltat=1.0, 
+                                          ydata=num.ones(1000, dtype=num.int32)))
+
+        # each file holds the traces of all stations
+        io.save(traces, pjoin(datadir, 'data-%(tmin)s.mseed'))
+        filenames = util.select_files([datadir], show_progress=False)
+        assert len(filenames) == 3
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+        cache = p.get_data_cache()
+
+        nloads = []
+        for traces in p.chopper_grouped(lambda tr: tr.station):
+            nloads.append(cache.nmisses - sum(nloads))
+            assert len(set( tr.station for tr in traces )) == 1
+
+        assert nloads == [3, 0, 0]
+        assert not any( f.data_loaded for f in p.iter_files() )
+        shutil.rmtree(datadir)
+
+    def testChopperPartialReread(self):
+        import shutil
+        tmin = 1234567890
+        nsamples = 1000
+        datadir = makeManyFiles(30, nsamples, ['xx'], ['aaa', 'bbb'], ['n'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+
+        for traces in p.chopper(accessor_id='viewer', keep_current_files_open=True):
+            pass
+
+        files = list(p.iter_files())
+        assert all( file.data_use_count == 1 for file in files )
+
+        for traces in p.chopper(accessor_id='viewer', keep_current_files_open=True,
+                                group_selector=lambda gr: 'aaa' in gr.stations):
+            assert all( tr.station == 'aaa' for tr in traces )
+
+        assert all( file.data_use_count == 1 for file in files )
+
+        shutil.rmtree(datadir)
+
+    def testTimeIndex(self):
+        traces = []
+        for i in xrange(500):
+            tmin = random.uniform(0., 10000.)
+            n = random.randint(1, 1000)
+            traces.append(trace.Trace(station='%i' % i, tmin=tmin, deltat=1.0, ydata=num.ones(n)))
+
+        files = [ pile.MemTracesFile(None, [tr]) for tr in traces ]
+        index = pile.TimeIndex(files)
+        for f in files[::3]:
+            index.remove(f)
+
+        remaining = [ f for (i,f) in enumerate(files) if i % 3 != 0 ]
+        assert len(index) == len(remaining)
+        for i in xrange(100):
+            tmin = random.uniform(-1000., 11000.)
+            tmax = tmin + random.uniform(0., 2000.)
+            want = set([ f for f in remaining if f.is_relevant(tmin, tmax) ])
+            have = set(index.iter_overlapping(tmin, tmax))
+            assert want == have
+
+        # a removed long entry must not widen the search any longer
+        maxdur = index._maxdur
+        long_file = pile.MemTracesFile(None, [ trace.Trace(station='long', tmin=0., deltat=1.0, ydata=num.ones(100000)) ])
+        index.add(long_file)
+        assert index._maxdur > maxdur
+        index.remove(long_file)
+        assert index._maxdur == maxdur
+
+    def testListeners(self):
+
+        class Listener:
+            def __init__(self):
+                self.changes = []
+
+            def pile_changed(self, what, change):
+                self.changes.append((what, change))
+
+        from pyrocko import hamster_pile
+        p = hamster_pile.HamsterPile()
+        listener = Listener()
+        p.add_listener(listener)
+
+        f1 = pile.MemTracesFile(None, [ trace.Trace(station='A', tmin=0., deltat=1.0, ydata=num.ones(100)) ])
+        f2 = pile.MemTracesFile(None, [ trace.Trace(station='B', tmin=500., deltat=1.0, ydata=num.ones(100)) ])
+        p.add_files([f1, f2])
+        what, change = listener.changes[-1]
+        assert what == 'add'
+        assert change.nslc_ids == set([('', 'A', '', ''), ('', 'B', '', '')])
+        assert (change.tmin, change.tmax) == (0., 599.)
+        assert change.affects(('', 'A', '', ''), 50., 60.)
+        assert not change.affects(('', 'C', '', ''), 50., 60.)
+        assert not change.overlaps(700., 800.)
+
+        p.remove_file(f1)
+        what, change = listener.changes[-1]
+        assert what == 'remove'
+        assert change.nslc_ids == set([('', 'A', '', '')])
+        assert (change.tmin, change.tmax) == (0., 99.)
+
+        p.insert_trace(trace.Trace(station='C', tmin=1000., deltat=1.0, ydata=num.ones(10)))
+        p.insert_trace(trace.Trace(station='C', tmin=1010., deltat=1.0, ydata=num.ones(10)))
+        what, change = listener.changes[-1]
+        assert what == 'update'
+        assert change.nslc_ids == set([('', 'C', '', '')])
+        assert (change.tmin, change.tmax) == (1010., 1019.)
+
+        p.recursive_full_update()
+        what, change = listener.changes[-1]
+        assert what == 'fullupdate'
+        assert change.is_global() and change.affects(('', 'X', '', ''), 0., 1.)
+
+    def testWatch(self):
+        import shutil, time
+        from pyrocko import file_watcher
+
+        def mktrace(station, tmin):
+            return trace.Trace(station=station, tmin=tmin, deltat=1.0, ydata=num.ones(100, dtype=num.int32))
+
+        backends = ['polling']
+        try:
+            file_watcher.get_file_watcher([], backend='inotify').close()
+            backends.append('inotify')
+        except file_watcher.FileWatcherError:
+            pass
+
+        for backend in backends:
+            datadir = tempfile.mkdtemp()
+            fn_a, fn_b = pjoin(datadir, 'a.mseed'), pjoin(datadir, 'b.mseed')
+            io.save([ mktrace('A', 0.) ], fn_a)
+            io.save([ mktrace('B', 0.) ], fn_b)
+
+            p = pile.Pile()
+            p.load_files([fn_a, fn_b], show_progress=False)
+            p.watch(datadir, regex=r'\.mseed$', backend=backend)
+            assert not p.reload_modified()
+            assert not p.reload_modified()
+
+            time.sleep(1.1)
+            io.save([ mktrace('A', 1000.) ], fn_a)
+            os.unlink(fn_b)
+            os.mkdir(pjoin(datadir, 'sub'))
+            io.save([ mktrace('C', 0.) ], pjoin(datadir, 'sub', 'c.mseed'))
+            io.save([ mktrace('D', 0.) ], pjoin(datadir, 'sub', 'd.txt'))
+
+            assert p.reload_modified()
+            assert set(p.stations) == set(['A', 'C'])
+            assert p.tmax == 1099.
+            assert not p.reload_modified()
+
+            shutil.rmtree(pjoin(datadir, 'sub'))
+            assert p.reload_modified()
+            assert set(p.stations) == set(['A'])
+
+            p.unwatch()
+            shutil.rmtree(datadir)
+
+    def testDispatch(self):
+        files = []
+        for i in xrange(200):
+            tmin = random.randint(0, 100) * 8000.
+            tr = trace.Trace(network='N', station=rc(['A', 'B', 'C']), channel=rc(['Z', 'E']),
+                             tmin=tmin, deltat=1.0, ydata=num.ones(random.randint(1, 1000)))
+
+            files.append(pile.MemTracesFile(None, [tr]))
+
+        def chopped(p, tmin, tmax):
+            return sorted((tr.nslc_id, tr.tmin, tr.tmax) for tr in p.chop(tmin, tmax, load_data=False)[0])
+
+        ref = pile.Pile(dispatch='month')
+        ref.add_files(files)
+        windows = [ (tmin, tmin + random.uniform(0., 100000.)) for tmin in num.random.uniform(0, 800000, 10) ]
+        want = [ chopped(ref, tmin, tmax) for (tmin, tmax) in windows ]
+
+        for dispatch in ('day', 'station', 'station_month', 'station_day', pile.dispatch_by_month):
+            p = pile.Pile(dispatch=dispatch)
+            p.add_files(files)
+            assert [ chopped(p, tmin, tmax) for (tmin, tmax) in windows ] == want
+
+        assert len(p.subpiles) == 1
+        p.set_dispatch('station')
+        assert sorted(p.subpiles.keys()) == [ (('N', sta),) for sta in 'ABC' ]
+        assert [ chopped(p, tmin, tmax) for (tmin, tmax) in windows ] == want
+
+        for subpile in p.subpiles.values():
+            for (tmin, tmax) in windows:
+                want_nslc_ids = set()
+                for file in subpile.files:
+                    if file.overlaps(tmin, tmax):
+                        want_nslc_ids.update(file.nslc_ids)
+
+                assert want_nslc_ids <= subpile.relevant_nslc_ids(tmin, tmax)
+
+        self.assertRaises(ValueError, p.set_dispatch, 'year')
+
+    def testSelector(self):
+        import shutil
+        tmin = 1234567890
+        datadir = makeManyFiles(100, 100, ['N1', 'N2'], ['S1', 'S2', 'S3'], ['BHZ', 'LHZ'], tmin)
+        p = pile.make_pile(datadir, show_progress=False)
+        p.set_dispatch('station_day')
+
+        def ids(traces):
+            return sorted( (tr.nslc_id, tr.tmin, tr.tmax) for tr in traces )
+
+        for patterns in ('*.S1.*.*', ['N1.*.*.BHZ', 'N2.S3.*.*'], 'X.*.*.*'):
+            selector = util.NSLCSelector(patterns, tmin=tmin+1000, tmax=tmin+5000)
+            want = ids( tr for tr in p.iter_traces() if selector.match_trace(tr) )
+            assert ids(p.iter_traces(selector=selector)) == want
+
+            for wmin, wmax in ((tmin, tmin+10000), (tmin+2000, tmin+2500)):
+                chopped, used_files = p.chop(wmin, wmax, selector=selector)
+                chopped_ref, _ = p.chop(wmin, wmax, trace_selector=lambda tr: selector.match_trace(tr))
+                assert ids(chopped) == ids(chopped_ref)
+                for file in used_files:
+                    assert any( selector.match_nslc(nslc_id) for nslc_id in file.nslc_ids )
+                    file.drop_data()
+
+            nwindows = len(list(p.chopper(tmin, tmin+10000, tinc=1000, selector=selector)))
+            if patterns == 'X.*.*.*':
+                assert nwindows == 0
+
+        shutil.rmtree(datadir)
+
+    def testMMTraceFiles(self):
+        import shutil
+        tmin = 1234567890.
+        nsamples = 100000
+        datadir = tempfile.mkdtemp()
+        traces = []
+        for sta in ('A', 'B'):
+            ydata = num.random.randint(-1000, 1000, nsamples).astype(num.int32)
+            traces.append(trace.Trace('N', sta, '', 'Z', tmin=tmin, deltat=0.001, ydata=ydata))
+
+        io.save(traces, pjoin(datadir, '%(station)s.mmtr'), format='mmtrace')
+        p = pile.make_pile(datadir, fileformat='from_extension', show_progress=False)
+        p.set_data_cache_size(1000)
+        cache = p.get_data_cache()
+        for i in range(2):
+            chopped, used = p.chop(tmin+10., tmin+20.)
+            assert len(chopped) == 2
+            for tr in chopped:
+                want = [ t for t in traces if t.nslc_id == tr.nslc_id ][0].chop(tmin+10., tmin+20., inplace=False)
+                assert num.all(tr.ydata == want.ydata)
+                tr.ydata -= 1
+
+            for file in used:
+                file.drop_data()
+
+        assert cache.nbytes == 0
+        assert cache.nevictions == 0 and cache.nhits == 2
+        shutil.rmtree(datadir)
+
+    def testMMTraceFilesLimit(self):
+        import shutil, resource
+        tmin = 1234567890.
+        nfiles = 300
+        datadir = tempfile.mkdtemp()
+        traces = []
+        for i in xrange(nfiles):
+            traces.append(trace.Trace('N', 'S%i' % i, '', 'Z', tmin=tmin+i*100., deltat=1.0, 
+                                      ydata=num.ones(100, dtype=num.int32)))
+
+        io.save(traces, pjoin(datadir, '%(station)s.mmtr'), format='mmtrace')
+        p = pile.make_pile(datadir, fileformat='from_extension', show_progress=False)
+        p.get_data_cache().set_max_mapped(16)
+
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(128, hard), hard))
+        try:
+            stations = set()
+            for traces in p.chopper(tinc=100.):
+                stations.update( tr.station for tr in traces )
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+        assert len(stations) == nfiles
+        assert len([ f for f in p.iter_files() if f.data_loaded ]) <= 16
+        shutil.rmtree(datadir)
+
     def testMemTracesFile(self):
         tr = trace.Trace(ydata=num.arange(100,dtype=num.float))
         
@@ -83,7 +83,27 @@ class TraceTestCase(unittest.TestCase):
             for x in xs:
                 assert x.ydata.size == 18
                 assert numeq(x.ydata[8:10], res, 1e-6)
-                
+
+        for fill, res in (('interpolate', [2.,4.]), ('zeros', [0.,0.])):
+            a = trace.Trace(deltat=dt, ydata=num.zeros(10), tmin=100)
+            b = trace.Trace(deltat=dt, ydata=num.ones(10)*6., tmin=112)
+            xs = trace.degapper([a,b], fillmethod=fill)
+            assert len(xs) == 1
+            assert xs[0].ydata.size == 22
+            assert numeq(xs[0].ydata[10:12], res, 1e-6)
+
+        ydata = num.arange(10000, dtype=num.int32)
+        traces = []
+        for i in range(0, ydata.size, 100):
+            n = 110 if i % 300 == 0 else 100
+            traces.append(trace.Trace(deltat=dt, ydata=ydata[i:i+n], tmin=100+i))
+
+        traces.sort(key=lambda tr: tr.full_id)
+        xs = trace.degapper(traces)
+        assert len(xs) == 1
+        assert xs[0].tmin == 100 and xs[0].tmax == 100+ydata.size-1
+        assert num.all(xs[0].ydata == ydata)
+
 
 
 
@@ -195,7 +215,325 @@ class TraceTestCase(unittest.TestCase):
             t = trace.Trace(tmin=tmin, deltat=0.05, ydata=num.ones(n,dtype=num.float))
             t.bandpass_fft(0.1, 5.)
         d2 = time.time() - b
-        
+
+    def testFilterSOS(self):
+        from scipy import signal
+        # older scipy versions have sosfilt but not sosfiltfilt
+        sosfiltfilt = getattr(signal, 'sosfiltfilt', None)
+        if sosfiltfilt is not None:
+            zero_phases = (False, True)
+        else:
+            zero_phases = (False,)
+
+        deltat = 0.01
+        n = 20000
+        t = num.arange(n)*deltat
+        f = 0.05
+        ydata = num.sin(2.*num.pi*f*t) + num.sin(2.*num.pi*20.*t)
+
+        # in (b, a) form, this filter is unstable
+        tr_ba = trace.Trace(deltat=deltat, ydata=ydata.copy())
+        tr_ba.lowpass(8, 0.1)
+        assert not num.all(num.abs(tr_ba.ydata) < 2.)
+
+        for zero_phase in zero_phases:
+            tr = trace.Trace(deltat=deltat, ydata=ydata.copy())
+            tr.lowpass(8, 0.1, demean=False, sos=True, zero_phase=zero_phase)
+            assert num.all(num.isfinite(tr.ydata))
+            # low frequency sine passes
+            assert numeq(tr.ydata[n/2:].max(), 1., 0.05)
+            if zero_phase:
+                # ... without phase shift
+                assert numeq(tr.ydata[n/4:3*n/4], num.sin(2.*num.pi*f*t[n/4:3*n/4]), 0.05)
+
+        # well conditioned filters give the same results in both forms
+        for method in (lambda tr, **kw: tr.lowpass(4, 5., **kw),
+                       lambda tr, **kw: tr.highpass(4, 1., **kw),
+                       lambda tr, **kw: tr.bandpass(2, 1., 5., **kw)):
+
+            for zero_phase in zero_phases:
+                tr_ba = trace.Trace(deltat=deltat, ydata=ydata.copy())
+                tr_sos = trace.Trace(deltat=deltat, ydata=ydata.copy())
+                method(tr_ba, zero_phase=zero_phase)
+                method(tr_sos, sos=True, zero_phase=zero_phase)
+                assert numeq(tr_ba.ydata, tr_sos.ydata, 1e-6)
+
+        for zero_phase in zero_phases:
+            traces_a = [ trace.Trace(station=str(i), deltat=deltat, ydata=ydata*i) for i in range(3) ]
+            traces_b = [ tr.copy() for tr in traces_a ]
+            for tr in traces_a:
+                tr.bandpass(4, 0.02, 1., sos=True, zero_phase=zero_phase)
+
+            trace.filter_many(traces_b, 'band', 4, (0.02, 1.), sos=True, zero_phase=zero_phase)
+            for a, b in zip(traces_a, traces_b):
+                assert num.all(a.ydata == b.ydata)
+
+        if sosfiltfilt is not None:
+            del signal.sosfiltfilt
+
+        try:
+            tr = trace.Trace(deltat=deltat, ydata=ydata.copy())
+            self.assertRaises(trace.FilteringError, tr.lowpass, 4, 1., sos=True, zero_phase=True)
+            tr.lowpass(4, 1., sos=True)
+        finally:
+            if sosfiltfilt is not None:
+                signal.sosfiltfilt = sosfiltfilt
+
+    def testFilterChain(self):
+        deltat = 0.01
+        n = 10000
+        tmin = 1234567890.
+        ydata = num.random.random(n) + 100.
+
+        def make_chain(sos):
+            chain = trace.FilterChain(sos=sos)
+            chain.add_highpass(4, 0.5)
+            chain.add_downsample_to(0.05)
+            chain.add_lowpass(4, 4.)
+            return chain
+
+        for sos in (False, True):
+            tr_whole = trace.Trace('', 'STA', '', 'Z', tmin=tmin, deltat=deltat, ydata=ydata.copy())
+            result_whole = make_chain(sos).process([tr_whole])
+            assert len(result_whole) == 1
+            assert abs(tr_whole.tmin - tmin) < 1e-6 and tr_whole.deltat == 0.05
+
+            # chunks of lengths not divisible by the decimation factor
+            chain = make_chain(sos)
+            pieces = []
+            ibeg = 0
+            for nchunk in [ 1, 3, 777, 1234, 7 ] + [ 999 ]*20:
+                iend = min(n, ibeg+nchunk)
+                if ibeg == iend:
+                    break
+
+                tr = trace.Trace('', 'STA', '', 'Z', tmin=tmin+ibeg*deltat, deltat=deltat,
+                                 ydata=ydata[ibeg:iend].copy())
+                pieces.extend(chain.process([tr]))
+                ibeg = iend
+
+            for a, b in zip(pieces[:-1], pieces[1:]):
+                assert abs(b.tmin - (a.tmax + a.deltat)) < 1e-6
+
+            assert abs(pieces[0].tmin - tr_whole.tmin) < 1e-6
+            data = num.concatenate([ tr.ydata for tr in pieces ])
+            assert numeq(data, tr_whole.ydata, 1e-8)
+
+            # highpass in steady state removes the offset without transient
+            assert num.all(num.abs(tr_whole.ydata) < 1.)
+
+        # a gap restarts the filters
+        chain = make_chain(True)
+        tr1 = trace.Trace('', 'STA', '', 'Z', tmin=tmin, deltat=deltat, ydata=ydata[:5000].copy())
+        tr2 = trace.Trace('', 'STA', '', 'Z', tmin=tmin+6000*deltat, deltat=deltat, ydata=ydata[6000:].copy())
+        tr2_alone = tr2.copy()
+        chain.process([tr1, tr2])
+        make_chain(True).process([tr2_alone])
+        assert num.all(tr2.ydata == tr2_alone.ydata)
+        assert abs(tr2.tmin - tr2_alone.tmin) < 1e-6
+
+    def testTransferOverlapSave(self):
+        deltat = 0.01
+        n = 2**18
+        ydata = num.cumsum(num.random.normal(size=n))
+        tr = trace.Trace('', 'STA', '', 'Z', tmin=1234567890., deltat=deltat, ydata=ydata)
+        resp = trace.PoleZeroResponse([0j, 0j], [-0.1+0.1j, -0.1-0.1j], 1.)
+        freqlimits = (0.05, 0.1, 5., 8.)
+        tfade = 10.
+
+        nfir = trace._transfer_nfir(deltat, freqlimits)
+        assert not trace._use_overlap_save(n, nfir)
+        tr_fft = tr.transfer(tfade, freqlimits, resp)
+        min_samples = trace._overlap_save_min_samples
+        trace._overlap_save_min_samples = 1000
+        try:
+            assert trace._use_overlap_save(n, nfir)
+            tr_os = tr.transfer(tfade, freqlimits, resp)
+        finally:
+            trace._overlap_save_min_samples = min_samples
+
+        assert tr_os.ydata.size == tr_fft.ydata.size
+        assert tr_os.tmin == tr_fft.tmin
+        assert num.abs(tr_os.ydata - tr_fft.ydata).max() < 0.01 * num.abs(tr_fft.ydata).max()
+
+        # streaming, with the filter state carried across pieces
+        chain = trace.FilterChain()
+        chain.add_transfer(freqlimits, resp)
+        pieces = []
+        for ibeg in xrange(0, n, 3333):
+            piece = trace.Trace('', 'STA', '', 'Z', tmin=tr.tmin+ibeg*deltat, deltat=deltat,
+                                ydata=ydata[ibeg:ibeg+3333].copy())
+            pieces.extend(chain.process([piece]))
+
+        for a, b in zip(pieces[:-1], pieces[1:]):
+            assert abs(b.tmin - (a.tmax + a.deltat)) < 1e-6
+
+        tr_whole = tr.copy()
+        chain = trace.FilterChain()
+        chain.add_transfer(freqlimits, resp)
+        chain.process([tr_whole])
+        assert abs(tr_whole.tmin - pieces[0].tmin) < 1e-6
+        data = num.concatenate([ piece.ydata for piece in pieces ])
+        assert numeq(data, tr_whole.ydata, 1e-6 * num.abs(data).max())
+
+        chain = trace.FilterChain()
+        chain.add_transfer((0., 0., 5., 8.))
+        self.assertRaises(trace.FilteringError, chain.process, [tr.copy()])
+
+    def testBandpassFFTOverlapSave(self):
+        deltat = 0.01
+        n = 2**18
+        t = num.arange(n)*deltat
+        ydata = num.sin(2.*num.pi*3.*t) + num.sin(2.*num.pi*0.3*t)
+        tr = trace.Trace(deltat=deltat, ydata=ydata)
+        corner_hp, corner_lp = 1., 10.
+
+        nfir = trace.nextpow2(10./(corner_hp*deltat))
+        tr_fft = tr.copy()
+        tr_fft.bandpass_fft(corner_hp, corner_lp)
+        min_samples = trace._overlap_save_min_samples
+        trace._overlap_save_min_samples = 1000
+        try:
+            assert trace._use_overlap_save(n, nfir)
+            tr_os = tr.copy()
+            tr_os.bandpass_fft(corner_hp, corner_lp)
+        finally:
+            trace._overlap_save_min_samples = min_samples
+
+        assert tr_os.ydata.size == n
+
+        # away from the ends, both agree and keep only the 3 Hz component
+        want = num.sin(2.*num.pi*3.*t)[nfir:-nfir]
+        for data in (tr_fft.ydata, tr_os.ydata):
+            assert num.abs(data[nfir:-nfir] - want).max() < 0.05
+
+        # within nfir/2 samples of the ends, the single FFT wraps around
+        # while overlap-save treats the data as zero outside the trace
+        assert num.abs(tr_os.ydata[:nfir/2] - tr_fft.ydata[:nfir/2]).max() > 0.05
+
+    def testNextFastLen(self):
+        def is_5smooth(n):
+            for p in (2, 3, 5):
+                while n % p == 0:
+                    n /= p
+            return n == 1
+
+        for i in range(1, 2000):
+            n = trace.nextfastlen(i)
+            assert n >= i and is_5smooth(n)
+            assert not any(is_5smooth(j) for j in range(i, n))
+
+        assert trace.nextfastlen(1025) == 1080
+        assert trace.nextfastlen(1200.5) == 1215
+
+    def testOddPaddedLength(self):
+        deltat = 0.01
+        for n in (1001, 1002, 1003):
+            assert trace.nextfastlen(n*1.2) % 2 == 1
+            t = num.arange(n)*deltat
+            ydata = num.sin(2.*num.pi*5.*t)
+            tr = trace.Trace(deltat=deltat, ydata=ydata)
+            tr2 = tr.transfer(1., (0.5, 1., 20., 30.), cut_off_fading=False)
+            assert tr2.ydata.size == n
+            assert num.abs(tr2.ydata - ydata)[200:-200].max() < 1e-3
+
+        tr = trace.Trace(deltat=deltat, ydata=num.random.normal(size=1215))
+        assert trace.nextfastlen(1215) == 1215
+        tr.bandpass_fft(1., 5.)
+        assert tr.ydata.size == 1215
+
+    def testTransferCached(self):
+        nevaluate = [0]
+        class CountingResponse(trace.PoleZeroResponse):
+            def evaluate(self, freqs):
+                nevaluate[0] += 1
+                return trace.PoleZeroResponse.evaluate(self, freqs)
+
+        class UncachedResponse(trace.FrequencyResponse):
+            def evaluate(self, freqs):
+                nevaluate[0] += 1
+                return trace.FrequencyResponse.evaluate(self, freqs)
+
+        ydata = num.random.normal(size=1000)
+        freqlimits = (0.01, 0.02, 2., 4.)
+
+        def restitute(resp):
+            return [ trace.Trace(tmin=i*1000., deltat=0.1, ydata=ydata).transfer(5., freqlimits, resp)
+                     for i in range(3) ]
+
+        # fresh response objects with equal parameters share the cache
+        outputs = restitute(CountingResponse([], [], 1.)) + restitute(CountingResponse([], [], 1.))
+        assert nevaluate[0] == 1
+        for tr in outputs[1:]:
+            assert num.all(tr.ydata == outputs[0].ydata)
+            assert tr.ydata.flags.writeable
+
+        # changing a response must not give stale results
+        resp = CountingResponse([], [], 1.)
+        resp.constant = 10.
+        assert num.allclose(restitute(resp)[0].ydata, outputs[0].ydata*10.)
+        assert nevaluate[0] == 2
+
+        # responses without a cache key are evaluated every time
+        nevaluate[0] = 0
+        restitute(UncachedResponse())
+        assert nevaluate[0] == 3
+
+        assert trace.Trace(deltat=0.1, ydata=ydata)._get_cached_freqs(10, 0.1).flags.writeable == False
+        assert trace.cached_tapered_coefs.get_nbytes() <= trace.cached_tapered_coefs.maxbytes
+
+    def testFilterMany(self):
+        def mktraces():
+            traces = []
+            for i, (deltat, n) in enumerate([(0.01, 1000)]*5 + [(0.01, 777), (0.05, 1000), (0.05, 1000), (0.1, 0)]):
+                num.random.seed(i)
+                ydata = num.random.randint(-1000, 1000, n).astype(num.int32)
+                traces.append(trace.Trace(station='S%i' % i, tmin=sometime+i*0.0123, deltat=deltat, ydata=ydata))
+
+            return traces
+
+        def check(traces_a, traces_b):
+            for a, b in zip(traces_a, traces_b):
+                assert (a.nslc_id, a.tmin, a.tmax, a.deltat) == (b.nslc_id, b.tmin, b.tmax, b.deltat)
+                assert a.ydata.dtype == b.ydata.dtype
+                assert num.all(a.ydata == b.ydata)
+
+        for btype, order, corners, method in [
+                ('low', 4, 2., lambda tr: tr.lowpass(4, 2.)),
+                ('high', 4, 0.5, lambda tr: tr.highpass(4, 0.5)),
+                ('band', 2, (0.5, 2.), lambda tr: tr.bandpass(2, 0.5, 2.)) ]:
+
+            traces_a, traces_b = mktraces(), mktraces()
+            for tr in traces_a:
+                method(tr)
+
+            trace.filter_many(traces_b, btype, order, corners)
+            check(traces_a, traces_b)
+            assert all( tr.ydata.base is None for tr in traces_b )
+
+        # empty traces cannot be downsampled
+        traces_a, traces_b = mktraces()[:-1], mktraces()[:-1]
+        for tr in traces_a:
+            tr.downsample(2, snap=True)
+
+        trace.downsample_many(traces_b, 2, snap=True)
+        check(traces_a, traces_b)
+        assert all( tr.ydata.base is None for tr in traces_b )
+
+        traces_a, traces_b = mktraces()[:-1], mktraces()[:-1]
+        traces_a.append(trace.Trace(station='X', tmin=sometime, deltat=0.03, ydata=num.ones(1000)))
+        traces_b.append(traces_a[-1].copy())
+        failed_a = []
+        for tr in traces_a:
+            try:
+                tr.downsample_to(0.1, snap=True)
+            except util.UnavailableDecimation:
+                failed_a.append(tr.nslc_id)
+
+        failed_b = trace.downsample_to_many(traces_b, 0.1, snap=True)
+        assert failed_a == [ tr.nslc_id for (tr, e) in failed_b ] == [ ('', 'X', '', '') ]
+        check(traces_a[:-1], traces_b[:-1])
+
     def testCropping(self):
         n = 20
         tmin = sometime
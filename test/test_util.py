@@ -1,5 +1,6 @@
 from pyrocko import mseed, trace, util, io
 import unittest, math, calendar, time
+import numpy as num
 from random import random
 
 class UtilTestCase( unittest.TestCase ):
@@ -35,6 +36,58 @@ class UtilTestCase( unittest.TestCase ):
         assert s1 == '2001-12-01 00:00:00.000'
         assert s2 == '2002-01-01 00:00:00.000'
 
+    def testLRUCache(self):
+        cache = util.LRUCache(maxsize=10)
+        for i in range(10):
+            cache[i] = i*2
+
+        assert len(cache) == 10
+        for i in range(5):
+            assert cache[i] == i*2
+
+        cache[10] = 20
+        assert len(cache) <= 10
+        for i in range(5) + [10]:
+            assert i in cache
+
+        assert 5 not in cache
+        assert cache.get(5) is None and cache.get(5, -1) == -1
+        self.assertRaises(KeyError, lambda: cache[5])
+        cache.clear()
+        assert len(cache) == 0
+
+        cache = util.LRUCache(maxsize=100, maxbytes=8000)
+        for i in range(20):
+            cache[i] = num.zeros(100)
+
+        assert 0 < cache.get_nbytes() <= 8000
+        assert 19 in cache and 0 not in cache
+        assert cache.get_nbytes() == sum([ cache[k].nbytes for k in range(20) if k in cache ])
+
+        # values larger than the limit are not stored
+        cache['big'] = num.zeros(2000)
+        assert 'big' not in cache
+
+    def testNSLCSelector(self):
+
+        sel = util.NSLCSelector(['GR.*.*.BH?', '*.HAM3.*.*'], tmin=100., tmax=200.)
+        assert sel.match_nslc(('GR', 'BFO', '', 'BHZ'))
+        assert sel.match_nslc(('XX', 'HAM3', '', 'HHZ'))
+        assert not sel.match_nslc(('XX', 'BFO', '', 'BHZ'))
+        assert util.match_nslc(sel, ('GR', 'BFO', '', 'BHN'))
+        assert util.match_nslcs(sel, [('GR', 'BFO', '', 'BHN'), ('GR', 'BFO', '', 'LHN')]) == [('GR', 'BFO', '', 'BHN')]
+
+        tr = trace.Trace('GR', 'BFO', '', 'BHZ', tmin=150., deltat=1., ydata=num.zeros(10))
+        assert sel.match_trace(tr)
+        tr.shift(100.)
+        assert not sel.match_trace(tr)
+
+        sel = util.NSLCSelector(nslc_ids=[('GR', 'BFO', '', 'BHZ')])
+        assert sel.match_nslc(('GR', 'BFO', '', 'BHZ'))
+        assert not sel.match_nslc(('GR', 'BFO', '', 'BHN'))
+        assert sel == util.NSLCSelector(nslc_ids=set([('GR', 'BFO', '', 'BHZ')]))
+        assert sel != util.NSLCSelector(nslc_ids=[('GR', 'BFO', '', 'BHN')])
+
 if __name__ == "__main__":
     util.setup_logging('test_util', 'warning')
     unittest.main()